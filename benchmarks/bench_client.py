@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+    HyperCycleClient benchmark against a local stand-in node.
+
+    Starts pyhypercycle_aim.local_node in a subprocess and measures signing
+    cost, per-call client overhead, throughput under concurrency and
+    websocket streaming rates. No live node or Ethereum RPC is needed.
+
+        python benchmarks/bench_client.py [--calls 500] [--verify]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from pyhypercycle_aim.hypercycle_client import HyperCycleClient, AsyncHyperCycleClient, RequestBody, \
+    client_config
+
+PK = "0x" + "42" * 32
+
+
+def rate(func, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_node(port, verify):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    cmd = [sys.executable, "-m", "pyhypercycle_aim.local_node", "--port", str(port)]
+    if not verify:
+        cmd.append("--no-verify")
+    proc = subprocess.Popen(cmd, env=env)
+    for _ in range(200):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/info", timeout=1)
+            return proc
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("local node did not start")
+
+
+def latency_ms(func, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def bench_signing(seconds):
+    from eth_account import Account
+    print(f"{'signing':<44} {'ops/s':>10}")
+    print(f"{'  derive account (uncached)':<44} {rate(lambda: Account.from_key(PK), seconds):>10.1f}")
+    print(f"{'  derive account (cached)':<44} {rate(lambda: HyperCycleClient._account(PK), seconds):>10.1f}")
+    headers = {"tx-sender": HyperCycleClient._account(PK).address, "tx-nonce": "1", "tx-driver": "ethereum"}
+    body = RequestBody(b"x" * 1024)
+
+    def sign():
+        message = HyperCycleClient.form_protocol_v2_message(headers, "POST", "/aim/1/echo", body)
+        HyperCycleClient.sign_message(message['message'], None, PK)
+    print(f"{'  form + sign ProtocolV2 message':<44} {rate(sign, seconds):>10.1f}")
+
+    data = os.urandom(64 * 1024 * 1024)
+    start = time.perf_counter()
+    RequestBody(data)
+    print(f"{'  hash 64 MiB bytes body (MiB/s)':<44} {64 / (time.perf_counter() - start):>10.1f}")
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        from pathlib import Path
+        start = time.perf_counter()
+        RequestBody(Path(f.name)).close()
+        print(f"{'  hash 64 MiB file body, mmap (MiB/s)':<44} {64 / (time.perf_counter() - start):>10.1f}")
+
+
+def bench_calls(node, calls):
+    session = requests.Session()
+    print(f"\n{'per call, sequential':<44} {'p50 ms':>10} {'p99 ms':>8}")
+    rows = [
+        ("  raw requests GET /info (baseline)", lambda: session.get(f"http://{node}/info").text),
+        ("  public call", lambda: HyperCycleClient.call(node, PK, 1, "GET", "/echo", is_public=True)),
+        ("  signed GET", lambda: HyperCycleClient.call(node, PK, 1, "GET", "/echo")),
+        ("  signed POST, 1 KiB body", lambda: HyperCycleClient.call(node, PK, 1, "POST", "/echo",
+                                                                   body=b"x" * 1024)),
+        ("  cost quote from cached manifest", lambda: HyperCycleClient.quote(node, 1, "/echo")),
+    ]
+    for label, func in rows:
+        func()
+        p50, p99 = latency_ms(func, calls)
+        print(f"{label:<44} {p50:>10.2f} {p99:>8.2f}")
+
+
+def bench_throughput(node, calls):
+    print(f"\n{'throughput, signed GET via call_many':<44} {'req/s':>10}")
+    for concurrency in [1, 8, 32]:
+        requests_ = [dict(node=node, pk=PK, aim_slot=1, method="GET", uri="/echo")] * calls
+
+        async def run():
+            start = time.perf_counter()
+            await AsyncHyperCycleClient.call_many(requests_, concurrency=concurrency)
+            return calls / (time.perf_counter() - start)
+        label = f"  concurrency {concurrency}"
+        print(f"{label:<44} {asyncio.run(run()):>10.1f}")
+
+
+def drive(gen, reply):
+    count = 0
+    try:
+        item = next(gen)
+        while True:
+            count += 1
+            item = gen.send(reply)
+    except StopIteration:
+        return count
+
+
+def bench_websocket(node, frames):
+    print(f"\n{'websocket':<44} {'rate':>10}")
+    call = lambda: drive(HyperCycleClient.call(node, PK, 1, "websocket", "/run", body='{"partials": 0}'), "ok")
+    call()
+    p50, p99 = latency_ms(call, 200)
+    print(f"{'  call on a reused session (ms p50)':<44} {p50:>10.2f}")
+
+    body = f'{{"partials": {frames}}}'
+    start = time.perf_counter()
+    drive(HyperCycleClient.call(node, PK, 1, "websocket", "/run", body=body), "ok")
+    print(f"{'  partial JSON frames (frames/s)':<44} {frames / (time.perf_counter() - start):>10.1f}")
+
+    size = 256 * 1024
+    body = f'{{"partials": {frames // 10}, "size": {size}, "binary": true}}'
+    start = time.perf_counter()
+    drive(HyperCycleClient.call(node, PK, 1, "websocket", "/run", body=body), "ok")
+    mib = frames // 10 * size / (1024 * 1024)
+    print(f"{'  binary 256 KiB frames (MiB/s)':<44} {mib / (time.perf_counter() - start):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HyperCycleClient benchmark")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--verify", action="store_true", help="Have the node check signatures.")
+    args = parser.parse_args()
+
+    port = free_port()
+    node = f"127.0.0.1:{port}"
+    proc = start_node(port, args.verify)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        client_config["cache_dir"] = cache_dir
+        client_config["seed_hosts"] = [node]
+        try:
+            bench_signing(args.seconds)
+            bench_calls(node, args.calls)
+            bench_throughput(node, args.calls)
+            bench_websocket(node, args.frames)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
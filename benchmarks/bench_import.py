@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+    Import-time benchmark for pyhypercycle_aim.
+
+    Each statement runs in a fresh interpreter, so the numbers are cold-start
+    import costs. Also reports which heavy dependencies each import pulled in.
+
+        python benchmarks/bench_import.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = [
+    "import pyhypercycle_aim",
+    "from pyhypercycle_aim import StorageManager",
+    "from pyhypercycle_aim import SubscriptionManager",
+    "from pyhypercycle_aim import DiskSpaceManager",
+    "from pyhypercycle_aim import SimpleServer",
+    "import pyhypercycle_aim.hypercycle_client",
+]
+
+HEAVY_MODULES = ["starlette", "uvicorn", "web3", "eth_account", "requests", "websocket"]
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"elapsed": elapsed,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_once(statement):
+    code = PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.check_output([sys.executable, "-c", code], env=env)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyhypercycle_aim import benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'statement':<52} {'median ms':>10} {'min ms':>8}  heavy modules loaded")
+    for statement in STATEMENTS:
+        samples = []
+        loaded = []
+        for _ in range(args.runs):
+            try:
+                res = run_once(statement)
+            except subprocess.CalledProcessError:
+                samples = None
+                break
+            samples.append(res['elapsed']*1000)
+            loaded = res['loaded']
+        if samples is None:
+            print(f"{statement:<52} {'failed (missing dependency?)':>20}")
+            continue
+        print(f"{statement:<52} {statistics.median(samples):>10.1f} {min(samples):>8.1f}  "
+              f"{', '.join(loaded) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+    SSH key generation benchmark for SSHPortManager.
+
+    Compares in-process generation (generate_keypair) with spawning
+    ssh-keygen as allow_access used to, and times formatting a batch of
+    authorized_keys lines as allow_access_many does.
+
+        python benchmarks/bench_ssh_keygen.py [--seconds 2]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from pyhypercycle_aim.ssh_port_manager import SSHPortManager, generate_keypair
+
+
+def rate(func, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def ssh_keygen(key_type, tmp_dir):
+    path = os.path.join(tmp_dir, "key")
+    cmd = ["ssh-keygen", "-q", "-t", key_type, "-N", "", "-f", path]
+    if key_type == "rsa":
+        cmd[4:4] = ["-b", "2048"]
+    subprocess.check_output(cmd)
+    open(path).read()
+    open(path + ".pub").read()
+    os.remove(path)
+    os.remove(path + ".pub")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSH key generation benchmark")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'method':<36} {'keys/s':>10}")
+    print(f"{'in-process ed25519':<36} {rate(lambda: generate_keypair('ed25519'), args.seconds):>10.1f}")
+    print(f"{'in-process rsa-2048':<36} {rate(lambda: generate_keypair('rsa'), args.seconds):>10.1f}")
+
+    if shutil.which("ssh-keygen"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for key_type in ["ed25519", "rsa"]:
+                label = f"ssh-keygen subprocess {key_type}"
+                print(f"{label:<36} {rate(lambda: ssh_keygen(key_type, tmp_dir), args.seconds):>10.1f}")
+    else:
+        print("ssh-keygen not found, skipping subprocess comparison")
+
+    public_keys = [generate_keypair()[1] for _ in range(1000)]
+    start = time.perf_counter()
+    "".join(SSHPortManager._authorized_key_line(key, ports=[8000, 8001]) for key in public_keys)
+    elapsed = time.perf_counter() - start
+    print(f"{'authorized_keys lines (batch of 1000)':<36} {1000/elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,35 @@
-from pyhypercycle_aim.exceptions import *
-from pyhypercycle_aim.util import *
-from pyhypercycle_aim.servers import *
-from pyhypercycle_aim.subscription import *
-from pyhypercycle_aim.storage import *
-from pyhypercycle_aim.disks import *
-from pyhypercycle_aim.ssh_port_manager import *
+import importlib
+
+#Submodules are imported on first attribute access (PEP 562), so e.g.
+#`from pyhypercycle_aim import StorageManager` does not pull in starlette,
+#and nothing touches the filesystem until a manager is used.
+_exports = {
+    "exceptions": ["AppException", "SubscriptionError", "SSHPortManagerError", "DiskError"],
+    "util": ["aim_uri", "to_async", "JSONResponseCORS", "HTMLResponseCORS", "FileResponseCORS",
+             "handle_interrupt", "install_interrupt_handler", "HTML_404_PAGE", "HTML_500_PAGE",
+             "not_found", "server_error", "default_exception_handlers", "manifest_response",
+             "manifest_etag"],
+    "servers": ["BaseServer", "SimpleServer", "SimpleQueue", "AsyncQueue", "ExampleUsageSimple"],
+    "subscription": ["SubscriptionManager"],
+    "storage": ["StorageManager"],
+    "disks": ["DiskSpaceManager"],
+    "ssh_port_manager": ["SSHPortManager", "SSH_USER_HOME", "SSH_USER", "SSH_AUTH_KEYS",
+                         "SSHD_CONFIG", "INIT_MARKER_FILE", "SSH_KEY_REGISTRY"],
+}
+
+_name_to_module = {name: module for module, names in _exports.items() for name in names}
+
+__all__ = list(_name_to_module)
+
+
+def __getattr__(name):
+    module = _name_to_module.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
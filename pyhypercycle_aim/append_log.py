@@ -0,0 +1,101 @@
+import os
+import json
+from pathlib import Path
+from filelock import FileLock
+
+
+class AppendLog:
+    """
+        Append-only JSON lines log shared between processes.
+        Writers append under a FileLock, readers tail the file from the last
+        offset they have seen. `rewrite` compacts the log by atomically
+        replacing the file, which readers detect and reload from scratch.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = None
+        self._lock_pid = None
+        self._inode = None
+        self._offset = 0
+
+    def exists(self):
+        return self.path.exists()
+
+    def loaded(self):
+        #True once read_new has seen the file
+        return self._inode is not None
+
+    def lock(self):
+        #FileLocks cannot be used across fork, so each process makes its own
+        if self._lock_pid != os.getpid():
+            self._lock = FileLock(f"{self.path}.lock")
+            self._lock_pid = os.getpid()
+        return self._lock
+
+    def append(self, records):
+        data = "".join(json.dumps(r) + "\n" for r in records)
+        if not data:
+            return
+        with self.lock():
+            with open(self.path, "a+b") as f:
+                #end a line torn by a writer killed mid-append, or it would
+                #swallow our first record
+                end = os.fstat(f.fileno()).st_size
+                if end and os.pread(f.fileno(), 1, end-1) != b"\n":
+                    data = "\n" + data
+                f.write(data.encode())
+
+    def rewrite(self, records):
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with self.lock():
+            with open(tmp_path, "w") as f:
+                for r in records:
+                    f.write(json.dumps(r) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def read_new(self):
+        """
+            Returns (reset, records). `reset` is True when the log was
+            replaced since the last read and callers must drop their state
+            before applying `records`.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._reset_missing()
+        if st.st_ino == self._inode and st.st_size == self._offset:
+            return False, []
+
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return self._reset_missing()
+        with f:
+            #stat the open file, the path may have been replaced meanwhile
+            st = os.fstat(f.fileno())
+            reset = False
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                reset = True
+                self._inode = st.st_ino
+                self._offset = 0
+            f.seek(self._offset)
+            data = f.read()
+        #only consume complete lines, a writer may be mid-append
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                #left by a writer killed mid-line; the records after it are fine
+                print(f"Skipping malformed line in {self.path}: {line[:80]!r}")
+        self._offset += end
+        return reset, records
+
+    def _reset_missing(self):
+        reset = self._inode is not None
+        self._inode = None
+        self._offset = 0
+        return reset, []
@@ -1,81 +1,290 @@
 import subprocess
 import os
+import json
+import time
+import re
+import uuid
+import asyncio
+import threading
+import collections
+import concurrent.futures
 from filelock import FileLock
 from pyhypercycle_aim.exceptions import DiskError
 
-os.makedirs("/container_mount/virtual_disks", exist_ok=True)
-os.makedirs("/container_mount/disk_mounts", exist_ok=True)
+VIRTUAL_DISKS_DIR = "/container_mount/virtual_disks"
+DISK_MOUNTS_DIR = "/container_mount/disk_mounts"
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+
+
+def _unescape_mount(path):
+    #mountinfo escapes space, tab, newline and backslash as octal
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
 
 class DiskSpaceManager:
     @classmethod
-    def update_disks(cls):
-        for fn in os.listdir("/container_mount/virtual_disks"):
+    def init(cls, background=True, max_workers=8):
+        """
+            Creates the disk directories and remounts existing disks, in a
+            background thread unless `background` is False. Call once at
+            startup; importing the module has no side effects.
+        """
+        cls._ensure_dirs()
+        if background:
+            return cls.start_update_disks(max_workers=max_workers)
+        return cls.update_disks(max_workers=max_workers)
+
+    @classmethod
+    def _ensure_dirs(cls):
+        os.makedirs(VIRTUAL_DISKS_DIR, exist_ok=True)
+        os.makedirs(DISK_MOUNTS_DIR, exist_ok=True)
+
+    @classmethod
+    def update_disks(cls, max_workers=8):
+        """
+            Mounts every disk that is not mounted yet. The mount table is read
+            once and mounts run concurrently, at most `max_workers` at a time.
+            Returns {"mounted": [disk_id, ...], "failed": {disk_id: error}}.
+        """
+        cls._ensure_dirs()
+        mounts = cls._read_mounts()
+        missing = []
+        for fn in os.listdir(VIRTUAL_DISKS_DIR):
             if fn.endswith(".iso") and fn.startswith("disk_"):
                 disk_id = fn.partition("disk_")[2].rpartition(".iso")[0]
-                if not cls.is_mounted(disk_id):
-                    cls._mount_disk(disk_id)
+                if disk_id.isalnum() and not cls.is_mounted(disk_id, mounts):
+                    missing.append(disk_id)
+
+        result = {"mounted": [], "failed": {}}
+        if not missing:
+            return result
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(cls._mount_disk, disk_id): disk_id for disk_id in missing}
+            for future in concurrent.futures.as_completed(futures):
+                disk_id = futures[future]
+                try:
+                    future.result()
+                    result['mounted'].append(disk_id)
+                except Exception as e:
+                    result['failed'][disk_id] = str(e)
+        return result
+
+    @classmethod
+    def start_update_disks(cls, max_workers=8):
+        """
+            Runs update_disks in a background thread.
+        """
+        thread = threading.Thread(target=cls.update_disks, kwargs={"max_workers": max_workers},
+                                  daemon=True)
+        thread.start()
+        return thread
 
     @classmethod
-    def is_mounted(cls, disk_id):
+    def _read_mounts(cls):
+        """
+            Returns {mount_point: source} parsed from /proc/self/mountinfo.
+        """
+        mounts = {}
+        with open(MOUNTINFO_PATH) as f:
+            for line in f:
+                fields = line.split()
+                #the optional fields end at "-", followed by fstype and source
+                sep = fields.index("-")
+                mount_point = _unescape_mount(fields[4])
+                mounts[mount_point] = _unescape_mount(fields[sep+2])
+        return mounts
+
+    @classmethod
+    def is_mounted(cls, disk_id, mounts=None):
         if not disk_id.isalnum():
             raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
-   
-        mp = f"/container_mount/disk_mounts/{disk_id}"
-        cmd = f"findmnt --target {mp}"
-        res = os.split(b'\n')[1].split()
-        if res[1] == b'/container_mount/virtual_disks/disk_{disk_id}.iso':
+
+        if mounts is None:
+            mounts = cls._read_mounts()
+        vd = f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso"
+        source = mounts.get(f"{DISK_MOUNTS_DIR}/{disk_id}")
+        if source is None:
+            return False
+        if source == vd:
             return True
+        if source.startswith("/dev/loop"):
+            #loop mounts report the loop device, check what it is backed by
+            try:
+                backing = open(f"/sys/block/{os.path.basename(source)}/loop/backing_file").read()
+            except OSError:
+                return True
+            return backing.strip() == vd
         return False
 
+    ALLOCATION_POLICIES = ("sparse", "fallocate", "zero")
+
+    #seconds a finished provisioning job stays visible to get_provision_job
+    job_retention = 3600
+
+    _jobs = {}
+    _jobs_mutex = threading.Lock()
+
+    @classmethod
+    def add_disk(cls, block_size, count, disk_id, max_usage=None, allocation="sparse",
+                 lazy_init=True):
+        """
+            Creates, formats and mounts a virtual disk.
+            `allocation` is one of:
+              "sparse"    - size the file without allocating blocks (instant)
+              "fallocate" - reserve all blocks up front without writing them
+              "zero"      - write zeros over the whole disk (slow)
+            `lazy_init` lets mkfs.ext4 defer inode table and journal init.
+        """
+        size = cls._reserve_disk(block_size, count, disk_id, max_usage, allocation)
+        job = cls._new_job(disk_id)
+        cls._provision(job, disk_id, size, allocation, lazy_init)
+        if job['status'] == "failed":
+            raise DiskError(job['error'])
+
     @classmethod
-    def add_disk(cls, block_size, count, disk_id, max_usage=None):
+    def provision_disk(cls, block_size, count, disk_id, max_usage=None, allocation="sparse",
+                       lazy_init=True):
+        """
+            Like add_disk, but only validates and reserves the disk before
+            returning a job id. Allocation, formatting and mounting continue
+            in a background thread; poll them with get_provision_job. Jobs
+            are forgotten `job_retention` seconds after they finish.
+        """
+        size = cls._reserve_disk(block_size, count, disk_id, max_usage, allocation)
+        job = cls._new_job(disk_id)
+        threading.Thread(target=cls._provision, args=(job, disk_id, size, allocation, lazy_init),
+                         daemon=True).start()
+        return job['job_id']
+
+    @classmethod
+    def get_provision_job(cls, job_id):
+        with cls._jobs_mutex:
+            job = cls._jobs.get(job_id)
+            return dict(job) if job else None
+
+    @classmethod
+    def list_provision_jobs(cls):
+        with cls._jobs_mutex:
+            return [dict(job) for job in cls._jobs.values()]
+
+    @classmethod
+    def _new_job(cls, disk_id):
+        now = time.time()
+        job = {"job_id": uuid.uuid4().hex, "disk_id": disk_id, "status": "queued",
+               "progress": 0.0, "error": None, "started": now, "finished": None}
+        with cls._jobs_mutex:
+            for job_id, old in list(cls._jobs.items()):
+                if old['finished'] is not None and now - old['finished'] > cls.job_retention:
+                    del cls._jobs[job_id]
+            cls._jobs[job['job_id']] = job
+        return job
+
+    @classmethod
+    def _update_job(cls, job, **kwargs):
+        with cls._jobs_mutex:
+            job.update(kwargs)
+
+    @classmethod
+    def _reserve_disk(cls, block_size, count, disk_id, max_usage, allocation):
         if not disk_id.isalnum():
             raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
+        if allocation not in cls.ALLOCATION_POLICIES:
+            raise DiskError(f"Invalid allocation {allocation}, must be one of {cls.ALLOCATION_POLICIES}.")
+        if type(count) != int or count < 0:
+            raise DiskError(f"'count' must be a positive integer.")
+
+        size = 0
+        if block_size == "1K":
+            size = count*1024
+        elif block_size == "1M":
+            size = count*(1024*1024)
+        else:
+            raise DiskError(f"Invalid block size {block_size}, must be either '1K' or '1M'.")
 
-        os.makedirs(f"/container_mount/disk_mounts/{disk_id}", exist_ok=True)
-              
-        vd = f"/container_mount/virtual_disks/disk_{disk_id}.iso"
-        lock = FileLock(f"{vd}.lock", timeout=60*20)#20 minute timeout
-        with lock:
+        cls._ensure_dirs()
+        vd = f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso"
+        #only held while checking and reserving, not while formatting
+        with cls._ledger_lock():
             if os.path.exists(vd):
                 raise DiskError(f"Disk {disk_id} already exists.")
-            if type(count) != int or count < 0:
-                raise DiskError(f"'count' must be a positive integer.")
-
-            size = 0
-            if block_size == "1K":
-                size = count*1024
-            elif block_size == "1M":
-                size = count*(1024*1024)
-            else:
-                raise DiskError(f"Invalid block size {block_size}, must be either '1K' or '1M'.")
-
-            total_used = cls.list_disks()['total']
-            if max_usage is None or total_used+size <= max_usage:
-                cmd = f"dd if=/dev/zero of={vd} bs={block_size} count={count}"
-                subprocess.check_output(cmd, shell=True)
-
-                cmd = f"mkfs.ext4 {vd}"
-                subprocess.check_output(cmd, shell=True)
-                cls._mount_disk(disk_id)
-            else:
+            ledger = cls._read_ledger()
+            if max_usage is not None and ledger['total_allocated']+size > max_usage:
                 raise DiskError("Not enough space remaining.")
-     
+            with open(vd, "xb") as f:
+                f.truncate(size)
+            ledger['disks'][disk_id] = {"allocated": size, "actual": cls._actual_bytes(vd)}
+            cls._write_ledger(ledger)
+        os.makedirs(f"{DISK_MOUNTS_DIR}/{disk_id}", exist_ok=True)
+        return size
+
+    @classmethod
+    def _provision(cls, job, disk_id, size, allocation, lazy_init):
+        vd = f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso"
+        try:
+            cls._update_job(job, status="allocating")
+            if allocation == "fallocate":
+                fd = os.open(vd, os.O_WRONLY)
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                finally:
+                    os.close(fd)
+            elif allocation == "zero":
+                chunk = bytes(1024*1024)
+                written = 0
+                with open(vd, "r+b") as f:
+                    while written < size:
+                        written += f.write(chunk[:size-written])
+                        cls._update_job(job, progress=0.8*written/size)
+            cls._update_job(job, status="formatting", progress=0.8)
+
+            cmd = ["mkfs.ext4", "-q", "-F"]
+            options = []
+            if lazy_init:
+                options.append("lazy_itable_init=1,lazy_journal_init=1")
+            if allocation != "sparse":
+                #mkfs would otherwise discard (punch out) the blocks just allocated
+                options.append("nodiscard")
+            if options:
+                cmd += ["-E", ",".join(options)]
+            subprocess.check_output(cmd + [vd], stderr=subprocess.STDOUT)
+            cls._update_job(job, status="mounting", progress=0.9)
+
+            cls._mount_disk(disk_id)
+            cls._update_ledger_actual(disk_id)
+            cls._update_job(job, status="done", progress=1.0, finished=time.time())
+        except Exception as e:
+            if isinstance(e, subprocess.CalledProcessError) and e.output:
+                e = e.output.decode(errors="replace").strip()
+            with cls._ledger_lock():
+                try:
+                    os.remove(vd)
+                except FileNotFoundError:
+                    pass
+                ledger = cls._read_ledger()
+                ledger['disks'].pop(disk_id, None)
+                cls._write_ledger(ledger)
+            cls._update_job(job, status="failed", error=str(e), finished=time.time())
+
     @classmethod
     def _mount_disk(cls, disk_id):
         if not disk_id.isalnum():
             raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
    
-        cmd = f"mount /container_mount/virtual_disks/disk_{disk_id}.iso /container_mount/disk_mounts/{disk_id}"
-        subprocess.check_outut(cmd, shell=True)
+        mp = f"{DISK_MOUNTS_DIR}/{disk_id}"
+        os.makedirs(mp, exist_ok=True)
+        try:
+            subprocess.check_output(["mount", f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso", mp],
+                                    stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            raise DiskError(f"Mounting disk {disk_id} failed: {e.output.decode(errors='replace').strip()}")
 
     @classmethod
     def _unmount_disk(cls, disk_id):
         if not disk_id.isalnum():
             raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
    
-        cmd = f"umount /container_mount/disk_mounts/{disk_id}"
-        subprocess.check_outut(cmd, shell=True)
+        cmd = f"umount {DISK_MOUNTS_DIR}/{disk_id}"
+        subprocess.check_output(cmd, shell=True)
 
     @classmethod
     def remove_disk(cls, disk_id):
@@ -83,18 +292,272 @@ class DiskSpaceManager:
             raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
    
         cls._unmount_disk(disk_id)
-        os.remove(f"/container_mount/disk_mounts/{disk_id}")
-        os.remove(f"/container_mount/virtual_disks/disk_{disk_id}.iso")
+        os.rmdir(f"{DISK_MOUNTS_DIR}/{disk_id}")
+        with cls._ledger_lock():
+            os.remove(f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso")
+            ledger = cls._read_ledger()
+            ledger['disks'].pop(disk_id, None)
+            cls._write_ledger(ledger)
 
     @classmethod
     def list_disks(cls):
-        ll = []
-        total = 0
-        for fn in os.listdir("/container_mount/virtual_disks/"):
-            vd = f"/container_mount/virtual_disks/{fn}"
-            size = os.path.getsize(fn)
-            total += size
-            ll.append((fn.partition("_")[2].rpartition(".iso")[0], size))
-        return {"total": total, "disks": ll}
-
-DiskSpaceManager.update_disks()
+        ledger = cls._read_ledger()
+        ll = [(disk_id, entry['allocated']) for disk_id, entry in sorted(ledger['disks'].items())]
+        return {"total": ledger['total_allocated'], "total_actual": ledger['total_actual'],
+                "disks": ll}
+
+    @classmethod
+    def disk_usage(cls, disk_id):
+        """
+            Allocated and backing-store bytes of a disk from the ledger, plus
+            the space used inside its filesystem when it is mounted.
+        """
+        if not disk_id.isalnum():
+            raise DiskError(f"Invalid disk_id {disk_id}: must be alpha-numeric.")
+        entry = cls._read_ledger()['disks'].get(disk_id)
+        if entry is None:
+            raise DiskError(f"Disk {disk_id} does not exist.")
+        usage = dict(entry)
+        mp = f"{DISK_MOUNTS_DIR}/{disk_id}"
+        if os.path.ismount(mp):
+            st = os.statvfs(mp)
+            usage['fs_size'] = st.f_blocks*st.f_frsize
+            usage['fs_used'] = (st.f_blocks-st.f_bfree)*st.f_frsize
+            usage['fs_free'] = st.f_bavail*st.f_frsize
+        return usage
+
+    ##########################
+    # Usage ledger
+    #
+    # /container_mount/virtual_disks/ledger.json keeps the allocated size and
+    # the blocks actually used on the host (st_blocks) of every disk, plus
+    # running totals, so quota checks do not stat every disk file.
+    ##########################
+    _ledger_path = f"{VIRTUAL_DISKS_DIR}/ledger.json"
+    _ledger_locks = {}
+
+    @classmethod
+    def _ledger_lock(cls):
+        #one instance per path and process, so nested use is reentrant and
+        #forked children do not reuse the parent's FileLock
+        path = f"{cls._ledger_path}.lock"
+        key = (path, os.getpid())
+        if key not in cls._ledger_locks:
+            cls._ledger_locks[key] = FileLock(path, timeout=60)
+        return cls._ledger_locks[key]
+
+    @classmethod
+    def _actual_bytes(cls, vd):
+        return os.stat(vd).st_blocks*512
+
+    @classmethod
+    def _read_ledger(cls):
+        try:
+            with open(cls._ledger_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return cls.reconcile_ledger()
+
+    @classmethod
+    def _write_ledger(cls, ledger):
+        ledger['total_allocated'] = sum(e['allocated'] for e in ledger['disks'].values())
+        ledger['total_actual'] = sum(e['actual'] for e in ledger['disks'].values())
+        tmp_path = f"{cls._ledger_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(ledger, f)
+        os.replace(tmp_path, cls._ledger_path)
+
+    @classmethod
+    def _update_ledger_actual(cls, disk_id):
+        vd = f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso"
+        with cls._ledger_lock():
+            ledger = cls._read_ledger()
+            if disk_id in ledger['disks']:
+                ledger['disks'][disk_id]['actual'] = cls._actual_bytes(vd)
+                cls._write_ledger(ledger)
+
+    @classmethod
+    def reconcile_ledger(cls):
+        """
+            Rebuilds the ledger from the disk files on the filesystem.
+        """
+        cls._ensure_dirs()
+        with cls._ledger_lock():
+            ledger = {"disks": {}}
+            for fn in os.listdir(VIRTUAL_DISKS_DIR):
+                if fn.endswith(".iso") and fn.startswith("disk_"):
+                    disk_id = fn.partition("disk_")[2].rpartition(".iso")[0]
+                    if not disk_id.isalnum():
+                        #not one of ours, e.g. a stray file
+                        continue
+                    st = os.stat(f"{VIRTUAL_DISKS_DIR}/{fn}")
+                    ledger['disks'][disk_id] = {"allocated": st.st_size,
+                                                "actual": st.st_blocks*512}
+            cls._write_ledger(ledger)
+            return ledger
+
+    ##########################
+    # Usage sampling
+    #
+    # sample_usage records filesystem usage (statvfs on the mount point) and
+    # host backing-store usage (st_blocks of the disk file) for every disk,
+    # keeps the last `usage_history` samples per disk and calls the limit
+    # callbacks when a disk crosses `soft_threshold` / `hard_threshold`.
+    ##########################
+    usage_interval = 30
+    usage_history = 120
+    soft_threshold = 0.8
+    hard_threshold = 0.95
+
+    _usage_samples = {}
+    _usage_levels = {}
+    _usage_mutex = threading.Lock()
+
+    @classmethod
+    def sample_usage(cls):
+        """
+            Takes one usage sample of every disk. Returns {disk_id: sample}.
+        """
+        now = time.time()
+        mounts = cls._read_mounts()
+        samples = {}
+        #stat the disks without the lock, a slow filesystem must not hold up
+        #add_disk and remove_disk
+        for disk_id, entry in cls._read_ledger()['disks'].items():
+            if not disk_id.isalnum():
+                #left by an older reconcile_ledger, would fail every sample
+                continue
+            vd = f"{VIRTUAL_DISKS_DIR}/disk_{disk_id}.iso"
+            try:
+                actual = cls._actual_bytes(vd)
+            except FileNotFoundError:
+                continue
+            sample = {"time": now, "allocated": entry['allocated'], "actual": actual,
+                      "mounted": cls.is_mounted(disk_id, mounts)}
+            if sample['mounted']:
+                st = os.statvfs(f"{DISK_MOUNTS_DIR}/{disk_id}")
+                used = (st.f_blocks-st.f_bfree)*st.f_frsize
+                avail = st.f_bavail*st.f_frsize
+                sample['fs_size'] = st.f_blocks*st.f_frsize
+                sample['fs_used'] = used
+                sample['fs_free'] = avail
+                #same as df: reserved blocks count as unavailable
+                sample['fs_fraction'] = used/(used+avail) if used+avail else 0.0
+            samples[disk_id] = sample
+        #keep the ledger's host usage current while we have it
+        with cls._ledger_lock():
+            ledger = cls._read_ledger()
+            for disk_id, sample in samples.items():
+                #skip disks removed meanwhile
+                if disk_id in ledger['disks']:
+                    ledger['disks'][disk_id]['actual'] = sample['actual']
+            cls._write_ledger(ledger)
+
+        alerts = []
+        with cls._usage_mutex:
+            for disk_id in list(cls._usage_samples):
+                if disk_id not in samples:
+                    del cls._usage_samples[disk_id]
+                    cls._usage_levels.pop(disk_id, None)
+            for disk_id, sample in samples.items():
+                history = cls._usage_samples.get(disk_id)
+                if history is None or history.maxlen != cls.usage_history:
+                    history = collections.deque(history or (), maxlen=cls.usage_history)
+                    cls._usage_samples[disk_id] = history
+                history.append(sample)
+
+                fraction = sample.get('fs_fraction')
+                if fraction is None:
+                    continue
+                level = "ok"
+                if fraction >= cls.hard_threshold:
+                    level = "hard"
+                elif fraction >= cls.soft_threshold:
+                    level = "soft"
+                previous = cls._usage_levels.get(disk_id, "ok")
+                cls._usage_levels[disk_id] = level
+                #only alert when a disk crosses into a higher level
+                if level == "hard" and previous != "hard":
+                    alerts.append((cls.hard_limit_callback, disk_id, sample))
+                elif level == "soft" and previous == "ok":
+                    alerts.append((cls.soft_limit_callback, disk_id, sample))
+
+        for callback, disk_id, sample in alerts:
+            try:
+                callback(disk_id, sample)
+            except Exception as e:
+                print(f"Disk usage callback {callback.__name__}({disk_id}) failed: {e!r}")
+        return samples
+
+    @classmethod
+    async def usage_loop(cls):
+        """
+            Samples disk usage every `usage_interval` seconds. Add to a
+            server's on_startup like SubscriptionManager.subscription_loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, cls.sample_usage)
+            except Exception as e:
+                print(f"Disk usage sampling failed: {e!r}")
+            await asyncio.sleep(cls.usage_interval)
+
+    @classmethod
+    def start_usage_sampler(cls):
+        """
+            Runs the usage sampler in a daemon thread, for non-async callers.
+        """
+        def run():
+            while True:
+                try:
+                    cls.sample_usage()
+                except Exception as e:
+                    print(f"Disk usage sampling failed: {e!r}")
+                time.sleep(cls.usage_interval)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def get_usage_history(cls, disk_id):
+        with cls._usage_mutex:
+            return list(cls._usage_samples.get(disk_id, ()))
+
+    @classmethod
+    def usage_metrics(cls):
+        """
+            Latest sample and alert level of every disk.
+        """
+        with cls._usage_mutex:
+            return {disk_id: dict(history[-1], level=cls._usage_levels.get(disk_id, "ok"))
+                    for disk_id, history in cls._usage_samples.items() if history}
+
+    @classmethod
+    def usage_metrics_text(cls):
+        """
+            Latest samples in Prometheus text exposition format.
+        """
+        metrics = [("allocated", "aim_disk_allocated_bytes", "Size of the virtual disk."),
+                   ("actual", "aim_disk_backing_bytes", "Host blocks used by the disk file."),
+                   ("fs_used", "aim_disk_fs_used_bytes", "Bytes used inside the filesystem."),
+                   ("fs_free", "aim_disk_fs_free_bytes", "Bytes available inside the filesystem.")]
+        latest = cls.usage_metrics()
+        lines = []
+        for field, name, help_text in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for disk_id, sample in sorted(latest.items()):
+                if field in sample:
+                    lines.append(f'{name}{{disk="{disk_id}"}} {sample[field]}')
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def soft_limit_callback(cls, disk_id, sample):
+        #override to act on a disk crossing soft_threshold
+        print(f"Disk {disk_id} is {sample['fs_fraction']:.0%} full (soft limit).")
+
+    @classmethod
+    def hard_limit_callback(cls, disk_id, sample):
+        #override to act on a disk crossing hard_threshold
+        print(f"Disk {disk_id} is {sample['fs_fraction']:.0%} full (hard limit).")
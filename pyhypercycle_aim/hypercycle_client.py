@@ -1,22 +1,34 @@
+import os
 import sys
 import json
-import requests
-from websocket import create_connection, WebSocketConnectionClosedException
 import pprint
 import time
+import random
 import re
 import hashlib
-from web3 import Web3
-from eth_account import Account
-from eth_account.messages import encode_defunct
 import argparse
+import io
+import mmap
+import tempfile
+import asyncio
+import threading
+import functools
+import collections
+import concurrent.futures
+from filelock import FileLock
+
+#requests, web3, eth_account and websocket are imported where they are used,
+#so importing this module (e.g. for message formatting) stays cheap.
 
 
 client_config = {
     "seed_hosts": ["3.17.97.74:8000"],
     "driver": "ethereum",
     "rpc_provider": "https://eth.llamarpc.com",
-    "network": "mainnet"
+    "network": "mainnet",
+    "cache_dir": "~/.hypercycle",
+    #concurrent requests the client runs: pooled connections and worker threads
+    "max_connections": 32
 }
 
 currencies = {"ethereum": {
@@ -32,7 +44,239 @@ chains = {"ethereum": {"chain_id": 1},
 erc20_abi = json.loads("""[{"constant": true, "inputs": [], "name": "name", "outputs": [{"name": "", "type": "string"}], "payable": false, "stateMutability": "view", "type": "function"}, {"constant": false, "inputs": [{"name": "_spender", "type": "address"}, {"name": "_value", "type": "uint256"}], "name": "approve", "outputs": [{"name": "", "type": "bool"}], "payable": false, "stateMutability": "nonpayable", "type": "function"}, {"constant": true, "inputs": [], "name": "totalSupply", "outputs": [{"name": "", "type": "uint256"}], "payable": false, "stateMutability": "view", "type": "function"}, {"constant": false, "inputs": [{"name": "_from", "type": "address"}, {"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}], "name": "transferFrom", "outputs": [{"name": "", "type": "bool"}], "payable": false, "stateMutability": "nonpayable", "type": "function"}, {"constant": true, "inputs": [], "name": "decimals", "outputs": [{"name": "", "type": "uint8"}], "payable": false, "stateMutability": "view", "type": "function"}, {"constant": true, "inputs": [{"name": "_owner", "type": "address"}], "name": "balanceOf", "outputs": [{"name": "balance", "type": "uint256"}], "payable": false,  "stateMutability": "view", "type": "function"}, {"constant": true, "inputs": [], "name": "symbol", "outputs": [{"name": "", "type": "string"}], "payable": false, "stateMutability": "view", "type": "function"}, {"constant": false, "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}], "name": "transfer","outputs": [{"name": "","type": "bool"}],"payable": false,"stateMutability": "nonpayable","type": "function"},{"constant": true,"inputs": [{"name": "_owner","type": "address"},{"name": "_spender","type": "address"}],"name": "allowance","outputs": [{"name": "","type": "uint256"}],"payable": false,"stateMutability": "view","type": "function"},{"payable": true, "stateMutability": "payable", "type": "fallback"},{"anonymous": false,"inputs": [{"indexed": true,"name": "owner","type": "address"},{"indexed": true,"name": "spender","type": "address"},{"indexed": false,"name": "value","type": "uint256"}],"name": "Approval","type": "event"},{"anonymous": false,"inputs": [{"indexed": true,"name": "from","type": "address"},{"indexed": true,"name": "to","type": "address"},{"indexed": false,"name": "value","type": "uint256"}], "name": "Transfer", "type": "event"}]""")
 
 
+@functools.lru_cache(maxsize=32)
+def _account_from_key(pk):
+    from eth_account import Account
+    return Account.from_key(pk)
+
+
+#Client state shared between CLI runs (nonces, node table, ...) is kept as
+#JSON files in client_config["cache_dir"], written under a file lock.
+_cache_locks = {}
+_cache_locks_mutex = threading.Lock()
+
+
+def _reset_cache_locks_after_fork():
+    #FileLocks inherited across fork cannot be used, the child makes new ones
+    global _cache_locks_mutex
+    _cache_locks.clear()
+    _cache_locks_mutex = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_cache_locks_after_fork)
+
+
+def _max_connections():
+    #sizes the per-node connection pools and the client's thread pools alike
+    return client_config.get("max_connections", 32)
+
+
+def _cache_path(name):
+    cache_dir = os.path.expanduser(client_config.get("cache_dir", "~/.hypercycle"))
+    return os.path.join(cache_dir, name)
+
+
+def _cache_lock(path):
+    #one FileLock object per path, so nested use in a process is reentrant
+    with _cache_locks_mutex:
+        lock = _cache_locks.get(path)
+        if lock is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock = FileLock(path + ".lock")
+            _cache_locks[path] = lock
+    return lock
+
+
+def _read_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_cache(path, state):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class RequestBody:
+    """
+        Body of an AIM call. bytes and str are used as is. File paths
+        (os.PathLike), file objects and iterators of bytes are hashed in
+        chunks, or through mmap for paths, and streamed on upload, so a large
+        body is never held in memory. Iterators, text-mode and non-seekable
+        files are spooled to a temporary file first (str as UTF-8), as the
+        hash has to be signed before anything is sent.
+    """
+    chunk_size = 1 << 20
+
+    def __init__(self, body):
+        self._file = None
+        self._owns_file = False
+        self._start = 0
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if body is None or isinstance(body, (bytes, bytearray, memoryview)):
+            self._data = body
+            self.size = memoryview(body).nbytes if body is not None else 0
+            self._digest = hashlib.sha256(body).hexdigest() if self.size else None
+        elif isinstance(body, os.PathLike):
+            self._data = None
+            self._file = open(body, "rb")
+            self._owns_file = True
+            self.size = os.fstat(self._file.fileno()).st_size
+            self._digest = self._hash_mapped(self._file) if self.size else None
+        elif hasattr(body, "read") and not self._is_text(body) and self._seekable(body):
+            self._data = None
+            self._file = body
+            self._start = body.tell()
+            self._digest, self.size = self._hash_chunks(self._read_chunks(body))
+            body.seek(self._start)
+        else:
+            #text-mode files are spooled too, so the UTF-8 bytes that were
+            #hashed are the ones sent
+            if hasattr(body, "read"):
+                body = self._read_chunks(body)
+            self._data = None
+            self._file = tempfile.TemporaryFile()
+            self._owns_file = True
+            self._digest, self.size = self._hash_chunks(body, spool=self._file)
+            self._file.seek(0)
+
+    @classmethod
+    def _read_chunks(cls, f):
+        #stops on any empty chunk, text-mode files return "" at EOF
+        while chunk := f.read(cls.chunk_size):
+            yield chunk
+
+    @staticmethod
+    def _is_text(f):
+        return isinstance(f, io.TextIOBase) or "b" not in getattr(f, "mode", "b")
+
+    @staticmethod
+    def _seekable(f):
+        try:
+            return f.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+    @staticmethod
+    def _hash_mapped(f):
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha256(m).hexdigest()
+
+    @staticmethod
+    def _hash_chunks(chunks, spool=None):
+        h = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            h.update(chunk)
+            size += len(chunk)
+            if spool is not None:
+                spool.write(chunk)
+        return (h.hexdigest() if size else None), size
+
+    def __len__(self):
+        return self.size
+
+    def hexdigest(self):
+        return self._digest
+
+    def data(self):
+        """
+            Returns what to send: the bytes, or the file rewound to the start
+            of the body so requests streams it.
+        """
+        if self._file is None:
+            return self._data
+        self._file.seek(self._start)
+        return self._file
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+
 class HyperCycleClient:
+    """
+        Client for HyperCycle nodes.
+        HTTP sessions (one keep-alive connection pool per node, holding up
+        to client_config["max_connections"]), the Web3 provider and accounts
+        derived from private keys are cached on the class and shared by all
+        calls.
+    """
+    #seconds to connect / to wait for a response
+    connect_timeout = 5
+    read_timeout = 60
+    #retries of calls that are safe to repeat, with jittered exponential backoff
+    retries = 2
+    retry_backoff = 0.2
+    #hedge calls that don't pay (cost-only and public) unless told otherwise
+    hedge_free_calls = False
+    #hedge delay until enough latencies are recorded to estimate the p95
+    hedge_delay = 1.0
+    hedge_min_samples = 20
+
+    _sessions = {}
+    _latencies = {}
+    _hedge_executor = None
+    _web3_providers = {}
+    _cache_mutex = threading.Lock()
+
+    @classmethod
+    def _session(cls, node):
+        session = cls._sessions.get(node)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            with cls._cache_mutex:
+                session = cls._sessions.get(node)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_max_connections())
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    cls._sessions[node] = session
+        return session
+
+    @classmethod
+    def _timeout(cls, timeout=None):
+        #(connect, read) seconds; a single number is used for both
+        if timeout is None:
+            return (cls.connect_timeout, cls.read_timeout)
+        if isinstance(timeout, (int, float)):
+            return (timeout, timeout)
+        return tuple(timeout)
+
+    @classmethod
+    def _web3(cls):
+        rpc_provider = client_config.get("rpc_provider")
+        w3 = cls._web3_providers.get(rpc_provider)
+        if w3 is None:
+            from web3 import Web3
+            with cls._cache_mutex:
+                w3 = cls._web3_providers.setdefault(rpc_provider,
+                                                    Web3(Web3.HTTPProvider(rpc_provider)))
+        return w3
+
+    @classmethod
+    def _account(cls, pk):
+        return _account_from_key(pk)
+
+    @classmethod
+    def close(cls):
+        """Closes all pooled connections."""
+        with cls._cache_mutex:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
     @classmethod
     def _get_currency(cls, currency):
         driver = client_config.get("driver")
@@ -46,8 +290,9 @@ class HyperCycleClient:
 
     @classmethod
     def sign_message(cls, message, sender, pk):
+        from eth_account.messages import encode_defunct
         encoded_message = encode_defunct(text=message)
-        signed_message = Account.sign_message(encoded_message, pk)
+        signed_message = cls._account(pk).sign_message(encoded_message)
         return signed_message.signature.hex()
 
     @classmethod
@@ -79,8 +324,10 @@ class HyperCycleClient:
         assert 'tx-nonce' in {k.lower() for k in message_headers.keys()}
 
         if body:
-            print([body])
-            hash_body = cls._hash_blob(body)
+            if isinstance(body, RequestBody):
+                hash_body = body.hexdigest()
+            else:
+                hash_body = cls._hash_blob(body)
             message += f"hash-body: {hash_body}"
         return {"message": message, "valid": valid}
 
@@ -92,13 +339,13 @@ class HyperCycleClient:
     @classmethod
     def list_nodes(cls):
         for seed_host in client_config['seed_hosts']:
-            res = requests.get(f"http://{seed_host}/nodes").json()
+            res = cls._session(seed_host).get(f"http://{seed_host}/nodes", timeout=cls._timeout()).json()
             return res['nodes']
             break
 
     @classmethod
     def node_info(cls, node, timeout=20):
-        res = requests.get(f"http://{node}/info", timeout=timeout).json()
+        res = cls._session(node).get(f"http://{node}/info", timeout=timeout).json()
         return res
  
     @classmethod
@@ -106,14 +353,14 @@ class HyperCycleClient:
         node_data = cls.node_info(node)
         driver = node_data['tm']['driver']
         hotwallet_address = node_data['tm']['address']
-        w3 = Web3(Web3.HTTPProvider(client_config.get("rpc_provider")))
+        w3 = cls._web3()
         currency_type = cls._get_currency(currency)
         chain_id = cls._get_chain_id(currency)
         erc20_instance = w3.eth.contract(address=currency_type, abi=erc20_abi)
         
-        client_address = w3.eth.account.from_key(pk)
+        client_address = cls._account(pk).address
         nonce = w3.eth.get_transaction_count(client_address)
-        built_txn = self.erc20_instance.functions.transfer(hotwallet_address, amount).build_transaction({
+        built_txn = erc20_instance.functions.transfer(hotwallet_address, amount).build_transaction({
             "chainId": chain_id,  # sepolia
             "gas": 70000,  #
             "maxFeePerGas": w3.to_wei('2', 'gwei'),
@@ -124,7 +371,7 @@ class HyperCycleClient:
         signed_hash = signed_txn.hash
         print("sending")
         w3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        txid = w3.to_hex(self.w3.keccak(signed_txn.rawTransaction))
+        txid = w3.to_hex(w3.keccak(signed_txn.rawTransaction))
         print("txid:", txid)
         cls.resume_deposit(node, txid, client_address, currency)
         return txid
@@ -133,118 +380,837 @@ class HyperCycleClient:
     def resume_deposit(cls, node, txid, sender, currency, driver):
         driver = client_config['driver']
         headers = {"tx-id": txid, "tx-sender":sender, 'currency-type': currency_type, 'tx-driver': driver}
-        res = requests.post(f"http://{node}/balance", "",  headers=headers).json()
+        res = cls._session(node).post(f"http://{node}/balance", "",  headers=headers,
+                                      timeout=cls._timeout()).json()
         return res
 
     @classmethod
     def get_balance(cls, node, address=None, pk=None, driver=None):
         if not address:        
-            w3 = Web3(Web3.HTTPProvider(client_config.get("rpc_provider")))
-            address = w3.eth.account.from_key(pk)
+            address = cls._account(pk).address
         headers = {'tx-sender': address, "tx-driver": driver}
 
-        res = requests.get(f"http://{node}/balance", headers=headers).json()
+        res = cls._session(node).get(f"http://{node}/balance", headers=headers, timeout=cls._timeout()).json()
         return res
 
     @classmethod
-    def get_manifest(cls, node, aim_slot):
-        res = requests.get(f"http://{node}/aim/{aim_slot}/manifest.json").text
-        #print(res)
-        return res
+    def get_manifest(cls, node, aim_slot, refresh=False):
+        return ManifestCache.get(node, aim_slot, refresh=refresh)
+
+    @classmethod
+    def quote(cls, node, aim_slot, uri, method="POST", size=0):
+        return ManifestCache.quote(node, aim_slot, uri, method=method, size=size)
 
     @classmethod
-    def call(cls, node, pk, aim_slot, method, uri, headers, body=None, protocol_version="2", driver="ethereum", cost_only=False, is_public=False):
+    def call(cls, node, pk, aim_slot, method, uri, headers=None, body=None, protocol_version="2", driver="ethereum", cost_only=False, is_public=False, timeout=None, hedge=None):
+        """
+            Calls an AIM endpoint. `body` may be a dict (sent as JSON), str,
+            bytes, a file path (os.PathLike), a file object or an iterator
+            of bytes; see RequestBody.
+
+            `timeout` is (connect, read) seconds. With `hedge`, a duplicate is
+            sent to the next best node serving the slot if `node` has not
+            answered within its p95 latency, and the first answer wins. It
+            defaults to `hedge_free_calls` for cost-only and public calls and
+            to off for paid calls, as a hedged paid call may be charged twice.
+        """
         gen = cls._call(node, pk, aim_slot, method, uri, headers, body, protocol_version, 
-                        driver, cost_only, is_public)
-        if method in ["get", "post"]:
-            try:
-                result = next(gen)
-            except StopIteration as e:
-                return e.value
-        else:
+                        driver, cost_only, is_public, timeout)
+        if method.lower() not in ["get", "post"]:
             return gen
+        if hedge is None:
+            hedge = cls.hedge_free_calls and (cost_only or is_public)
+        if hedge and not isinstance(body, (type(None), str, bytes, dict)):
+            #a streamed body can only be read once
+            hedge = False
+        if not hedge:
+            return cls._result(gen)
+
+        def attempt(target):
+            if target == node:
+                return cls._result(gen)
+            return cls._result(cls._call(target, pk, aim_slot, method, uri, headers, body, protocol_version,
+                                         driver, cost_only, is_public, timeout))
+        return cls._hedged(node, aim_slot, attempt)
+
+    @classmethod
+    def _result(cls, gen):
+        try:
+            next(gen)
+        except StopIteration as e:
+            return e.value
+
+    @classmethod
+    def _record_latency(cls, node, elapsed):
+        samples = cls._latencies.get(node)
+        if samples is None:
+            samples = cls._latencies.setdefault(node, collections.deque(maxlen=200))
+        samples.append(elapsed)
+        NodeDiscovery.record(node, rtt=elapsed)
+
+    @classmethod
+    def _hedge_after(cls, node):
+        samples = sorted(cls._latencies.get(node, ()))
+        if len(samples) < cls.hedge_min_samples:
+            return cls.hedge_delay
+        return samples[int(len(samples) * 0.95)]
+
+    @classmethod
+    def _hedged(cls, node, aim_slot, attempt):
+        if cls._hedge_executor is None:
+            with cls._cache_mutex:
+                if cls._hedge_executor is None:
+                    cls._hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=_max_connections(), thread_name_prefix="hypercycle-hedge")
+        primary = cls._hedge_executor.submit(attempt, node)
+        try:
+            return primary.result(timeout=cls._hedge_after(node))
+        except concurrent.futures.TimeoutError:
+            pass
+        #never wait for discovery here, the call is already late
+        backups = [n for n in NodeDiscovery.ranked_nodes(aim=aim_slot, cached=True) if n != node]
+        if not backups:
+            return primary.result()
+        pending = {primary, cls._hedge_executor.submit(attempt, backups[0])}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
 
     @classmethod
-    def _call(cls, node, pk, aim_slot, method, uri, headers, body=None, protocol_version="2", driver="ethereum", cost_only=False, is_public=False):
-        #get user nonce
-        w3 = Web3(Web3.HTTPProvider(client_config.get("rpc_provider")))
-        sender = w3.eth.account.from_key(pk).address
+    def _can_retry(cls, error, free):
+        import requests
+        if free:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        #a paid call is only repeated if it never reached the node
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+            from urllib3.exceptions import NewConnectionError
+            return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+        return False
+
+    @classmethod
+    def _backoff(cls, attempt):
+        return cls.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    @classmethod
+    def _fetch_nonce(cls, node, sender):
+        nobj = cls._session(node).get(f"http://{node}/nonce", headers={'sender': sender},
+                                      timeout=cls._timeout()).json()
+        return nobj['nonce']
+
+    @classmethod
+    def _nonce_rejected(cls, res):
+        return res.status_code in (400, 401, 403, 409) and "nonce" in res.text.lower()
+
+    @classmethod
+    def _base_headers(cls, sender, headers, driver, protocol_version, cost_only, is_public):
+        base_headers = {"tx-id": "", "tx-sender":sender, 'tx-origin': sender,
+                        'currency-type': "USDC", "spend_order": "USDC,HyPC",
+                        'tx-max-spend': (headers or {}).get("tx-max-spend",''),
+                        'tx-driver': driver, 'tx-protocol': protocol_version}
+        if cost_only:
+            base_headers['cost_only'] = "1"
+            base_headers['cost-only'] = "1"
+        if is_public:
+            base_headers['isPublic'] = "1"
+        return base_headers
+
+    @classmethod
+    def _sign_headers(cls, node, sender, pk, method, uri_path, base_headers, request_body, protocol_version):
+        headers = dict(base_headers)
+        if 'isPublic' in headers:
+            return headers
+        nonce = NonceManager.allocate(node, sender, lambda: cls._fetch_nonce(node, sender))
+        headers['tx-nonce'] = nonce
+        if protocol_version == "1":
+            sig = cls.sign_message(nonce, sender, pk)
+        else:
+            message = cls.form_protocol_v2_message(headers, method, uri_path, request_body)
+            sig = cls.sign_message(message['message'], sender, pk)
+        headers['tx-signature'] = sig
+        return headers
+
+    @classmethod
+    def _call(cls, node, pk, aim_slot, method, uri, headers, body=None, protocol_version="2", driver="ethereum", cost_only=False, is_public=False, timeout=None):
+        sender = cls._account(pk).address
         
         if isinstance(body, dict):
             body = json.dumps(body)
-        
-        nobj = requests.get(f"http://{node}/nonce", headers={'sender': sender}).json()
-        nonce = nobj['nonce']
+
         #form request:
-        headers = {"tx-id": "", "tx-sender":sender, 'tx-origin': sender,
-                   'currency-type': "USDC", "spend_order": "USDC,HyPC",
-                   'tx-max-spend': headers.get("tx-max-spend",''),
-                   'tx-driver': driver, 'tx-protocol': protocol_version}
-        if cost_only:
-            headers['cost_only'] = "1"
-            headers['cost-only'] = "1"
-        if is_public:
-            headers['isPublic'] = "1"
+        base_headers = cls._base_headers(sender, headers, driver, protocol_version, cost_only, is_public)
+
+        if method.lower() == "websocket":
+            ws_session = WebSocketSession.acquire(node, pk, aim_slot, uri, base_headers, protocol_version)
+            try:
+                return (yield from ws_session.stream(body, timeout))
+            finally:
+                ws_session.release()
+
+        import requests
+        session = cls._session(node)
+        request_body = body if isinstance(body, RequestBody) else RequestBody(body)
+        free = cost_only or is_public
+        try:
+            attempt = 0
+            nonce_retried = False
+            while True:
+                headers = cls._sign_headers(node, sender, pk, method, f"/aim/{aim_slot}{uri}", base_headers,
+                                            request_body, protocol_version)
+                start = time.perf_counter()
+                try:
+                    res = session.request(method.upper(), f"http://{node}/aim/{aim_slot}{uri}", headers=headers,
+                                          data=request_body.data() if method.lower() == "post" else None,
+                                          timeout=timeout or cls._timeout())
+                except requests.exceptions.RequestException as e:
+                    NodeDiscovery.record(node, error=True)
+                    if attempt >= cls.retries or not cls._can_retry(e, free):
+                        raise
+                else:
+                    cls._record_latency(node, time.perf_counter() - start)
+                    if not is_public and not nonce_retried and cls._nonce_rejected(res):
+                        #another client used the nonce; resync and retry once
+                        nonce_retried = True
+                        NonceManager.invalidate(node, sender)
+                        continue
+                    if not free or res.status_code not in (502, 503, 504) or attempt >= cls.retries:
+                        return res.text
+                attempt += 1
+                time.sleep(cls._backoff(attempt))
+        finally:
+            if request_body is not body:
+                request_body.close()
+
+
+class WebSocketSession:
+    """
+        Reusable connection to a /vm/<slot><uri> websocket endpoint. The
+        handshake and signature are paid when the connection opens; after
+        that calls run over it one after another, and it is reopened if the
+        node closed it in between. Idle sessions are pooled per endpoint and
+        signer, so concurrent calls each check one out (the protocol has no
+        request ids to multiplex a single connection).
+
+        `stream` is a generator over a call's partial results, reading the
+        next frame only when the consumer asks for it. Text frames are JSON
+        status messages; binary frames are yielded as bytes. A value sent
+        into the generator is sent back to the node, as a binary frame if it
+        is bytes and `binary` is set; an empty frame acknowledges the result
+        when nothing is sent.
+    """
+    #idle connections kept per endpoint
+    max_idle = 4
+
+    _idle = {}
+    _idle_mutex = threading.Lock()
+
+    def __init__(self, node, pk, aim_slot, uri, base_headers, protocol_version="2", binary=False):
+        self.node = node
+        self.pk = pk
+        self.aim_slot = aim_slot
+        self.uri = uri
+        self.base_headers = base_headers
+        self.protocol_version = protocol_version
+        self.binary = binary
+        self._ws = None
+        self._key = None
+
+    @classmethod
+    def acquire(cls, node, pk, aim_slot, uri, base_headers, protocol_version="2", binary=False):
+        """
+            Returns an idle pooled session for the endpoint, or a new one.
+            Hand it back with `release` when the call is done.
+        """
+        key = (node, aim_slot, uri, pk, protocol_version, binary, tuple(sorted(base_headers.items())))
+        with cls._idle_mutex:
+            idle = cls._idle.get(key)
+            session = idle.pop() if idle else None
+        if session is None:
+            session = cls(node, pk, aim_slot, uri, base_headers, protocol_version, binary)
+        session._key = key
+        return session
+
+    def release(self):
+        if self._ws is None:
+            return
+        with self._idle_mutex:
+            idle = self._idle.setdefault(self._key, [])
+            if len(idle) < self.max_idle:
+                idle.append(self)
+                return
+        self.close()
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    def _connect(self, body, connect_timeout):
+        from websocket import create_connection
+        sender = HyperCycleClient._account(self.pk).address
+        request_body = RequestBody(body)
+        headers = HyperCycleClient._sign_headers(self.node, sender, self.pk, "websocket",
+                                                 f"/vm/{self.aim_slot}{self.uri}", self.base_headers,
+                                                 request_body, self.protocol_version)
+        self._ws = create_connection(f"ws://{self.node}/vm/{self.aim_slot}{self.uri}", header=headers,
+                                     timeout=connect_timeout)
+
+    def _send(self, data):
+        if isinstance(data, dict):
+            data = json.dumps(data)
+        if self.binary and isinstance(data, (bytes, bytearray, memoryview)):
+            self._ws.send_binary(data)
         else:
-            headers['tx-nonce'] = nonce
-            if protocol_version == "1":
-                sig = cls.sign_message(nonce, sender, pk)
-            else:
-                encodedBody = body
-                if isinstance(body, str):
-                    encodedBody = encodedBody.encode('utf-8')
-                if method.lower() == "websocket":
-                   uri_path = f"/vm/{aim_slot}{uri}"
+            self._ws.send(data)
+
+    def _first_frame(self, body, timeout):
+        from websocket import ABNF, WebSocketConnectionClosedException
+        connect_timeout, read_timeout = timeout
+        for attempt in range(2):
+            reused = self._ws is not None
+            if not reused:
+                self._connect(body, connect_timeout)
+            self._ws.settimeout(read_timeout)
+            try:
+                self._send(body)
+                opcode, data = self._ws.recv_data()
+            except (WebSocketConnectionClosedException, ConnectionError):
+                if attempt:
+                    raise
+                opcode, data = ABNF.OPCODE_CLOSE, b""
+            if opcode != ABNF.OPCODE_CLOSE or attempt:
+                return opcode, data
+            #the node closed the idle connection, or refused the handshake
+            #(e.g. a nonce used by another client); open a new one
+            if not reused:
+                NonceManager.invalidate(self.node, HyperCycleClient._account(self.pk).address)
+            self.close()
+
+    def stream(self, body, timeout=None):
+        from websocket import ABNF, WebSocketConnectionClosedException
+        res = None
+        done = False
+        try:
+            opcode, data = self._first_frame(body, HyperCycleClient._timeout(timeout))
+            while True:
+                if opcode == ABNF.OPCODE_CLOSE:
+                    return res
+                if opcode == ABNF.OPCODE_BINARY:
+                    reply = yield data
                 else:
-                    uri_path = f"/aim/{aim_slot}{uri}"
-
-                message = cls.form_protocol_v2_message(headers, method, uri_path, encodedBody)
-                print('-----------------------------------')
-                print(message['message'])
-                print('----------------------------------')
-                sig = cls.sign_message(message['message'], sender, pk)
-            headers['tx-signature'] = sig
-        if method.lower() == "get":
-            res = requests.get(f"http://{node}/aim/{aim_slot}{uri}", headers=headers)
-            res = res.text
-        elif method.lower() == "post":
-            res = requests.post(f"http://{node}/aim/{aim_slot}{uri}", headers=headers, data=body)
-            res = res.text
-        elif method.lower() == "websocket":
-            res = yield from websocket_call(f"ws://{node}/vm/{aim_slot}{uri}", headers=headers,body=body)
-        return res
+                    res = json.loads(data)
+                    if res.get('status') == "return":
+                        done = True
+                        return res
+                    elif res.get('status') == "partial":
+                        reply = yield res
+                    else:
+                        reply = {"status": "???"}
+                if reply is None:
+                    #the node waits for an answer to every frame
+                    reply = ""
+                self._send(reply)
+                opcode, data = self._ws.recv_data()
+        except WebSocketConnectionClosedException:
+            return res
+        finally:
+            if not done:
+                #unfinished exchange, the connection can't be reused
+                self.close()
+
+    def call(self, body, timeout=None):
+        """
+            Runs a call to completion, ignoring partial results, and returns
+            the final message.
+        """
+        gen = self.stream(body, timeout)
+        try:
+            while True:
+                next(gen)
+        except StopIteration as e:
+            return e.value
+
+
+class NonceManager:
+    """
+        Allocates request nonces per (node, sender) locally instead of asking
+        the node before every signed call. The node is asked once, without
+        holding any lock, after that nonces are handed out under a file lock,
+        so threads and concurrent CLI runs never reuse one. State lives in <cache_dir>/nonces.json and
+        entries older than `ttl` seconds are fetched again.
+    """
+    ttl = 600
+
+    @classmethod
+    def allocate(cls, node, sender, fetch):
+        """
+            Returns the next nonce for `sender` on `node`. `fetch` is called
+            to get the node's current nonce when there is no fresh local one.
+        """
+        path = _cache_path("nonces.json")
+        key = f"{node}|{sender}"
+        nonce = cls._take(path, key, None)
+        if nonce is not None:
+            return nonce
+        #ask the node without holding the lock, other callers keep allocating
+        fetched = fetch()
+        try:
+            fetched = int(fetched)
+        except (TypeError, ValueError):
+            #not a counter, can't be allocated locally
+            return fetched
+        return cls._take(path, key, fetched)
+
+    @classmethod
+    def _take(cls, path, key, fetched):
+        #hands out the cached nonce, or the larger of it and `fetched` when
+        #given; returns None if there is no fresh cached one to hand out
+        with _cache_lock(path):
+            state = _read_cache(path)
+            entry = state.get(key)
+            now = time.time()
+            if entry is not None and now - entry["updated"] <= cls.ttl:
+                nonce = int(entry["next"])
+                if fetched is not None:
+                    nonce = max(nonce, fetched)
+            elif fetched is not None:
+                nonce = fetched
+            else:
+                return None
+            state[key] = {"next": str(nonce + 1), "updated": now}
+            _write_cache(path, state)
+        return str(nonce)
+
+    @classmethod
+    def invalidate(cls, node, sender):
+        """
+            Forgets the local nonce, so the next call fetches it from the node.
+        """
+        path = _cache_path("nonces.json")
+        with _cache_lock(path):
+            state = _read_cache(path)
+            if state.pop(f"{node}|{sender}", None) is not None:
+                _write_cache(path, state)
+
+
+class NodeDiscovery:
+    """
+        Finds nodes through all seed hosts and keeps a table of their round
+        trip time and error rate, as exponentially decayed averages of probes
+        and of calls reported through `record`. The table is cached in
+        <cache_dir>/nodes.json and refreshed after `ttl` seconds.
+    """
+    ttl = 300
+    probe_timeout = 3
+    #weight of the newest sample in the moving averages
+    decay = 0.3
+    max_workers = 16
+
+    _nodes = {}
+    _updated = 0
+    _refreshing = False
+    _mutex = threading.Lock()
+
+    @classmethod
+    def _node_address(cls, node):
+        if isinstance(node, dict):
+            return node.get("address") or node.get("host")
+        return node
+
+    @classmethod
+    def _seed_nodes(cls, seed_host):
+        res = HyperCycleClient._session(seed_host).get(f"http://{seed_host}/nodes",
+                                                       timeout=cls.probe_timeout).json()
+        return [cls._node_address(node) for node in res['nodes']]
+
+    @classmethod
+    def _probe(cls, node):
+        start = time.perf_counter()
+        try:
+            info = HyperCycleClient.node_info(node, timeout=cls.probe_timeout)
+        except Exception:
+            cls.record(node, error=True)
+            return
+        cls.record(node, rtt=time.perf_counter() - start, info=info)
+
+    @classmethod
+    def record(cls, node, rtt=None, error=False, info=None):
+        """
+            Adds a sample for `node`: its round trip time in seconds, or
+            `error` if it failed to answer.
+        """
+        with cls._mutex:
+            entry = cls._nodes.setdefault(node, {"rtt": None, "error_rate": 0.0, "info": None})
+            entry["error_rate"] += cls.decay * (float(error) - entry["error_rate"])
+            if rtt is not None:
+                entry["rtt"] = rtt if entry["rtt"] is None else entry["rtt"] + cls.decay * (rtt - entry["rtt"])
+            if info is not None:
+                entry["info"] = info
+            entry["updated"] = time.time()
+
+    @classmethod
+    def _load(cls):
+        state = _read_cache(_cache_path("nodes.json"))
+        with cls._mutex:
+            if state.get("updated", 0) > cls._updated:
+                cls._nodes.clear()
+                cls._nodes.update(state["nodes"])
+                cls._updated = state["updated"]
+
+    @classmethod
+    def _save(cls):
+        path = _cache_path("nodes.json")
+        with _cache_lock(path):
+            with cls._mutex:
+                state = {"updated": cls._updated, "nodes": dict(cls._nodes)}
+            _write_cache(path, state)
+
+    @classmethod
+    def discover(cls, force=False):
+        """
+            Queries every seed host and probes every node they list, in
+            parallel. Does nothing if the table is younger than `ttl` unless
+            `force` is set. Returns the node table.
+        """
+        cls._load()
+        if not force and time.time() - cls._updated < cls.ttl:
+            return cls._nodes
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cls.max_workers) as executor:
+            nodes = set()
+            for future in [executor.submit(cls._seed_nodes, seed) for seed in client_config['seed_hosts']]:
+                try:
+                    nodes.update(node for node in future.result() if node)
+                except Exception:
+                    continue
+            listed = set(nodes)
+            #nodes no seed lists anymore are kept until they keep failing
+            nodes.update(cls._nodes)
+            list(executor.map(cls._probe, nodes))
+        with cls._mutex:
+            for node in nodes - listed:
+                if cls._nodes[node]["error_rate"] > 0.9:
+                    del cls._nodes[node]
+            cls._updated = time.time()
+        cls._save()
+        return cls._nodes
+
+    @classmethod
+    def _serves(cls, info, aim):
+        aims = (info or {}).get("aims")
+        if aim is None or aims is None:
+            return True
+        if isinstance(aims, dict):
+            aims = [{"slot": k, **v} if isinstance(v, dict) else k for k, v in aims.items()]
+        for entry in aims:
+            if isinstance(entry, dict):
+                values = [entry.get("slot"), entry.get("aim_slot"), entry.get("name")]
+            else:
+                values = [entry]
+            if str(aim) in [str(v) for v in values if v is not None]:
+                return True
+        return False
+
+    @classmethod
+    def _score(cls, entry):
+        #expected time to a successful answer
+        return entry["rtt"] / max(1.0 - entry["error_rate"], 0.01)
+
+    @classmethod
+    def refresh_in_background(cls):
+        """
+            Runs `discover` in a daemon thread if the table is older than
+            `ttl` and no refresh is already running.
+        """
+        with cls._mutex:
+            if cls._refreshing or time.time() - cls._updated < cls.ttl:
+                return
+            cls._refreshing = True
+
+        def run():
+            try:
+                cls.discover()
+            except Exception as e:
+                print(f"Node discovery failed: {e!r}")
+            finally:
+                cls._refreshing = False
+        threading.Thread(target=run, daemon=True, name="hypercycle-discovery").start()
+
+    @classmethod
+    def ranked_nodes(cls, aim=None, cached=False):
+        """
+            Returns the nodes serving `aim` (slot or name), best first. With
+            `cached`, ranks the table already in memory and refreshes it in
+            the background instead of waiting for discovery.
+        """
+        if cached:
+            cls.refresh_in_background()
+        else:
+            cls.discover()
+        with cls._mutex:
+            candidates = [(cls._score(entry), node) for node, entry in cls._nodes.items()
+                          if entry["rtt"] is not None and cls._serves(entry["info"], aim)]
+        return [node for score, node in sorted(candidates)]
+
+    @classmethod
+    def best_node(cls, aim=None):
+        nodes = cls.ranked_nodes(aim)
+        return nodes[0] if nodes else None
+
+
+class ManifestCache:
+    """
+        Caches AIM manifests per (node, slot) in <cache_dir>/manifests/. A
+        cached manifest is used for `ttl` seconds and then revalidated with
+        If-None-Match, so an unchanged manifest is not downloaded again. It
+        is refetched early when the node publishes a different AIM version.
+        Cost quotes are worked out from the cached manifest.
+    """
+    ttl = 300
+
+    _parsed = {}
+    _mutex = threading.Lock()
+
+    @classmethod
+    def _path(cls, node, aim_slot):
+        digest = hashlib.sha256(f"{node}|{aim_slot}".encode()).hexdigest()
+        return _cache_path(os.path.join("manifests", f"{digest}.json"))
 
+    @classmethod
+    def _published_version(cls, node, aim_slot):
+        info = (NodeDiscovery._nodes.get(node) or {}).get("info") or {}
+        aims = info.get("aims")
+        if isinstance(aims, dict):
+            aims = [{"slot": k, **v} for k, v in aims.items() if isinstance(v, dict)]
+        for entry in aims or []:
+            if isinstance(entry, dict) and str(aim_slot) in [str(entry.get("slot")), str(entry.get("aim_slot"))]:
+                return entry.get("version")
+        return None
+
+    @classmethod
+    def get(cls, node, aim_slot, refresh=False):
+        """
+            Returns the manifest text of `aim_slot` on `node`. The cached
+            copy is returned if the node fails to answer; without one the
+            error is raised.
+        """
+        path = cls._path(node, aim_slot)
+        entry = _read_cache(path)
+        if entry and not refresh and time.time() - entry["fetched"] < cls.ttl:
+            published = cls._published_version(node, aim_slot)
+            if published is None or str(published) == str(entry.get("version")):
+                return entry["manifest"]
+
+        import requests
+        headers = {}
+        if entry.get("etag") and not refresh:
+            headers["If-None-Match"] = entry["etag"]
+        try:
+            res = HyperCycleClient._session(node).get(f"http://{node}/aim/{aim_slot}/manifest.json",
+                                                      headers=headers, timeout=HyperCycleClient._timeout())
+        except requests.exceptions.RequestException:
+            if entry:
+                return entry["manifest"]
+            raise
+        if res.status_code == 304 and entry:
+            entry["fetched"] = time.time()
+        elif res.status_code == 200:
+            try:
+                version = json.loads(res.text).get("version")
+            except (ValueError, AttributeError):
+                version = None
+            entry = {"manifest": res.text, "etag": res.headers.get("ETag"), "version": version,
+                     "fetched": time.time()}
+        elif entry:
+            #a stale manifest beats the node's error page
+            return entry["manifest"]
+        else:
+            res.raise_for_status()
+            raise requests.exceptions.HTTPError(f"Unexpected status {res.status_code} for the manifest of "
+                                                f"slot {aim_slot} on {node}", response=res)
+        with _cache_lock(path):
+            _write_cache(path, entry)
+        return entry["manifest"]
+
+    @classmethod
+    def invalidate(cls, node, aim_slot):
+        path = cls._path(node, aim_slot)
+        with _cache_lock(path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def manifest(cls, node, aim_slot):
+        """
+            Returns the parsed manifest, parsing it again only when it changed.
+        """
+        text = cls.get(node, aim_slot)
+        key = (node, str(aim_slot))
+        with cls._mutex:
+            cached = cls._parsed.get(key)
+            if cached is not None and cached[0] == text:
+                return cached[1]
+        manifest = json.loads(text)
+        with cls._mutex:
+            cls._parsed[key] = (text, manifest)
+        return manifest
+
+    @classmethod
+    def quote(cls, node, aim_slot, uri, method="POST", size=0):
+        """
+            Estimates the cost of calling `uri` with a body of `size` bytes
+            from the endpoint's price_per_call and price_per_mb. Returns a
+            dict with currency, estimated_cost, min and max, or None if the
+            manifest lists no such endpoint.
+        """
+        return cls.quote_manifest(cls.manifest(node, aim_slot), uri, method, size)
 
+    @classmethod
+    def quote_manifest(cls, manifest, uri, method="POST", size=0):
+        for endpoint in manifest.get("endpoints", []):
+            methods = [m.upper() for m in endpoint.get("input_methods") or [method]]
+            if endpoint.get("uri") != uri or method.upper() not in methods:
+                continue
+            per_call = endpoint.get("price_per_call") or {}
+            per_mb = endpoint.get("price_per_mb") or {}
+            mb = size / (1024 * 1024)
+            quote = {"currency": endpoint.get("currency")}
+            for field in ["estimated_cost", "min", "max"]:
+                quote[field] = per_call.get(field, 0) + per_mb.get(field, 0) * mb
+            return quote
+        return None
+
+
+class AsyncHyperCycleClient:
+    """
+        asyncio interface to HyperCycleClient with the same call, get_manifest
+        and get_balance methods. Requests run on a shared thread pool over the
+        client's pooled sessions, so many calls can be in flight at once. The
+        pool has as many threads as client_config["max_connections"], so
+        every thread can hold a pooled connection.
+    """
+    #default limit of concurrent requests in call_many
+    concurrency = 16
+
+    _executor = None
+    _executor_mutex = threading.Lock()
+
+    @classmethod
+    def _run(cls, function, *args, **kwargs):
+        if cls._executor is None:
+            with cls._executor_mutex:
+                if cls._executor is None:
+                    cls._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=_max_connections(), thread_name_prefix="hypercycle-client")
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(cls._executor, functools.partial(function, *args, **kwargs))
+
+    @classmethod
+    async def call(cls, node, pk, aim_slot, method, uri, headers=None, body=None, protocol_version="2",
+                   driver="ethereum", cost_only=False, is_public=False, timeout=None, hedge=None):
+        if method.lower() not in ["get", "post"]:
+            raise ValueError(f"Unsupported method for AsyncHyperCycleClient.call: {method}")
+        return await cls._run(HyperCycleClient.call, node, pk, aim_slot, method, uri, headers, body,
+                              protocol_version, driver, cost_only, is_public, timeout, hedge)
+
+    @classmethod
+    async def get_manifest(cls, node, aim_slot, refresh=False):
+        return await cls._run(HyperCycleClient.get_manifest, node, aim_slot, refresh)
+
+    @classmethod
+    async def get_balance(cls, node, address=None, pk=None, driver=None):
+        return await cls._run(HyperCycleClient.get_balance, node, address, pk, driver)
 
-def websocket_call(uri, headers, body):
-    print(uri)
+    @classmethod
+    async def node_info(cls, node, timeout=20):
+        return await cls._run(HyperCycleClient.node_info, node, timeout)
+
+    @classmethod
+    def _step(cls, gen, value):
+        #StopIteration can't cross a future, so report completion instead
+        try:
+            return False, gen.send(value)
+        except StopIteration as e:
+            return True, e.value
+
+    @classmethod
+    async def stream(cls, node, pk, aim_slot, uri, body, headers=None, protocol_version="2",
+                     driver="ethereum", is_public=False, binary=False, timeout=None):
+        """
+            Async iterator over a websocket call on a pooled WebSocketSession.
+            Yields partial results and binary frames, then the final message.
+            A value passed with asend() is sent back to the node. `timeout`
+            is (connect, read) seconds.
+        """
+        sender = (await cls._run(HyperCycleClient._account, pk)).address
+        base_headers = HyperCycleClient._base_headers(sender, headers, driver, protocol_version, False, is_public)
+        session = WebSocketSession.acquire(node, pk, aim_slot, uri, base_headers, protocol_version, binary)
+        gen = session.stream(body, timeout)
+        reply = None
+        try:
+            while True:
+                done, item = await cls._run(cls._step, gen, reply)
+                reply = yield item
+                if done:
+                    return
+        finally:
+            gen.close()
+            session.release()
+
+    @classmethod
+    async def call_many(cls, calls, concurrency=None, return_exceptions=False):
+        """
+            Runs `calls`, an iterable of dicts of `call` keyword arguments,
+            with at most `concurrency` requests in flight. Returns the results
+            in the order of `calls`. With `return_exceptions` a failed call
+            yields its exception instead of cancelling the rest.
+        """
+        semaphore = asyncio.Semaphore(concurrency or cls.concurrency)
+
+        async def run_one(kwargs):
+            async with semaphore:
+                return await cls.call(**kwargs)
+
+        return await asyncio.gather(*[run_one(kwargs) for kwargs in calls],
+                                    return_exceptions=return_exceptions)
+
+    @classmethod
+    def close(cls):
+        """Shuts down the thread pool and closes pooled connections."""
+        with cls._executor_mutex:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=False)
+                cls._executor = None
+        HyperCycleClient.close()
+
+
+def websocket_call(uri, headers, body, timeout=None):
+    #one-shot connection; HyperCycleClient.call reuses connections through WebSocketSession
+    from websocket import create_connection, WebSocketConnectionClosedException
     res = None
+    connect_timeout, read_timeout = HyperCycleClient._timeout(timeout)
+    ws = create_connection(uri, header=headers, timeout=connect_timeout)
+    ws.settimeout(read_timeout)
     try:
-        ws = create_connection(uri, header=headers)#, header=[f"{k}: {v}" for k, v in headers.items()])
-        print(headers)
-        print("Connected to server.")
         ws.send(body)
         while True:
             try:
-                response = ws.recv()
-                print("============================")
-                print(response)
-                res = json.loads(response)
-
+                res = json.loads(ws.recv())
                 if res.get('status') == "return":
-                    print("Returned", res['result'])
                     break
                 elif res.get('status') == "partial":
-                    print("Partial", res['result'])
                     send_bytes = yield res
-                    print("FFFFFFFFDDDDDDDDDDDD", send_bytes)
-                    ws.send(send_bytes)
+                    ws.send(send_bytes if send_bytes is not None else "")
                 else:
-                    print(res.get("status"), "LLLLLLLLLLLLL")
-                    print("ISSUE", res)
                     ws.send(json.dumps({"status": "???"}))
             except WebSocketConnectionClosedException:
-                print("Connection closed by server.")
                 break
     finally:
         ws.close()
@@ -305,6 +1271,16 @@ class ClientCLI:
         call_parser.add_argument("--is-public", action="store_true", help="If set, indicates a public call not requiring nonce/signature.")
         call_parser.set_defaults(func=self.call_aim)
 
+        # Batch Command
+        batch_parser = self.subparsers.add_parser("batch", help="Run AIM calls read as JSON lines, concurrently, writing JSON lines results.")
+        batch_parser.add_argument("input", type=str, nargs="?", default="-", help="File of JSON lines requests, or '-' for stdin. Each line holds `call` arguments: node, aim_slot, method, uri, headers, body, protocol_version, cost_only, is_public, and optionally an id.")
+        batch_parser.add_argument("--node", type=str, help="Node for requests that don't name one. Defaults to the best discovered node for the AIM slot.")
+        batch_parser.add_argument("--pk", type=str, help="Your private key for transaction signing.")
+        batch_parser.add_argument("--driver", type=str, default="ethereum", help="Blockchain driver (e.g., 'ethereum').")
+        batch_parser.add_argument("--concurrency", type=int, default=16, help="Number of requests in flight.")
+        batch_parser.add_argument("--unordered", action="store_true", help="Write results as they complete instead of in input order. The low-latency mode: in input order a slow call holds back every later result.")
+        batch_parser.set_defaults(func=self.batch)
+
         # Configuration file argument (global)
         self.parser.add_argument("--config", type=str, help="Path to a JSON configuration file (e.g., --config client_config.json).")
 
@@ -319,8 +1295,7 @@ class ClientCLI:
                 args.pk = pk
                 
         if hasattr(args, "address") and not args.address and args.pk:
-            w3 = Web3(Web3.HTTPProvider(client_config.get("rpc_provider")))
-            args.address = w3.eth.account.from_key(args.pk).address
+            args.address = HyperCycleClient._account(args.pk).address
         if hasattr(args, "driver") and not args.driver:
             args.driver = client_config.get('driver')
         if hasattr(args, 'func'):
@@ -333,7 +1308,7 @@ class ClientCLI:
             with open(filename, 'r') as f:
                 config_data = json.load(f)
                 client_config.update(config_data)
-                print(f"Loaded configuration from {filename}")
+                print(f"Loaded configuration from {filename}", file=sys.stderr)
         except FileNotFoundError:
             print(f"Error: Configuration file '{filename}' not found.", file=sys.stderr)
             sys.exit(1)
@@ -376,8 +1351,7 @@ class ClientCLI:
         balance_address = args.address
         if args.pk:
             try:
-                w3 = Web3(Web3.HTTPProvider(client_config.get("rpc_provider")))
-                balance_address = w3.eth.account.from_key(args.pk).address
+                balance_address = HyperCycleClient._account(args.pk).address
                 print(f"Using address derived from private key: {balance_address}")
             except Exception as e:
                 print(f"Error deriving address from private key: {e}", file=sys.stderr)
@@ -413,8 +1387,8 @@ class ClientCLI:
             args.aim_slot,
             args.method,
             args.uri,
-            args.headers,
-            body_str=args.body,
+            json.loads(args.headers),
+            body=args.body,
             protocol_version=args.protocol_version,
             driver=args.driver,
             cost_only=args.cost_only,
@@ -429,6 +1403,96 @@ class ClientCLI:
         else:
             print("AIM call failed.")
 
+    def _batch_call(self, index, request, args):
+        start = time.perf_counter()
+        out = {"index": index}
+        if "id" in request:
+            out["id"] = request["id"]
+        try:
+            node = request.get("node") or args.node or NodeDiscovery.best_node(aim=request.get("aim_slot"))
+            res = HyperCycleClient.call(node, args.pk, request["aim_slot"], request.get("method", "GET"),
+                                        request["uri"], request.get("headers") or {}, request.get("body"),
+                                        protocol_version=str(request.get("protocol_version", "2")),
+                                        driver=request.get("driver", args.driver),
+                                        cost_only=request.get("cost_only", False),
+                                        is_public=request.get("is_public", False))
+            try:
+                out["result"] = json.loads(res)
+            except (TypeError, ValueError):
+                out["result"] = res
+            out["ok"] = True
+        except Exception as e:
+            out["ok"] = False
+            out["error"] = f"{type(e).__name__}: {e}"
+        out["elapsed"] = time.perf_counter() - start
+        return out
+
+    def batch(self, args):
+        """
+            Writes each result once all earlier ones are written, or as soon
+            as it completes with --unordered, the low-latency mode.
+        """
+        stream = sys.stdin if args.input == "-" else open(args.input, "r")
+        concurrency = max(1, args.concurrency)
+        client_config["max_connections"] = max(_max_connections(), concurrency)
+        #requests are read lazily, keeping at most `window` of them in memory
+        window = concurrency * 2
+        slots = threading.Semaphore(window)
+        output_mutex = threading.Lock()
+        ready = {}
+        next_seq = 0
+        latencies = []
+        failed = 0
+
+        def emit(out):
+            nonlocal failed
+            latencies.append(out["elapsed"])
+            failed += not out["ok"]
+            sys.stdout.write(json.dumps(out) + "\n")
+            sys.stdout.flush()
+            slots.release()
+
+        def on_done(seq, future):
+            #runs as soon as a call finishes; in input order each result is
+            #written once every earlier one has been
+            nonlocal next_seq
+            with output_mutex:
+                if args.unordered:
+                    emit(future.result())
+                    return
+                ready[seq] = future.result()
+                while next_seq in ready:
+                    emit(ready.pop(next_seq))
+                    next_seq += 1
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            seq = 0
+            for index, line in enumerate(stream):
+                if not line.strip():
+                    continue
+                slots.acquire()
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    future = concurrent.futures.Future()
+                    future.set_result({"index": index, "ok": False, "error": f"Invalid JSON: {e}", "elapsed": 0.0})
+                else:
+                    future = executor.submit(self._batch_call, index, request, args)
+                future.add_done_callback(functools.partial(on_done, seq))
+                seq += 1
+        elapsed = time.perf_counter() - start
+        if stream is not sys.stdin:
+            stream.close()
+
+        latencies.sort()
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0.0
+        print(f"{len(latencies)} requests, {failed} failed in {elapsed:.2f}s "
+              f"({len(latencies) / elapsed if elapsed else 0:.1f} req/s), latency ms "
+              f"p50 {percentile(0.5):.1f} p95 {percentile(0.95):.1f} p99 {percentile(0.99):.1f}",
+              file=sys.stderr)
+
 
 def main():
     cli = ClientCLI()
@@ -0,0 +1,237 @@
+import json
+import time
+import asyncio
+import argparse
+import threading
+import uvicorn
+from starlette.websockets import WebSocketDisconnect
+from pyhypercycle_aim.servers import SimpleServer
+from pyhypercycle_aim.util import aim_uri, JSONResponseCORS, manifest_response, manifest_etag
+from pyhypercycle_aim.hypercycle_client import HyperCycleClient, ManifestCache
+
+
+ECHO_MANIFEST = {
+    "name": "Echo",
+    "short_name": "echo",
+    "version": "1.0",
+    "documentation_url": "",
+    "license": "Open",
+    "terms_of_service": "",
+    "author": "",
+    "endpoints": [{
+        "uri": "/echo",
+        "input_methods": ["GET", "POST"],
+        "input_query": "",
+        "input_headers": {},
+        "input_body": "<Any>",
+        "output": {"method": "<Text>", "uri": "<Text>", "size": "<Int>"},
+        "currency": "USD",
+        "price_per_call": {"estimated_cost": 0.001, "min": 0, "max": 0.01},
+        "price_per_mb": {"estimated_cost": 0.01, "min": 0, "max": 0.1},
+        "documentation": "Returns the method, uri and body size of the call."
+    }]
+}
+
+
+class LocalNode(SimpleServer):
+    """
+        Stand-in HyperCycle node for testing and benchmarking the client
+        without a live node or an Ethereum RPC. Serves /nodes, /info,
+        /nonce, /balance, AIM calls under /aim/<slot>/ and websocket calls
+        under /vm/<slot>/, checking nonces and ProtocolV2 signatures.
+
+        Every slot runs an echo AIM. A websocket call's JSON body may ask for
+        `partials` partial results, sent as `size`-byte binary frames if
+        `binary` is set; each one waits for the client's reply unless `ack`
+        is false.
+    """
+    manifest = {"name": "Local node",
+                "short_name": "local_node",
+                "version": "1.0",
+                "documentation_url": "",
+                "license": "Open",
+                "terms_of_service": "",
+                "author": ""
+               }
+
+    def __init__(self, address="127.0.0.1:8000", peers=None, aims=None, verify_signatures=True,
+                 latency=0.0, hotwallet="0x0000000000000000000000000000000000000000"):
+        self.address = address
+        self.peers = peers or []
+        self.aims = aims or {1: ECHO_MANIFEST}
+        self.aim_etags = {slot: manifest_etag(m) for slot, m in self.aims.items()}
+        self.verify_signatures = verify_signatures
+        self.latency = latency
+        self.hotwallet = hotwallet
+        self.used_nonces = {}
+        self.next_nonces = {}
+        self.balances = {}
+        self.deposit_amount = 1000000
+
+    def _verify(self, headers, method, path, body):
+        """
+            Checks the nonce and signature of a call. Returns an error
+            message, or None if the call is accepted.
+        """
+        if headers.get("ispublic"):
+            return None
+        sender = headers.get("tx-sender")
+        nonce = headers.get("tx-nonce")
+        signature = headers.get("tx-signature")
+        if not sender or not nonce or not signature:
+            return "Missing tx-sender, tx-nonce or tx-signature"
+        used = self.used_nonces.setdefault(sender, set())
+        if nonce in used:
+            return "Invalid nonce: already used"
+        if self.verify_signatures:
+            from eth_account import Account
+            from eth_account.messages import encode_defunct
+            if headers.get("tx-protocol") == "1":
+                message = nonce
+            else:
+                message = HyperCycleClient.form_protocol_v2_message(headers, method, path, body)['message']
+            try:
+                signer = Account.recover_message(encode_defunct(text=message),
+                                                 signature=bytes.fromhex(signature.removeprefix("0x")))
+            except Exception:
+                signer = None
+            if signer is None or signer.lower() != sender.lower():
+                return "Invalid signature"
+        used.add(nonce)
+        try:
+            self.next_nonces[sender] = max(self.next_nonces.get(sender, 1), int(nonce) + 1)
+        except ValueError:
+            pass
+        return None
+
+    @aim_uri(uri="/nodes", methods=["GET"], endpoint_manifest={
+        "documentation": "Lists the known nodes.",
+        "is_public": True
+    })
+    async def nodes(self, request):
+        return JSONResponseCORS({"nodes": [self.address] + self.peers})
+
+    @aim_uri(uri="/info", methods=["GET"], endpoint_manifest={
+        "documentation": "Node information.",
+        "is_public": True
+    })
+    async def info(self, request):
+        aims = [{"slot": slot, "name": m.get("short_name"), "version": m.get("version")}
+                for slot, m in self.aims.items()]
+        return JSONResponseCORS({"tm": {"driver": "ethereum", "address": self.hotwallet},
+                                 "aims": aims})
+
+    @aim_uri(uri="/nonce", methods=["GET"], endpoint_manifest={
+        "documentation": "Next nonce of the `sender` header.",
+        "is_public": True
+    })
+    async def nonce(self, request):
+        sender = request.headers.get("sender", "")
+        return JSONResponseCORS({"nonce": str(self.next_nonces.get(sender, 1))})
+
+    @aim_uri(uri="/balance", methods=["GET", "POST"], endpoint_manifest={
+        "documentation": "Balance of `tx-sender`. POST with a `tx-id` credits a test deposit.",
+        "is_public": True
+    })
+    async def balance(self, request):
+        sender = request.headers.get("tx-sender", "")
+        if request.method == "POST" and request.headers.get("tx-id"):
+            self.balances[sender] = self.balances.get(sender, 0) + self.deposit_amount
+        return JSONResponseCORS({"balance": {"USDC": self.balances.get(sender, 0)}})
+
+    @aim_uri(uri="/aim/{slot:int}/{path:path}", methods=["GET", "POST"], endpoint_manifest={
+        "documentation": "AIM calls.",
+    })
+    async def aim_call(self, request):
+        slot = request.path_params['slot']
+        path = "/" + request.path_params['path']
+        aim_manifest = self.aims.get(slot)
+        if aim_manifest is None:
+            return JSONResponseCORS({"error": f"No AIM in slot {slot}"}, status_code=404)
+        if path == "/manifest.json":
+            return manifest_response(request, aim_manifest, self.aim_etags.get(slot))
+
+        body = await request.body()
+        uri_path = request.url.path
+        if request.url.query:
+            uri_path += "?" + request.url.query
+        error = self._verify(request.headers, request.method, uri_path, body)
+        if error:
+            return JSONResponseCORS({"error": error}, status_code=403)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.headers.get("cost-only") or request.headers.get("cost_only"):
+            return JSONResponseCORS({"cost": ManifestCache.quote_manifest(aim_manifest, path, request.method,
+                                                                          len(body))})
+        return JSONResponseCORS({"method": request.method, "uri": path, "size": len(body)})
+
+    @aim_uri(uri="/vm/{slot:int}/{path:path}", methods=["WEBSOCKET"], endpoint_manifest={
+        "documentation": "Streaming AIM calls.",
+    })
+    async def vm_call(self, websocket):
+        headers = websocket.headers
+        await websocket.accept()
+        verified = False
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                data = message.get("text")
+                if data is None:
+                    data = message.get("bytes", b"")
+                if not verified:
+                    body = data.encode('utf-8') if isinstance(data, str) else data
+                    if self._verify(headers, "websocket", websocket.url.path, body):
+                        await websocket.close(code=1008)
+                        return
+                    verified = True
+                try:
+                    request = json.loads(data)
+                except ValueError:
+                    request = {}
+                if not isinstance(request, dict):
+                    request = {}
+                payload = b"\0" * int(request.get("size", 0))
+                for i in range(int(request.get("partials", 0))):
+                    if request.get("binary"):
+                        await websocket.send_bytes(payload)
+                    else:
+                        await websocket.send_text(json.dumps({"status": "partial", "result": i}))
+                    if request.get("ack", True):
+                        await websocket.receive()
+                await websocket.send_text(json.dumps({"status": "return",
+                                                      "result": {"partials": int(request.get("partials", 0))}}))
+        except WebSocketDisconnect:
+            return
+
+    def start(self, host="127.0.0.1", port=8000, **starlette_kwargs):
+        """
+            Serves the node from a daemon thread and returns the uvicorn
+            server once it accepts connections. Set `should_exit` on it to
+            stop.
+        """
+        self.build_app(debug=False, starlette_kwargs=starlette_kwargs)
+        config = uvicorn.Config(self.app, host=host, port=port, log_level="warning")
+        server = uvicorn.Server(config)
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in HyperCycle node")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--peers", type=str, nargs="*", default=[], help="Other nodes to list in /nodes.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every AIM call.")
+    parser.add_argument("--no-verify", action="store_true", help="Skip signature checks (nonces are still checked).")
+    args = parser.parse_args()
+    node = LocalNode(address=f"{args.host}:{args.port}", peers=args.peers, latency=args.latency,
+                     verify_signatures=not args.no_verify)
+    node.run(debug=False, uvicorn_kwargs={"host": args.host, "port": args.port, "log_level": "warning"})
+
+
+if __name__ == '__main__':
+    main()
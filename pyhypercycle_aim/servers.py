@@ -3,7 +3,7 @@ import inspect
 import time
 import uvicorn
 from pyhypercycle_aim.util import to_async, JSONResponseCORS, default_exception_handlers, \
-    aim_uri
+    aim_uri, install_interrupt_handler, manifest_response, manifest_etag
 from starlette.applications import Starlette
 from starlette.routing import Route, WebSocketRoute
 
@@ -23,10 +23,22 @@ class SimpleServer(BaseServer):
     def run(self, debug=True, exception_handlers=None,
                   on_startup=None, concurrent=1, sleep_time=0.25, 
                   starlette_kwargs=None, uvicorn_kwargs=None):
-        if not starlette_kwargs:
-            starlette_kwargs = {}
+        install_interrupt_handler()
         if not uvicorn_kwargs:
             uvicorn_kwargs = {}
+        self.build_app(debug=debug, exception_handlers=exception_handlers, on_startup=on_startup,
+                       concurrent=concurrent, sleep_time=sleep_time, starlette_kwargs=starlette_kwargs)
+        uvicorn.run(self.app, **uvicorn_kwargs)
+
+    def build_app(self, debug=True, exception_handlers=None,
+                  on_startup=None, concurrent=1, sleep_time=0.25, 
+                  starlette_kwargs=None):
+        """
+            Builds the Starlette app (self.app) without serving it, e.g. to
+            serve it from a thread or mount it elsewhere.
+        """
+        if not starlette_kwargs:
+            starlette_kwargs = {}
         if exception_handlers is None:
             exception_handlers = default_exception_handlers
         if on_startup is None:
@@ -55,19 +67,24 @@ class SimpleServer(BaseServer):
         self.manifest_json = self.manifest.copy()
         self.manifest_json['endpoints'] = endpoints_manifest
         
+        self.manifest_etag = manifest_etag(self.manifest_json)
         if has_manifest_override is False:
             routes.append(Route("/manifest.json", 
-                                lambda *args, **kwargs: JSONResponseCORS(self.manifest_json),
+                                lambda request: manifest_response(request, self.manifest_json,
+                                                                  self.manifest_etag),
                                 methods=["GET"]))
 
         self.job_queue = []
         self.queue_counter = 0
         self.concurrent = concurrent
         self.sleep_time = sleep_time
+        if on_startup:
+            #Starlette 1.0 dropped on_startup; only pass it when there are jobs
+            starlette_kwargs['on_startup'] = on_startup
         self.app = Starlette(debug=debug, routes=routes,
                              exception_handlers=exception_handlers,
-                             on_startup = on_startup, **starlette_kwargs)
-        uvicorn.run(self.app, **uvicorn_kwargs)
+                             **starlette_kwargs)
+        return self.app
 
 
 class SimpleQueue(BaseServer):
@@ -77,6 +94,7 @@ class SimpleQueue(BaseServer):
     def run(self, debug=True, exception_handlers=None,
                   on_startup=None, concurrent=1, sleep_time=0.25, 
                   starlette_kwargs=None, uvicorn_kwargs=None):
+        install_interrupt_handler()
         if not starlette_kwargs:
             starlette_kwargs = {}
         if not uvicorn_kwargs:
@@ -116,9 +134,11 @@ class SimpleQueue(BaseServer):
         self.manifest_json = self.manifest.copy()
         self.manifest_json['endpoints'] = endpoints_manifest
         
+        self.manifest_etag = manifest_etag(self.manifest_json)
         if has_manifest_override is False:
             routes.append(Route("/manifest.json", 
-                                lambda *args, **kwargs: JSONResponseCORS(self.manifest_json),
+                                lambda request: manifest_response(request, self.manifest_json,
+                                                                  self.manifest_etag),
                                 methods=["GET"]))
 
         self.job_queue = []
@@ -190,6 +210,7 @@ class AsyncQueue(BaseServer):
     def run(self, debug=True, exception_handlers=None,
                   on_startup=None, concurrent=1, sleep_time=0.25, 
                   starlette_kwargs=None, uvicorn_kwargs=None):
+        install_interrupt_handler()
         if not starlette_kwargs:
             starlette_kwargs = {}
         if not uvicorn_kwargs:
@@ -241,9 +262,11 @@ class AsyncQueue(BaseServer):
             new_endpoints.extend(endpoints_manifest)
             self.manifest_json['endpoints'] = new_endpoints
                     
+        self.manifest_etag = manifest_etag(self.manifest_json)
         if has_manifest_override is False:
             routes.append(Route("/manifest.json", 
-                                lambda *args, **kwargs: JSONResponseCORS(self.manifest_json),
+                                lambda request: manifest_response(request, self.manifest_json,
+                                                                  self.manifest_etag),
                                 methods=["GET"]))
 
         self.job_queue = []
@@ -0,0 +1,147 @@
+import os
+import re
+import threading
+from pathlib import Path
+from filelock import FileLock
+
+LOCK_STRIPES = 256
+
+_HASH_FILE = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)$")
+_SHARD_DIR = re.compile(r"^[0-9a-f]{2}$")
+
+_locks = {}
+_locks_mutex = threading.Lock()
+
+
+def _reset_locks_after_fork():
+    #FileLock objects refuse to work once inherited across fork, and the
+    #mutex may have been held by another thread, so the child starts over
+    global _locks_mutex
+    _locks.clear()
+    _locks_mutex = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def shard_path(base, key_hash, suffix=".json"):
+    """
+        Fan-out location of a hashed key file: <base>/ab/cd/abcd...<suffix>
+    """
+    return Path(base) / key_hash[:2] / key_hash[2:4] / f"{key_hash}{suffix}"
+
+
+def resolve_shard_path(base, key_hash, suffix=".json"):
+    """
+        Returns the shard path for `key_hash`, first moving a file left in
+        the old flat layout into place. Call while holding the key's lock.
+    """
+    path = shard_path(base, key_hash, suffix)
+    if not path.exists():
+        legacy = Path(base) / f"{key_hash}{suffix}"
+        if legacy.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(legacy, path)
+            except FileNotFoundError:
+                #moved by another process
+                pass
+    return path
+
+
+def stripe_lock(base, key_hash, stripes=LOCK_STRIPES):
+    """
+        Returns the FileLock guarding `key_hash`. Keys share a fixed set of
+        lock files under <base>/_locks instead of one lock file per key.
+        Lock objects are cached per process (the cache is dropped in forked
+        children), so nested use is reentrant.
+    """
+    stripe = int(key_hash[:8], 16) % stripes
+    path = os.path.join(base, "_locks", f"{stripe:03x}.lock")
+    with _locks_mutex:
+        lock = _locks.get(path)
+        if lock is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock = FileLock(path)
+            _locks[path] = lock
+    return lock
+
+
+def iter_shard_files(base, suffix=".json"):
+    """
+        Yields the paths of all hashed key files under `base`, in both the
+        sharded and the old flat layout.
+    """
+    try:
+        top = list(os.scandir(base))
+    except FileNotFoundError:
+        return
+    for entry in top:
+        if entry.is_dir() and _SHARD_DIR.match(entry.name):
+            for sub in os.scandir(entry.path):
+                if sub.is_dir() and _SHARD_DIR.match(sub.name):
+                    for f in os.scandir(sub.path):
+                        if f.name.endswith(suffix):
+                            yield Path(f.path)
+        elif entry.name.endswith(suffix) and _HASH_FILE.match(entry.name):
+            yield Path(entry.path)
+
+
+def migrate_flat_layout(base, suffix=".json", stripes=LOCK_STRIPES):
+    """
+        Moves files from the flat layout into shard directories and removes
+        the old per-key .lock files. Safe to run while the managers are in
+        use, as long as every process runs a version that reads the sharded
+        layout. Returns the number of files moved.
+    """
+    moved = 0
+    try:
+        entries = list(os.scandir(base))
+    except FileNotFoundError:
+        return moved
+    for entry in entries:
+        m = _HASH_FILE.match(entry.name)
+        if not m or not entry.is_file():
+            continue
+        key_hash, ext = m.groups()
+        if ext == ".lock":
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            continue
+        if ext != suffix:
+            continue
+        with stripe_lock(base, key_hash, stripes):
+            target = shard_path(base, key_hash, suffix)
+            try:
+                if target.exists():
+                    #the sharded copy is always the newer one
+                    os.remove(entry.path)
+                else:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(entry.path, target)
+                    moved += 1
+            except FileNotFoundError:
+                pass
+    return moved
+
+
+class ShardMigrator(threading.Thread):
+    """
+        Background thread running `migrate_flat_layout` on a directory.
+    """
+    def __init__(self, base, suffix=".json", stripes=LOCK_STRIPES):
+        super().__init__(daemon=True)
+        self.base = base
+        self.suffix = suffix
+        self.stripes = stripes
+        self.moved = 0
+        self.error = None
+
+    def run(self):
+        try:
+            self.moved = migrate_flat_layout(self.base, self.suffix, self.stripes)
+        except Exception as e:
+            self.error = e
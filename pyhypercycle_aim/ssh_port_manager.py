@@ -1,7 +1,12 @@
 import os
+import time
+import json
+import hashlib
+import asyncio
 import subprocess
 import tempfile
 import base64
+from filelock import FileLock
 from pyhypercycle_aim.exceptions import SSHPortManagerError
 
 SSH_USER_HOME = "/home/access"
@@ -9,23 +14,105 @@ SSH_USER = "access"
 SSH_AUTH_KEYS = f"{SSH_USER_HOME}/.ssh/authorized_keys"
 SSHD_CONFIG = "/etc/ssh/sshd_config"
 INIT_MARKER_FILE = "/var/run/sshportmanager_initialized"
+SSH_KEY_REGISTRY = "/container_mount/ssh_keys/registry.json"
+
+def key_fingerprint(public_key):
+    """
+        SHA256 fingerprint of an OpenSSH public key, as ssh-keygen -l prints it.
+        Accepts a bare key or a full authorized_keys line.
+    """
+    fields = public_key.split()
+    for i, field in enumerate(fields[:-1]):
+        if field.startswith(("ssh-", "ecdsa-", "sk-")):
+            blob = fields[i+1]
+            break
+    else:
+        raise SSHPortManagerError("Not an OpenSSH public key.")
+    digest = hashlib.sha256(base64.b64decode(blob)).digest()
+    return "SHA256:" + base64.b64encode(digest).decode().rstrip("=")
+
+
+def generate_keypair(key_type="ed25519", rsa_bits=2048):
+    """
+        Generates an SSH keypair in-process, without temp files.
+        Returns (private_key, public_key) in OpenSSH format.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if key_type == "ed25519":
+        key = ed25519.Ed25519PrivateKey.generate()
+    elif key_type == "rsa":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=rsa_bits)
+    else:
+        raise SSHPortManagerError(f"Invalid key_type {key_type}, must be 'ed25519' or 'rsa'.")
+
+    private_key = key.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.OpenSSH,
+                                    serialization.NoEncryption()).decode()
+    public_key = key.public_key().public_bytes(serialization.Encoding.OpenSSH,
+                                               serialization.PublicFormat.OpenSSH).decode()
+    return private_key, public_key
+
 
 class SSHPortManager:
+    """
+        Issues SSH keys for port forwarding.
+        Issued keys are kept in a registry (fingerprint -> user, ports,
+        expiry) and every authorized_keys file is regenerated from it
+        atomically, so batches of grants or revocations cost one rewrite.
+        Lines of authorized_keys that the registry did not issue are read
+        again and kept on every rewrite, so keys added by hand or by other
+        tools are left alone.
+    """
+    @classmethod
+    def allow_access(cls, ports=None, shell=False, username="access", key_type="ed25519",
+                     expires=None, subscription_key=None):
+        """
+            Issues a new key allowing `username` to forward to `ports`.
+            The key is revoked by expire_keys once the `expires` timestamp
+            passes or the SubscriptionManager `subscription_key` is no longer
+            active. Returns the private key.
+        """
+        return cls.allow_access_many([{"ports": ports, "shell": shell, "expires": expires,
+                                       "subscription_key": subscription_key}],
+                                     username=username, key_type=key_type)[0]
+
     @classmethod
-    def allow_access(cls, ports=None, shell=False, username="access"):
+    def allow_access_many(cls, grants, username="access", key_type="ed25519"):
+        """
+            Issues one key per grant ({"ports": [...], "shell": bool,
+            "expires": timestamp, "subscription_key": str}) and writes
+            authorized_keys once. Returns the private keys in the order of
+            `grants`.
+        """
         if not username.isalnum():
             raise SSHPortManagerError("Username must be alpha-numeric.")       
  
         cls.ensure_user(username)
         cls.ensure_ssh_dir(username)
 
-        # Create keypair
-        key = subprocess.check_output(["ssh-keygen", "-t", "rsa", "-b", "2048", "-N", "", "-f", "/tmp/tempkey"]).decode()
-        private_key = open("/tmp/tempkey", "r").read()
-        public_key = open("/tmp/tempkey.pub", "r").read()
-        os.remove("/tmp/tempkey")
-        os.remove("/tmp/tempkey.pub")
+        private_keys = []
+        entries = {}
+        for grant in grants:
+            private_key, public_key = generate_keypair(key_type)
+            private_keys.append(private_key)
+            ports = [int(port) for port in grant.get("ports") or []]
+            entries[key_fingerprint(public_key)] = {
+                "user": username, "public_key": public_key.strip(), "ports": ports,
+                "shell": bool(grant.get("shell", False)), "expires": grant.get("expires"),
+                "subscription_key": grant.get("subscription_key"), "created": time.time()}
+
+        with cls._registry_lock():
+            registry = cls._read_registry()
+            registry['keys'].update(entries)
+            cls._write_registry(registry)
+            cls._write_authorized_keys(registry, username)
 
+        return private_keys
+
+    @classmethod
+    def _authorized_key_line(cls, public_key, ports=None, shell=False):
         options = []
 
         if not shell:
@@ -39,24 +126,193 @@ class SSHPortManager:
         option_str = ""
         if options:
             option_str = ",".join(options) + " "
-
-        # Append to authorized_keys
-        with open(SSH_AUTH_KEYS, "a") as f:
-            f.write(f"{option_str}{public_key}")
-
-        return private_key
+        return f"{option_str}{public_key.strip()}\n"
 
     @classmethod
     def remove_key(cls, pubkey):
         """Remove a public key from authorized_keys."""
-        if not os.path.exists(SSH_AUTH_KEYS):
-            return
-        with open(SSH_AUTH_KEYS, "r") as f:
-            lines = f.readlines()
-        with open(SSH_AUTH_KEYS, "w") as f:
-            for line in lines:
-                if pubkey.strip() not in line.strip():
-                    f.write(line)
+        cls.revoke_many([pubkey])
+        #keys added by hand to the default user's file are removed as well
+        cls.revoke_unmanaged([pubkey], users=[SSH_USER])
+
+    @classmethod
+    def _fingerprints(cls, keys):
+        fingerprints = set()
+        for key in keys:
+            if not isinstance(key, str):
+                continue
+            fingerprint = key if key.startswith("SHA256:") else cls._line_fingerprint(key)
+            #a malformed key can't be in authorized_keys, nothing to revoke
+            if fingerprint is not None:
+                fingerprints.add(fingerprint)
+        return fingerprints
+
+    @classmethod
+    def revoke_many(cls, keys):
+        """
+            Revokes registry keys given as fingerprints or public keys,
+            rewriting the authorized_keys file of each affected user once.
+            Keys the registry did not issue are left alone, see
+            revoke_unmanaged. Returns the number revoked.
+        """
+        fingerprints = cls._fingerprints(keys)
+        if not fingerprints:
+            return 0
+
+        with cls._registry_lock():
+            registry = cls._read_registry()
+            revoked = {}
+            for fingerprint in fingerprints:
+                entry = registry['keys'].pop(fingerprint, None)
+                if entry:
+                    revoked.setdefault(entry['user'], set()).add(fingerprint)
+            if revoked:
+                cls._write_registry(registry)
+            for username, dropped in revoked.items():
+                cls._write_authorized_keys(registry, username, drop=dropped)
+        return sum(len(dropped) for dropped in revoked.values())
+
+    @classmethod
+    def revoke_unmanaged(cls, keys, users=None):
+        """
+            Removes keys added to authorized_keys outside the registry, from
+            the files of `users` or, by default, of every user under /home.
+            Returns the number of lines removed.
+        """
+        fingerprints = cls._fingerprints(keys)
+        if not fingerprints:
+            return 0
+
+        removed = 0
+        with cls._registry_lock():
+            registry = cls._read_registry()
+            for username in (cls._users() if users is None else users):
+                found = [fp for fp in map(cls._line_fingerprint, cls._read_authorized_keys(username))
+                         if fp in fingerprints and not cls._is_managed(registry, fp, username)]
+                if found:
+                    cls._write_authorized_keys(registry, username, drop=fingerprints)
+                    removed += len(found)
+        return removed
+
+    @classmethod
+    def expire_keys(cls, now=None):
+        """
+            Revokes keys past their `expires` time or whose subscription is no
+            longer active. Returns the revoked fingerprints.
+        """
+        if now is None:
+            now = time.time()
+        expired = []
+        for fingerprint, entry in cls._read_registry()['keys'].items():
+            if entry.get('expires') is not None and entry['expires'] <= now:
+                expired.append(fingerprint)
+            elif entry.get('subscription_key') is not None:
+                from pyhypercycle_aim.subscription import SubscriptionManager
+                if not SubscriptionManager.is_active(entry['subscription_key']):
+                    expired.append(fingerprint)
+        if expired:
+            cls.revoke_many(expired)
+        return expired
+
+    @classmethod
+    async def expiry_loop(cls, interval=60):
+        """
+            Runs expire_keys every `interval` seconds. Add to a server's
+            on_startup to enforce key expiry.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, cls.expire_keys)
+            except Exception as e:
+                print(f"SSH key expiry failed: {e!r}")
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def list_keys(cls, username=None):
+        """Registry entries by fingerprint, optionally for one user."""
+        return {fingerprint: entry for fingerprint, entry in cls._read_registry()['keys'].items()
+                if username is None or entry['user'] == username}
+
+    ##########################
+    # Key registry
+    ##########################
+    @classmethod
+    def _registry_lock(cls):
+        os.makedirs(os.path.dirname(SSH_KEY_REGISTRY), exist_ok=True)
+        return FileLock(f"{SSH_KEY_REGISTRY}.lock")
+
+    @classmethod
+    def _line_fingerprint(cls, line):
+        try:
+            return key_fingerprint(line)
+        except (SSHPortManagerError, ValueError):
+            return None
+
+    @classmethod
+    def _read_registry(cls):
+        try:
+            with open(SSH_KEY_REGISTRY) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"keys": {}}
+
+    @classmethod
+    def _users(cls):
+        try:
+            return sorted(os.listdir("/home"))
+        except FileNotFoundError:
+            return []
+
+    @classmethod
+    def _read_authorized_keys(cls, username):
+        try:
+            with open(f"/home/{username}/.ssh/authorized_keys", "r") as f:
+                return [line.strip() for line in f if line.strip()]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    @classmethod
+    def _is_managed(cls, registry, fingerprint, username):
+        entry = registry['keys'].get(fingerprint)
+        return entry is not None and entry['user'] == username
+
+    @classmethod
+    def _unmanaged_lines(cls, registry, username, drop=()):
+        #lines the registry did not issue to this user, read fresh on every
+        #rewrite; comments and lines that aren't keys are kept as well
+        kept = []
+        for line in cls._read_authorized_keys(username):
+            fingerprint = cls._line_fingerprint(line)
+            if not cls._is_managed(registry, fingerprint, username) and fingerprint not in drop:
+                kept.append(line)
+        return kept
+
+    @classmethod
+    def _write_registry(cls, registry):
+        #registries written by older versions kept a snapshot of these lines
+        registry.pop('unmanaged', None)
+        tmp_path = f"{SSH_KEY_REGISTRY}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, SSH_KEY_REGISTRY)
+
+    @classmethod
+    def _write_authorized_keys(cls, registry, username, drop=()):
+        lines = [line + "\n" for line in cls._unmanaged_lines(registry, username, drop)]
+        for entry in registry['keys'].values():
+            if entry['user'] == username:
+                lines.append(cls._authorized_key_line(entry['public_key'], entry['ports'],
+                                                      entry['shell']))
+        authorized_keys = f"/home/{username}/.ssh/authorized_keys"
+        tmp_path = f"{authorized_keys}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(lines))
+        os.chmod(tmp_path, 0o600)
+        if os.path.exists(authorized_keys):
+            st = os.stat(authorized_keys)
+            os.chown(tmp_path, st.st_uid, st.st_gid)
+        os.replace(tmp_path, authorized_keys)
 
     @classmethod
     def ensure_user(cls, username):
@@ -72,7 +328,7 @@ class SSHPortManager:
     def ensure_ssh_dir(cls, username):
         """Ensure the .ssh directory and authorized_keys exist."""
         if not username.isalnum():
-            raise SSHPortManager("Username must be alpha-numeric.")
+            raise SSHPortManagerError("Username must be alpha-numeric.")
         ssh_dir = f"/home/{username}/.ssh"
         authorized_keys = f"{ssh_dir}/authorized_keys"
 
@@ -83,33 +339,36 @@ class SSHPortManager:
         os.chown(authorized_keys, os.getuid(), os.getgid())
 
     @classmethod
-    def list_users(cls, users=None):
-        """List users with their public keys."""
-        users = {}
-        home_base = "/home"
-
-        for username in os.listdir(home_base):
-            if users is not None and username not in users:
-                continue
-            ssh_dir = os.path.join(home_base, username, ".ssh")
-            auth_keys = os.path.join(ssh_dir, "authorized_keys")
-
-            if os.path.exists(auth_keys):
-                with open(auth_keys, "r") as f:
-                    keys = [line.strip() for line in f if line.strip()]
-                    if keys:
-                        users[username] = keys
-        return users
+    def list_users(cls, users=None, include_unmanaged=False):
+        """
+            List users with their public keys, from the registry. With
+            `include_unmanaged`, lines added to authorized_keys outside the
+            registry are read from the files of `users` (or of every user
+            under /home) and listed first.
+        """
+        registry = cls._read_registry()
+        result = {}
+        if include_unmanaged:
+            for username in (cls._users() if users is None else users):
+                lines = cls._unmanaged_lines(registry, username)
+                if lines:
+                    result[username] = lines
+        for entry in registry['keys'].values():
+            line = cls._authorized_key_line(entry['public_key'], entry['ports'], entry['shell'])
+            result.setdefault(entry['user'], []).append(line.strip())
+        if users is not None:
+            result = {username: keys for username, keys in result.items() if username in users}
+        return result
 
 
     @classmethod
     def init(cls, ssh_port=4001):
-        if not os.path.exists(cls.INIT_MARKER_FILE):
+        """Prepare SSHD settings. Call explicitly once at startup."""
+        if os.path.exists(INIT_MARKER_FILE):
             print("SSHPortManager already initialized, skipping.")
             return 
         ssh_port=int(ssh_port)
 
-        """Prepare SSHD settings."""
         cls.ensure_user(SSH_USER)
         cls.ensure_ssh_dir(SSH_USER)
 
@@ -130,7 +389,7 @@ class SSHPortManager:
         subprocess.run("systemctl restart sshd", shell=True, check=True)
 
         # Write the marker file
-        with open(cls.INIT_MARKER_FILE, "w") as f:
+        with open(INIT_MARKER_FILE, "w") as f:
             f.write("initialized")
 
 
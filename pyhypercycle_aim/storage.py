@@ -1,10 +1,23 @@
+import os
 import json
+import time
+import mmap
 import hashlib
+import bisect
+import threading
 from pathlib import Path
 from filelock import FileLock
+from pyhypercycle_aim.append_log import AppendLog
+from pyhypercycle_aim.sharding import resolve_shard_path, stripe_lock, iter_shard_files, \
+    ShardMigrator
 
 class StorageManager:
     _storage_dir = Path("/container_mount/storage_manager")
+    _index_log = None
+    _index_keys = []
+    _index_set = set()
+    _index_records = 0
+    _index_mutex = threading.Lock()
 
     @classmethod
     def _safe_key(cls, key: str) -> str:
@@ -13,12 +26,11 @@ class StorageManager:
 
     @classmethod
     def _file_path(cls, key: str) -> Path:
-        cls._storage_dir.mkdir(exist_ok=True)
-        return cls._storage_dir / f"{cls._safe_key(key)}.json"
+        return resolve_shard_path(cls._storage_dir, cls._safe_key(key))
 
     @classmethod
-    def _lock_path(cls, key: str) -> Path:
-        return cls._file_path(key).with_suffix(".lock")
+    def _lock(cls, key: str) -> FileLock:
+        return stripe_lock(cls._storage_dir, cls._safe_key(key))
 
     @classmethod
     def _load(cls, key: str) -> dict:
@@ -32,30 +44,275 @@ class StorageManager:
     def _save(cls, key: str, data: dict):
         # Ensure original key is stored
         data["_original_key"] = key
-        with open(cls._file_path(key), "w") as f:
+        path = cls._file_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        #replaced atomically, so lock-free readers such as rebuild_index
+        #never see a half-written file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
 
     @classmethod
     def store(cls, key: str, field: str, value):
-        with FileLock(str(cls._lock_path(key))):
+        with cls._lock(key):
+            is_new = not cls._file_path(key).exists()
             data = cls._load(key)
             data[field] = value
             cls._save(key, data)
+            if is_new:
+                cls._index_append("+", key)
 
     @classmethod
     def get(cls, key: str, field: str, default=None):
-        with FileLock(str(cls._lock_path(key))):
+        with cls._lock(key):
             data = cls._load(key)
             return data.get(field, default)
 
     @classmethod
     def delete(cls, key: str, field: str):
-        with FileLock(str(cls._lock_path(key))):
+        with cls._lock(key):
             data = cls._load(key)
             if field in data:
                 del data[field]
                 if len(data) == 1 and "_original_key" in data:
                     # Only _original_key left — delete file
                     cls._file_path(key).unlink(missing_ok=True)
+                    cls._index_append("-", key)
                 else:
                     cls._save(key, data)
+
+    @classmethod
+    def migrate_layout(cls, background=True):
+        """
+            Moves key files from the old flat directory layout into shard
+            directories. Runs in a daemon thread unless `background` is False.
+        """
+        migrator = ShardMigrator(cls._storage_dir)
+        if background:
+            migrator.start()
+        else:
+            migrator.run()
+        return migrator
+
+    ##########################
+    # Key index
+    #
+    # The index is an append log of ["+", key] / ["-", key] records next to
+    # the key files. Every process tails it into a sorted in-memory key list,
+    # so listing keys never touches the key files themselves.
+    ##########################
+    @classmethod
+    def _index(cls) -> AppendLog:
+        if cls._index_log is None or cls._index_log.path.parent != cls._storage_dir:
+            cls._storage_dir.mkdir(parents=True, exist_ok=True)
+            cls._index_log = AppendLog(cls._storage_dir / "_index.log")
+            cls._index_keys = []
+            cls._index_set = set()
+            cls._index_records = 0
+        return cls._index_log
+
+    @classmethod
+    def _index_append(cls, op: str, key: str):
+        log = cls._index()
+        with log.lock():
+            if not log.exists():
+                # First use on an existing directory: seed from the key files
+                cls.rebuild_index()
+            else:
+                log.append([[op, key]])
+
+    @classmethod
+    def _iter_key_files(cls):
+        return iter_shard_files(cls._storage_dir)
+
+    @classmethod
+    def rebuild_index(cls):
+        """
+            Rebuilds the key index by scanning every key file on disk.
+        """
+        log = cls._index()
+        with log.lock():
+            keys = set()
+            for path in cls._iter_key_files():
+                try:
+                    with open(path, "r") as f:
+                        keys.add(json.load(f)["_original_key"])
+                except (OSError, ValueError, KeyError):
+                    continue
+            log.rewrite([["+", key] for key in sorted(keys)])
+
+    @classmethod
+    def _refresh_index(cls):
+        log = cls._index()
+        if not log.exists():
+            cls.rebuild_index()
+        with cls._index_mutex:
+            reset, records = log.read_new()
+            if reset or records:
+                cls._apply_index_records(reset, records)
+                if cls._index_records > 4*len(cls._index_keys) + 1024:
+                    cls._compact_index(log)
+            return cls._index_keys
+
+    @classmethod
+    def _apply_index_records(cls, reset, records):
+        if reset:
+            cls._index_keys = []
+            cls._index_set = set()
+            cls._index_records = 0
+        keys = cls._index_keys
+        key_set = cls._index_set
+        for op, key in records:
+            if op == "+" and key not in key_set:
+                key_set.add(key)
+                bisect.insort(keys, key)
+            elif op == "-" and key in key_set:
+                key_set.discard(key)
+                del keys[bisect.bisect_left(keys, key)]
+        cls._index_records += len(records)
+
+    @classmethod
+    def _compact_index(cls, log):
+        #rewrites the log as one "+" per live key, so new processes don't
+        #replay every create and delete ever made
+        with log.lock():
+            #pick up anything appended before we took the lock
+            cls._apply_index_records(*log.read_new())
+            log.rewrite([["+", key] for key in cls._index_keys])
+            #skip over our own rewrite
+            log.read_new()
+            cls._index_records = len(cls._index_keys)
+
+    @classmethod
+    def keys(cls, prefix: str = "", start_after: str = None, limit: int = None) -> list:
+        """
+            Returns stored keys in sorted order, optionally filtered by
+            `prefix`. Use `start_after` with the last key of the previous
+            page and `limit` to paginate.
+        """
+        keys = cls._refresh_index()
+        with cls._index_mutex:
+            if start_after is not None and start_after >= prefix:
+                i = bisect.bisect_right(keys, start_after)
+            else:
+                i = bisect.bisect_left(keys, prefix)
+            out = []
+            while i < len(keys) and keys[i].startswith(prefix):
+                if limit is not None and len(out) >= limit:
+                    break
+                out.append(keys[i])
+                i += 1
+            return out
+
+    @classmethod
+    def iter_keys(cls, prefix: str = "", page_size: int = 1000):
+        """
+            Iterates over stored keys one page at a time.
+        """
+        last = None
+        while True:
+            page = cls.keys(prefix, start_after=last, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    @classmethod
+    def count(cls, prefix: str = "") -> int:
+        keys = cls._refresh_index()
+        if not prefix:
+            return len(keys)
+        return len(cls.keys(prefix))
+
+    ##########################
+    # Blob storage
+    #
+    # Large binary values are written once to a content-addressed file under
+    # _blobs/ and the key document only keeps a small reference to it, so
+    # updating other fields of the key never rewrites the blob.
+    ##########################
+    @classmethod
+    def _blob_path(cls, digest: str) -> Path:
+        return cls._storage_dir / "_blobs" / digest[:2] / digest
+
+    @classmethod
+    def _is_blob_ref(cls, value) -> bool:
+        return isinstance(value, dict) and "_blob" in value
+
+    @classmethod
+    def store_blob(cls, key: str, field: str, value):
+        """
+            Stores a bytes-like value (bytes, bytearray, memoryview, NumPy
+            array) as a blob and keeps a reference to it in `field`.
+        """
+        view = memoryview(value)
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        view = view.cast("B")
+        digest = hashlib.sha256(view).hexdigest()
+
+        path = cls._blob_path(digest)
+        if path.exists():
+            # Refresh mtime so a concurrent gc_blobs treats it as new
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(view)
+            os.replace(tmp_path, path)
+
+        ref = {"_blob": digest, "size": view.nbytes}
+        if hasattr(value, "dtype") and hasattr(value, "shape"):
+            ref["dtype"] = value.dtype.str
+            ref["shape"] = list(value.shape)
+        cls.store(key, field, ref)
+        return ref
+
+    @classmethod
+    def get_blob(cls, key: str, field: str, default=None):
+        """
+            Returns a read-only memoryview over the memory-mapped blob, or a
+            NumPy array view of it if a NumPy array was stored.
+        """
+        ref = cls.get(key, field)
+        if not cls._is_blob_ref(ref):
+            return default
+        if ref["size"] == 0:
+            buf = b""
+        else:
+            with open(cls._blob_path(ref["_blob"]), "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if "dtype" in ref:
+            import numpy
+            return numpy.frombuffer(buf, dtype=ref["dtype"]).reshape(ref["shape"])
+        return memoryview(buf)
+
+    @classmethod
+    def gc_blobs(cls, grace: float = 3600) -> int:
+        """
+            Deletes blobs no key references anymore. Blobs written within
+            the last `grace` seconds are kept, as their reference may not be
+            stored yet. Returns the number of blobs removed.
+        """
+        referenced = set()
+        for key in cls.iter_keys():
+            with cls._lock(key):
+                data = cls._load(key)
+            for value in data.values():
+                if cls._is_blob_ref(value):
+                    referenced.add(value["_blob"])
+
+        removed = 0
+        cutoff = time.time() - grace
+        for path in (cls._storage_dir / "_blobs").glob("*/*"):
+            if path.name in referenced:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
@@ -3,42 +3,129 @@ import time
 import hashlib
 import json
 import asyncio
+import heapq
+import bisect
+import random
+import threading
 from filelock import FileLock
 from pyhypercycle_aim.exceptions import SubscriptionError
+from pyhypercycle_aim.append_log import AppendLog
+from pyhypercycle_aim.sharding import resolve_shard_path, iter_shard_files, ShardMigrator, \
+    stripe_lock
 
 
 class SubscriptionManager:
     """
         Subscription helper for AIMs.
-        *Is not threadsafe. Wrap in a threadsafe mechanism if calling from
-         multiple threads/processes.
+        Safe to use from multiple threads and processes: updates of a key
+        run under one of a fixed set of striped file locks, and files are
+        replaced atomically so reads need no lock.
     """
+    _subscription_dir = "/container_mount/subscriptions"
+
+    #seconds between checks of the index for changes made by other processes
+    resync_interval = 1
+
+    #callback dispatch settings used by subscription_loop
+    callback_concurrency = 8
+    callback_retries = 2
+    callback_retry_delay = 1
+    #deadlines this many seconds apart are expired and dispatched as one batch
+    expiry_batch_window = 0.05
+
+    _index = {}
+    _index_state = {"log": None, "records": 0, "sorted": None}
+    _index_mutex = threading.Lock()
+
+    #key -> deadline of positive access verdicts, see has_access
+    _access_cache = {}
+
+    _expiry_heap = []
+    _expiry_deadlines = {}
+    _expiry_mutex = threading.Lock()
+    _expiry_wakeup = None
+
     @classmethod
-    def add_subscription(cls, key, metadata=None, delete_on_expire=True, years=0, months=0,
-                              weeks=0, days=0, hours=0, minutes=0, seconds=0):
+    def _key_hash(cls, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _key_path(cls, key):
+        return resolve_shard_path(cls._subscription_dir, cls._key_hash(key))
+
+    @classmethod
+    def _lock(cls, key):
+        return stripe_lock(cls._subscription_dir, cls._key_hash(key))
+
+    @classmethod
+    def _duration(cls, years=0, months=0, weeks=0, days=0, hours=0, minutes=0, seconds=0):
         deadline = seconds+minutes*60+hours*60*60+days*24*60*60+\
                    weeks*7*24*60*60+months*30*24*60*60+years*365*24*60*60
         if deadline ==0:
             raise SubscriptionError("Invalid deadline: time must be set.")
-        if metadata and not isinstance(metadata,dict):
-            raise SubscriptionError("Invalid metadata: must be instance of dict.")
+        return deadline
 
-        data  = cls.get_subscription(key)
+    @classmethod
+    def _renew(cls, data, deadline, metadata, delete_on_expire):
         data['metadata'] = metadata
-
         data['delete_on_expire'] = delete_on_expire
         data['exists'] = True
         if data['expired']:
             data['expired'] = False
             data['deadline'] = time.time()
         data['deadline'] += deadline
-        cls.save_subscription(data)
+        return data
+
+    @classmethod
+    def add_subscription(cls, key, metadata=None, delete_on_expire=True, years=0, months=0,
+                              weeks=0, days=0, hours=0, minutes=0, seconds=0):
+        deadline = cls._duration(years, months, weeks, days, hours, minutes, seconds)
+        if metadata and not isinstance(metadata,dict):
+            raise SubscriptionError("Invalid metadata: must be instance of dict.")
+
+        with cls._lock(key):
+            data  = cls.get_subscription(key)
+            cls._renew(data, deadline, metadata, delete_on_expire)
+            cls.save_subscription(data)
+        cls._schedule_expiry(key, data['deadline'])
+
+    @classmethod
+    def renew_many(cls, keys, metadata=None, delete_on_expire=True, years=0, months=0,
+                        weeks=0, days=0, hours=0, minutes=0, seconds=0):
+        """
+            Adds the same time to every key in `keys`. Keys are grouped by
+            lock stripe, so each stripe is locked and the index appended
+            once per group. Existing metadata is kept unless `metadata` is
+            given.
+        """
+        deadline = cls._duration(years, months, weeks, days, hours, minutes, seconds)
+        if metadata and not isinstance(metadata,dict):
+            raise SubscriptionError("Invalid metadata: must be instance of dict.")
+
+        groups = {}
+        for key in dict.fromkeys(keys):
+            groups.setdefault(id(cls._lock(key)), (cls._lock(key), []))[1].append(key)
+
+        saved = []
+        for lock, group in groups.values():
+            with lock:
+                records = []
+                for key in group:
+                    data = cls.get_subscription(key)
+                    cls._renew(data, deadline,
+                               metadata if metadata is not None else data['metadata'],
+                               delete_on_expire)
+                    cls.save_subscription(data, index=False)
+                    records.append(cls._index_record(data))
+                    saved.append(data)
+                #appended under the lock to keep per-key order in the index
+                cls._index_append(records)
+        for data in saved:
+            cls._schedule_expiry(data['key'], data['deadline'])
 
     @classmethod
     def get_subscription(cls, key):
-        os.makedirs("/container_mount/subscriptions", exist_ok=True)
-        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
-        key_path = f"/container_mount/subscriptions/{key_hash}.json"
+        key_path = cls._key_path(key)
 
         try: 
             data = json.loads(open(key_path).read())
@@ -48,68 +135,451 @@ class SubscriptionManager:
         return data
 
     @classmethod
-    def save_subscription(cls, data):
-        os.makedirs("/container_mount/subscriptions", exist_ok=True)
-        key = data['key']
-        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
-        key_path = f"/container_mount/subscriptions/{key_hash}.json"
-        open(key_path, "w").write(json.dumps(data))
-        
+    def save_subscription(cls, data, index=True):
+        with cls._lock(data['key']):
+            key_path = cls._key_path(data['key'])
+            os.makedirs(key_path.parent, exist_ok=True)
+            data['version'] = data.get('version', 0) + 1
+            tmp_path = f"{key_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(data))
+            os.replace(tmp_path, key_path)
+            if index:
+                cls._index_append([cls._index_record(data)])
+
+    @classmethod
+    def compare_and_set(cls, data):
+        """
+            Saves `data` only if the stored subscription still has the
+            version `data` was read with. Returns False on a conflict, in
+            which case the caller should re-read and retry.
+        """
+        with cls._lock(data['key']):
+            current = cls.get_subscription(data['key'])
+            if current.get('version', 0) != data.get('version', 0):
+                return False
+            cls.save_subscription(data)
+        if data['expired']:
+            cls._unschedule_expiry(data['key'])
+        else:
+            cls._schedule_expiry(data['key'], data['deadline'])
+        return True
+
     @classmethod
     def update_subscription(cls, *args, **kwargs):
         cls.add_subscription(*args, **kwargs)
     
     @classmethod
     def get_all_subscriptions(cls):
-        os.makedirs("/container_mount/subscriptions", exist_ok=True)
-        for filename in os.listdir("/container_mount/subscriptions"):
-            if filename.endswith(".json"):
-                yield json.loads(open(f"/container_mount/subscriptions/{filename}").read())
+        for path in iter_shard_files(cls._subscription_dir):
+            try:
+                yield json.loads(open(path).read())
+            except FileNotFoundError:
+                #removed or migrated while listing
+                pass
 
     @classmethod
     def remove_subscription(cls, key):
-        os.makedirs("/container_mount/subscriptions", exist_ok=True)
-        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
-        key_path = f"/container_mount/subscriptions/{key_hash}.json"
-        try:
-            os.remove(key_path)
-        except:
-            pass
+        with cls._lock(key):
+            key_path = cls._key_path(key)
+            try:
+                os.remove(key_path)
+            except:
+                pass
+            cls._index_append([{"key": key, "removed": True}])
+        cls._unschedule_expiry(key)
+        cls._access_cache.pop(key, None)
 
     @classmethod
-    def check_subscription(cls, key):
-        data = cls.get_subscription(key)
-        if data['deadline'] < time.time():
+    def migrate_layout(cls, background=True):
+        """
+            Moves subscription files from the old flat directory layout into
+            shard directories. Runs in a daemon thread unless `background`
+            is False.
+        """
+        migrator = ShardMigrator(cls._subscription_dir)
+        if background:
+            migrator.start()
+        else:
+            migrator.run()
+        return migrator
+
+    @classmethod
+    def _expire(cls, key):
+        """
+            Expires `key` if its deadline has passed, without running
+            callbacks. Returns "removed", "expired" or None.
+        """
+        with cls._lock(key):
+            data = cls.get_subscription(key)
+            if not data['exists'] or data['expired']:
+                return None
+            if data['deadline'] >= time.time():
+                #renewed in the meantime, possibly by another process
+                cls._schedule_expiry(key, data['deadline'])
+                return None
             if data['delete_on_expire']:
                 cls.remove_subscription(key)
-                try:
-                    cls.remove_callback(key)
-                except NotImplementedError:
-                    pass
-            else:
-                data['expired'] = True
-                try:
-                    cls.expired_callback(key)
-                except NotImplementedError:
-                    pass
+                return "removed"
+            data['expired'] = True
+            cls.save_subscription(data)
+            return "expired"
 
-                cls.save_subscription(data)
+    @classmethod
+    def _expire_many(cls, keys):
+        removed, expired = [], []
+        for key in keys:
+            result = cls._expire(key)
+            if result == "removed":
+                removed.append(key)
+            elif result == "expired":
+                expired.append(key)
+        return removed, expired
+
+    @classmethod
+    def check_subscription(cls, key):
+        result = cls._expire(key)
+        try:
+            if result == "removed":
+                cls.remove_callback(key)
+            elif result == "expired":
+                cls.expired_callback(key)
+        except NotImplementedError:
+            pass
 
     @classmethod
     def check_all_subscriptions(cls):
         for subscription in cls.get_all_subscriptions():
             cls.check_subscription(subscription['key'])
 
+    ##########################
+    # Subscription index
+    #
+    # Every save/remove also appends {key, deadline, expired} to an append
+    # log in the subscription directory. Each process tails that log into
+    # an in-memory map, so hot-path checks cost a stat() and a dict lookup
+    # and still see writes from other processes.
+    ##########################
+    @classmethod
+    def _subscription_index(cls):
+        state = cls._index_state
+        log_path = os.path.join(cls._subscription_dir, "_index.log")
+        if state["log"] is None or str(state["log"].path) != log_path:
+            os.makedirs(cls._subscription_dir, exist_ok=True)
+            with cls._index_mutex:
+                state["log"] = AppendLog(log_path)
+                state["records"] = 0
+                state["sorted"] = None
+                cls._index.clear()
+        return state["log"]
+
+    @classmethod
+    def _index_record(cls, data):
+        return {"key": data['key'], "deadline": data['deadline'],
+                "expired": bool(data['expired'])}
+
+    @classmethod
+    def _index_append(cls, records):
+        log = cls._subscription_index()
+        with log.lock():
+            if not log.exists():
+                #first use on an existing directory: seed from the files
+                cls.rebuild_index()
+            else:
+                log.append(records)
+
+    @classmethod
+    def rebuild_index(cls):
+        """
+            Rebuilds the subscription index from the subscription files.
+        """
+        log = cls._subscription_index()
+        with log.lock():
+            records = [cls._index_record(data) for data in cls.get_all_subscriptions()]
+            log.rewrite(records)
+
+    @classmethod
+    def _refresh_index(cls):
+        log = cls._subscription_index()
+        if not log.loaded() and not log.exists():
+            cls.rebuild_index()
+        with cls._index_mutex:
+            reset, records = log.read_new()
+            if reset or records:
+                cls._apply_index_records(reset, records)
+                if cls._index_state["records"] > 4*len(cls._index) + 1024:
+                    cls._compact_index(log)
+            return cls._index
+
+    @classmethod
+    def _apply_index_records(cls, reset, records):
+        state = cls._index_state
+        if reset:
+            for key in cls._index:
+                cls._unschedule_expiry(key)
+            cls._index.clear()
+            state["records"] = 0
+        for r in records:
+            if r.get("removed"):
+                cls._index.pop(r['key'], None)
+                cls._unschedule_expiry(r['key'])
+            else:
+                cls._index[r['key']] = (r['deadline'], r['expired'])
+                if r['expired']:
+                    cls._unschedule_expiry(r['key'])
+                else:
+                    cls._schedule_expiry(r['key'], r['deadline'])
+        state["records"] += len(records)
+        state["sorted"] = None
+
+    @classmethod
+    def _compact_index(cls, log):
+        with log.lock():
+            #pick up anything appended before we took the lock
+            cls._apply_index_records(*log.read_new())
+            log.rewrite([{"key": key, "deadline": deadline, "expired": expired}
+                         for key, (deadline, expired) in cls._index.items()])
+            #skip over our own rewrite
+            log.read_new()
+            cls._index_state["records"] = len(cls._index)
+
+    @classmethod
+    def is_active(cls, key):
+        entry = cls._refresh_index().get(key)
+        return entry is not None and not entry[1] and entry[0] > time.time()
+
+    @classmethod
+    def remaining(cls, key):
+        """
+            Seconds left on an active subscription, 0 otherwise.
+        """
+        entry = cls._refresh_index().get(key)
+        if entry is None or entry[1]:
+            return 0
+        return max(0, entry[0] - time.time())
+
+    @classmethod
+    def get_deadline(cls, key):
+        entry = cls._refresh_index().get(key)
+        if entry is None or entry[1]:
+            return None
+        return entry[0]
+
+    @classmethod
+    def has_access(cls, key):
+        """
+            Like is_active, but positive verdicts are cached until the
+            deadline known at the time. A removal made by another process is
+            not seen before that deadline.
+        """
+        now = time.time()
+        deadline = cls._access_cache.get(key)
+        if deadline is not None and deadline > now:
+            return True
+        deadline = cls.get_deadline(key)
+        if deadline is None or deadline <= now:
+            cls._access_cache.pop(key, None)
+            return False
+        if len(cls._access_cache) > 10000:
+            for k, d in list(cls._access_cache.items()):
+                if d <= now:
+                    cls._access_cache.pop(k, None)
+        cls._access_cache[key] = deadline
+        return True
+
+    @classmethod
+    def subscriptions_expiring(cls, start=None, end=None):
+        """
+            Returns [(key, deadline)] of unexpired subscriptions with
+            start <= deadline < end, ordered by deadline.
+        """
+        cls._refresh_index()
+        with cls._index_mutex:
+            if cls._index_state["sorted"] is None:
+                cls._index_state["sorted"] = sorted((deadline, key) for key, (deadline, expired)
+                                                    in cls._index.items() if not expired)
+            entries = cls._index_state["sorted"]
+        lo = 0 if start is None else bisect.bisect_left(entries, (start,))
+        out = []
+        for deadline, key in entries[lo:]:
+            if end is not None and deadline >= end:
+                break
+            out.append((key, deadline))
+        return out
+
+    ##########################
+    # Expiry schedule
+    #
+    # A min-heap of (deadline, key) for unexpired subscriptions. Entries are
+    # invalidated lazily: only the deadline in _expiry_deadlines is current.
+    ##########################
+    @classmethod
+    def _schedule_expiry(cls, key, deadline):
+        with cls._expiry_mutex:
+            cls._expiry_deadlines[key] = deadline
+            heap = cls._expiry_heap
+            heapq.heappush(heap, (deadline, key))
+            if len(heap) > 2*len(cls._expiry_deadlines) + 1024:
+                #drop superseded entries left behind by renewals
+                heap[:] = [(d, k) for k, d in cls._expiry_deadlines.items()]
+                heapq.heapify(heap)
+            is_next = heap[0] == (deadline, key)
+        if is_next and cls._expiry_wakeup:
+            loop, event = cls._expiry_wakeup
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                #loop already closed
+                pass
+
+    @classmethod
+    def _unschedule_expiry(cls, key):
+        with cls._expiry_mutex:
+            cls._expiry_deadlines.pop(key, None)
+
+    @classmethod
+    def rebuild_expiry_schedule(cls):
+        cls._refresh_index()
+        with cls._index_mutex:
+            deadlines = {key: deadline for key, (deadline, expired)
+                         in cls._index.items() if not expired}
+        heap = [(deadline, key) for key, deadline in deadlines.items()]
+        heapq.heapify(heap)
+        with cls._expiry_mutex:
+            cls._expiry_heap[:] = heap
+            cls._expiry_deadlines.clear()
+            cls._expiry_deadlines.update(deadlines)
+
+    @classmethod
+    def _pop_due_expiries(cls, now):
+        """
+            Once a deadline has passed, pops every key due up to
+            `expiry_batch_window` seconds later as well. Returns the keys
+            and the latest of their deadlines.
+        """
+        due = []
+        latest = None
+        with cls._expiry_mutex:
+            heap = cls._expiry_heap
+            while heap and cls._expiry_deadlines.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            if not heap or heap[0][0] > now:
+                return due, latest
+            cutoff = now + cls.expiry_batch_window
+            while heap and heap[0][0] <= cutoff:
+                deadline, key = heapq.heappop(heap)
+                if cls._expiry_deadlines.get(key) == deadline:
+                    del cls._expiry_deadlines[key]
+                    due.append(key)
+                    latest = deadline
+        return due, latest
+
+    @classmethod
+    def _next_expiry(cls):
+        with cls._expiry_mutex:
+            heap = cls._expiry_heap
+            while heap and cls._expiry_deadlines.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    @classmethod
+    async def _run_callback(cls, semaphore, func, *args):
+        async with semaphore:
+            for attempt in range(cls.callback_retries+1):
+                try:
+                    if asyncio.iscoroutinefunction(func):
+                        await func(*args)
+                    else:
+                        await asyncio.get_running_loop().run_in_executor(None, func, *args)
+                    return
+                except NotImplementedError:
+                    raise
+                except Exception as e:
+                    if attempt == cls.callback_retries:
+                        print(f"Subscription callback {func.__name__}{args} failed: {e!r}")
+                        return
+                    delay = cls.callback_retry_delay * 2**attempt
+                    await asyncio.sleep(delay * (0.5 + random.random()))
+
+    @classmethod
+    async def _dispatch_callbacks(cls, semaphore, batch_func, func, keys):
+        if not keys:
+            return
+        try:
+            await cls._run_callback(semaphore, batch_func, keys)
+            return
+        except NotImplementedError:
+            pass
+        try:
+            await asyncio.gather(*[cls._run_callback(semaphore, func, key) for key in keys])
+        except NotImplementedError:
+            pass
+
     @classmethod
     async def subscription_loop(cls):
+        """
+            Expires subscriptions as their deadlines arrive. File I/O runs in
+            an executor and callbacks are dispatched in the background, at
+            most `callback_concurrency` at a time, retried
+            `callback_retries` times.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        cls._expiry_wakeup = (loop, event)
+        semaphore = asyncio.Semaphore(cls.callback_concurrency)
+        pending = set()
+        await loop.run_in_executor(None, cls.rebuild_expiry_schedule)
+        last_sync = time.time()
         while True:
-            cls.check_all_subscriptions()
-            await asyncio.sleep(1)
+            event.clear()
+            now = time.time()
+            if now - last_sync >= cls.resync_interval:
+                #schedules whatever other processes appended to the index
+                await loop.run_in_executor(None, cls._refresh_index)
+                last_sync = now
+            due, latest = cls._pop_due_expiries(now)
+            if due:
+                if latest > time.time():
+                    #the rest of the batch is due within the window
+                    await asyncio.sleep(latest - time.time())
+                removed, expired = await loop.run_in_executor(None, cls._expire_many, due)
+                for batch_func, func, keys in [(cls.remove_batch_callback, cls.remove_callback, removed),
+                                               (cls.expired_batch_callback, cls.expired_callback, expired)]:
+                    if keys:
+                        task = asyncio.create_task(cls._dispatch_callbacks(semaphore, batch_func,
+                                                                           func, keys))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+
+            timeout = last_sync + cls.resync_interval - time.time()
+            next_deadline = cls._next_expiry()
+            if next_deadline is not None:
+                timeout = min(timeout, next_deadline - time.time())
+            try:
+                await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    def remove_callback(cls, key):
+        raise NotImplementedError()
+
+    @classmethod
+    def expired_callback(cls, key):
+        raise NotImplementedError()
 
     @classmethod
-    def remove_callback(cls):
+    def remove_batch_callback(cls, keys):
+        """
+            Override to handle all keys removed in one tick with one call.
+            Falls back to remove_callback per key otherwise.
+        """
         raise NotImplementedError()
 
     @classmethod
-    def expired_callback(cls):
+    def expired_batch_callback(cls, keys):
+        """
+            Override to handle all keys expired in one tick with one call.
+            Falls back to expired_callback per key otherwise.
+        """
         raise NotImplementedError()
@@ -1,17 +1,27 @@
 import asyncio
 import concurrent.futures
+import hashlib
 import json
 import signal
 import sys
 
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, JSONResponse
+from starlette.responses import HTMLResponse, JSONResponse, Response
 
 from pyhypercycle_aim.exceptions import AppException
-
-
-def aim_uri(uri=None, methods=None, endpoint_manifest=None, **kwargs):
+from pyhypercycle_aim.subscription import SubscriptionManager
+
+
+def aim_uri(uri=None, methods=None, endpoint_manifest=None, requires_subscription=False,
+            subscription_manager=None, **kwargs):
+    """
+        Marks a server method as an AIM endpoint.
+        `requires_subscription` rejects calls from users without an active
+        subscription before the handler runs. Pass True to use the caller's
+        address as the subscription key, or a function mapping the request
+        to a key. `subscription_manager` defaults to SubscriptionManager.
+    """
     if not uri:
         raise AppException("`uri` must be defined")
     if not methods:
@@ -21,9 +31,31 @@ def aim_uri(uri=None, methods=None, endpoint_manifest=None, **kwargs):
 
     endpoint_manifest['uri'] = uri
     endpoint_manifest['input_methods'] = methods
+    if requires_subscription:
+        endpoint_manifest['requires_subscription'] = True
+        if subscription_manager is None:
+            subscription_manager = SubscriptionManager
+    is_websocket = "websocket" in [x.lower() for x in methods]
+
     def decorator(func):
-        if asyncio.iscoroutinefunction(func):
+        if requires_subscription and is_websocket:
             async def wrapper(*args, **kwargs):
+                if _subscription_denied(args[-1], requires_subscription, subscription_manager):
+                    await args[-1].close(code=1008)
+                    return
+                return await func(*args, **kwargs)
+            wrapper._uri = uri
+            wrapper._methods = methods
+            wrapper._endpoint_manifest = endpoint_manifest
+            wrapper._kwargs = kwargs
+            return wrapper
+        elif asyncio.iscoroutinefunction(func):
+            async def wrapper(*args, **kwargs):
+                if requires_subscription:
+                    denied = _subscription_denied(args[-1], requires_subscription,
+                                                  subscription_manager)
+                    if denied:
+                        return denied
                 return await func(*args, **kwargs)
             wrapper._uri = uri
             wrapper._methods = methods
@@ -32,6 +64,11 @@ def aim_uri(uri=None, methods=None, endpoint_manifest=None, **kwargs):
             return wrapper
         else:
             def wrapper(*args, **kwargs):
+                if requires_subscription:
+                    denied = _subscription_denied(args[-1], requires_subscription,
+                                                  subscription_manager)
+                    if denied:
+                        return denied
                 return func(*args, **kwargs)
             wrapper._uri = uri
             wrapper._methods = methods
@@ -41,6 +78,25 @@ def aim_uri(uri=None, methods=None, endpoint_manifest=None, **kwargs):
     return decorator
 
 
+def _subscription_denied(request, requires_subscription, subscription_manager):
+    #cost-only calls are gated too: a handler that ignores cost_only would
+    #otherwise serve its full response to unsubscribed users
+    if callable(requires_subscription):
+        key = requires_subscription(request)
+    else:
+        key = request.headers.get("hypc_user", None)
+    if not key:
+        if request.headers.get("hypc_is_private", None):
+            error = "Private calls cannot be used with subscription endpoints."
+        else:
+            error = "User address missing."
+        return JSONResponseCORS({"error": error}, status_code=403, costs=[])
+    if not subscription_manager.has_access(key):
+        return JSONResponseCORS({"error": "An active subscription is required."},
+                                status_code=403, costs=[])
+    return None
+
+
 def to_async(function, *args, **kwargs):
     executor = concurrent.futures.ThreadPoolExecutor()
 
@@ -70,6 +126,23 @@ def JSONResponseCORS(data, headers=None, costs=None, status_code=200):
     return JSONResponse(data, headers=headers, status_code=status_code)
 
 
+def manifest_etag(manifest_json):
+    return '"' + hashlib.sha256(json.dumps(manifest_json, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+
+def manifest_response(request, manifest_json, etag=None):
+    """
+        Serves manifest.json with an ETag, answering 304 Not Modified when
+        the client's If-None-Match already names this version. Pass the
+        `etag` computed with manifest_etag when the manifest was built.
+    """
+    if etag is None:
+        etag = manifest_etag(manifest_json)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponseCORS(manifest_json, headers={"ETag": etag})
+
+
 def HTMLResponseCORS(data, headers=None, costs=None):
     cors_headers = {
         "Access-Control-Allow-Origin": "*",
@@ -118,8 +191,10 @@ def handle_interrupt(signal, frame):
     sys.exit(0)
 
 
-# Register the signal handler
-signal.signal(signal.SIGINT, handle_interrupt)
+def install_interrupt_handler():
+    # Register the signal handler. Called by the servers' run(), not at
+    # import time, so importing the package leaves signal handling alone.
+    signal.signal(signal.SIGINT, handle_interrupt)
 
 HTML_404_PAGE = ""
 HTML_500_PAGE = ""
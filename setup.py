@@ -8,7 +8,8 @@ def main(args=None):
 
     setup_required_packages = []
 
-    required_packages = ["starlette", "uvicorn[standard]", "filelock", "web3", "websocket-client"
+    required_packages = ["starlette", "uvicorn[standard]", "filelock", "web3", "websocket-client",
+                         "cryptography"
                         ]
 
     test_required_packages = ["nose", "coverage"]
@@ -0,0 +1,147 @@
+import multiprocessing
+from pathlib import Path
+import pytest
+from pyhypercycle_aim.append_log import AppendLog
+from pyhypercycle_aim.storage import StorageManager
+
+
+def _append(path, worker, count):
+    log = AppendLog(path)
+    for i in range(count):
+        log.append([{"worker": worker, "i": i}])
+
+
+def _rewrite(path, records):
+    AppendLog(path).rewrite(records)
+
+
+def _store(worker, count):
+    for i in range(count):
+        StorageManager.store(f"w{worker}/{i:03d}", "value", i)
+
+
+def _start_forked(target, args_list):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=target, args=args) for args in args_list]
+    for p in procs:
+        p.start()
+    return procs
+
+
+def _join(procs):
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+
+def test_tail_while_other_processes_append(tmp_path):
+    path = tmp_path / "log.jsonl"
+    reader = AppendLog(path)
+    seen = []
+    procs = _start_forked(_append, [(path, w, 200) for w in range(4)])
+    while any(p.is_alive() for p in procs):
+        reset, records = reader.read_new()
+        #only the first read, when the file appears, may report a reset
+        assert not reset or not seen
+        seen.extend(records)
+    _join(procs)
+    seen.extend(reader.read_new()[1])
+    #every record seen exactly once and in per-writer order
+    assert len(seen) == 800
+    for w in range(4):
+        assert [r["i"] for r in seen if r["worker"] == w] == list(range(200))
+
+
+def test_tail_detects_rewrite_by_other_process(tmp_path):
+    path = tmp_path / "log.jsonl"
+    reader = AppendLog(path)
+    reader.append([{"i": i} for i in range(10)])
+    assert len(reader.read_new()[1]) == 10
+    _join(_start_forked(_rewrite, [(path, [{"i": 0}])]))
+    reset, records = reader.read_new()
+    assert reset and records == [{"i": 0}]
+    _join(_start_forked(_append, [(path, 0, 3)]))
+    assert reader.read_new() == (False, [{"worker": 0, "i": i} for i in range(3)])
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(StorageManager, "_storage_dir", Path(tmp_path))
+    monkeypatch.setattr(StorageManager, "_index_log", None)
+    return StorageManager
+
+
+def test_storage_index_sees_other_processes(storage):
+    storage.store("parent", "value", 1)
+    assert storage.keys() == ["parent"]
+    _join(_start_forked(_store, [(w, 50) for w in range(4)]))
+    assert storage.count() == 201
+    assert storage.keys("w2/", limit=3) == ["w2/000", "w2/001", "w2/002"]
+    storage.delete("w2/000", "value")
+    assert storage.count("w2/") == 49
+
+
+def test_torn_line_is_skipped(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = AppendLog(path)
+    log.append([{"i": 0}])
+    assert log.read_new()[1] == [{"i": 0}]
+    #a writer killed mid-line, then the next writer's complete record
+    with open(path, "a") as f:
+        f.write('{"i": 1, "tor')
+    log.append([{"i": 2}, {"i": 3}])
+    assert log.read_new() == (False, [{"i": 2}, {"i": 3}])
+    assert log.read_new() == (False, [])
+
+
+def test_subscription_active_after_torn_index_line(tmp_path, monkeypatch):
+    import threading
+    from pyhypercycle_aim.subscription import SubscriptionManager
+    monkeypatch.setattr(SubscriptionManager, "_subscription_dir", str(tmp_path))
+    monkeypatch.setattr(SubscriptionManager, "_index", {})
+    monkeypatch.setattr(SubscriptionManager, "_index_state", {"log": None, "records": 0, "sorted": None})
+    monkeypatch.setattr(SubscriptionManager, "_index_mutex", threading.Lock())
+    monkeypatch.setattr(SubscriptionManager, "_expiry_heap", [])
+    monkeypatch.setattr(SubscriptionManager, "_expiry_deadlines", {})
+    SubscriptionManager.add_subscription("first", days=1)
+    assert SubscriptionManager.is_active("first")
+    with open(tmp_path / "_index.log", "a") as f:
+        f.write('{"key": "dead')
+    SubscriptionManager.add_subscription("paying", days=1)
+    assert SubscriptionManager.is_active("paying")
+    assert SubscriptionManager.is_active("first")
+
+
+def test_storage_index_compacted(storage):
+    storage.store("kept", "value", 1)
+    for i in range(700):
+        storage.store(f"tmp{i}", "value", i)
+        storage.delete(f"tmp{i}", "value")
+    assert storage.keys() == ["kept"]
+    with open(storage._storage_dir / "_index.log") as f:
+        assert len(f.readlines()) < 10
+    #a fresh process replays the compacted log
+    storage._index_log = None
+    assert storage.keys() == ["kept"]
+
+
+def test_storage_rebuild_sees_keys_being_rewritten(storage):
+    import threading
+    storage.store("busy", "value", "x")
+    stop = threading.Event()
+
+    def rewrite():
+        i = 0
+        while not stop.is_set():
+            storage.store("busy", "value", "x" * (i % 5000))
+            i += 1
+
+    writer = threading.Thread(target=rewrite)
+    writer.start()
+    try:
+        for _ in range(50):
+            storage.rebuild_index()
+            assert storage.keys() == ["busy"]
+    finally:
+        stop.set()
+        writer.join()
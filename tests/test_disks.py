@@ -0,0 +1,233 @@
+import os
+import time
+import shutil
+import pytest
+from pyhypercycle_aim.disks import DiskSpaceManager
+from pyhypercycle_aim.exceptions import DiskError
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    jobs = {}
+    monkeypatch.setattr(DiskSpaceManager, "_jobs", jobs)
+    return jobs
+
+
+@pytest.mark.parametrize("args", [("1K", 1, "bad-id"), ("1G", 1, "disk1"), ("1K", -1, "disk1")])
+def test_invalid_request_creates_no_job(jobs, args):
+    with pytest.raises(DiskError):
+        DiskSpaceManager.provision_disk(*args)
+    with pytest.raises(DiskError):
+        DiskSpaceManager.add_disk(*args)
+    assert DiskSpaceManager.list_provision_jobs() == []
+
+
+def test_finished_jobs_are_evicted(jobs, monkeypatch):
+    monkeypatch.setattr(DiskSpaceManager, "job_retention", 60)
+    old = DiskSpaceManager._new_job("old")
+    recent = DiskSpaceManager._new_job("recent")
+    running = DiskSpaceManager._new_job("running")
+    DiskSpaceManager._update_job(old, status="done", finished=time.time() - 120)
+    DiskSpaceManager._update_job(recent, status="failed", finished=time.time() - 30)
+    new = DiskSpaceManager._new_job("new")
+    assert DiskSpaceManager.get_provision_job(old['job_id']) is None
+    assert sorted(jobs) == sorted([recent['job_id'], running['job_id'], new['job_id']])
+
+
+@pytest.fixture
+def disk_dirs(tmp_path, monkeypatch):
+    from pyhypercycle_aim import disks
+    vd_dir = tmp_path / "virtual_disks"
+    mounts_dir = tmp_path / "disk_mounts"
+    monkeypatch.setattr(disks, "VIRTUAL_DISKS_DIR", str(vd_dir))
+    monkeypatch.setattr(disks, "DISK_MOUNTS_DIR", str(mounts_dir))
+    monkeypatch.setattr(DiskSpaceManager, "_ledger_path", str(vd_dir / "ledger.json"))
+    monkeypatch.setattr(DiskSpaceManager, "_ledger_locks", {})
+    monkeypatch.setattr(DiskSpaceManager, "_usage_samples", {})
+    monkeypatch.setattr(DiskSpaceManager, "_usage_levels", {})
+    DiskSpaceManager._ensure_dirs()
+    return vd_dir, mounts_dir
+
+
+def _fake_disk(vd_dir, mounts_dir, disk_id, size, mounted):
+    vd = vd_dir / f"disk_{disk_id}.iso"
+    with open(vd, "wb") as f:
+        f.truncate(size)
+    (mounts_dir / disk_id).mkdir()
+    return {str(mounts_dir / disk_id): str(vd)} if mounted else {}
+
+
+def test_sample_usage_skips_stray_disk_files(disk_dirs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    mounts = _fake_disk(vd_dir, mounts_dir, "disk1", 1024*1024, mounted=True)
+    (vd_dir / "disk_a-b.iso").write_bytes(b"stray")
+    monkeypatch.setattr(DiskSpaceManager, "_read_mounts", classmethod(lambda cls: mounts))
+    assert sorted(DiskSpaceManager.reconcile_ledger()['disks']) == ["disk1"]
+
+    alerts = []
+    monkeypatch.setattr(DiskSpaceManager, "soft_threshold", 0.0)
+    monkeypatch.setattr(DiskSpaceManager, "hard_threshold", 2.0)
+    monkeypatch.setattr(DiskSpaceManager, "soft_limit_callback",
+                        classmethod(lambda cls, disk_id, sample: alerts.append(disk_id)))
+    samples = DiskSpaceManager.sample_usage()
+    assert list(samples) == ["disk1"]
+    assert samples["disk1"]["mounted"] and "fs_fraction" in samples["disk1"]
+    assert alerts == ["disk1"]
+    #only alerted when crossing into the level
+    DiskSpaceManager.sample_usage()
+    assert alerts == ["disk1"]
+    assert len(DiskSpaceManager.get_usage_history("disk1")) == 2
+
+
+def test_sample_usage_tolerates_bad_ids_in_old_ledgers(disk_dirs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    _fake_disk(vd_dir, mounts_dir, "disk1", 4096, mounted=False)
+    ledger = DiskSpaceManager.reconcile_ledger()
+    ledger['disks']["a-b"] = {"allocated": 5, "actual": 0}
+    DiskSpaceManager._write_ledger(ledger)
+    monkeypatch.setattr(DiskSpaceManager, "_read_mounts", classmethod(lambda cls: {}))
+    assert list(DiskSpaceManager.sample_usage()) == ["disk1"]
+
+
+def test_default_limit_callbacks_do_not_raise(disk_dirs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    mounts = _fake_disk(vd_dir, mounts_dir, "disk1", 4096, mounted=True)
+    monkeypatch.setattr(DiskSpaceManager, "_read_mounts", classmethod(lambda cls: mounts))
+    monkeypatch.setattr(DiskSpaceManager, "soft_threshold", 0.0)
+    monkeypatch.setattr(DiskSpaceManager, "hard_threshold", 0.0)
+    DiskSpaceManager.soft_limit_callback("disk1", {"fs_fraction": 0.5})
+    DiskSpaceManager.sample_usage()
+    assert DiskSpaceManager.usage_metrics()["disk1"]["level"] == "hard"
+
+
+def _wait_job(job_id, timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        job = DiskSpaceManager.get_provision_job(job_id)
+        if job['finished'] is not None:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+needs_mkfs = pytest.mark.skipif(shutil.which("mkfs.ext4") is None, reason="needs mkfs.ext4")
+
+
+@needs_mkfs
+@pytest.mark.parametrize("allocation", ["sparse", "fallocate"])
+def test_provision_disk_job(disk_dirs, jobs, monkeypatch, allocation):
+    vd_dir, mounts_dir = disk_dirs
+    mounted = []
+    monkeypatch.setattr(DiskSpaceManager, "_mount_disk", classmethod(lambda cls, d: mounted.append(d)))
+    size = 16*1024*1024
+    job_id = DiskSpaceManager.provision_disk("1M", 16, "disk1", allocation=allocation)
+    #reserved before the call returns
+    assert DiskSpaceManager.list_disks()['total'] == size
+    job = _wait_job(job_id)
+    assert job['status'] == "done" and job['progress'] == 1.0 and job['error'] is None
+    assert mounted == ["disk1"]
+    st = os.stat(vd_dir / "disk_disk1.iso")
+    assert st.st_size == size
+    if allocation == "sparse":
+        #only the blocks mkfs wrote are allocated
+        assert st.st_blocks*512 < size/2
+    else:
+        assert st.st_blocks*512 >= size
+    assert DiskSpaceManager.disk_usage("disk1")['actual'] == st.st_blocks*512
+
+
+@needs_mkfs
+def test_failed_provision_releases_reservation(disk_dirs, jobs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    def fail(cls, disk_id):
+        raise DiskError("mount failed")
+    monkeypatch.setattr(DiskSpaceManager, "_mount_disk", classmethod(fail))
+    job = _wait_job(DiskSpaceManager.provision_disk("1M", 8, "disk1"))
+    assert job['status'] == "failed" and job['error'] == "mount failed"
+    assert not (vd_dir / "disk_disk1.iso").exists()
+    assert DiskSpaceManager.list_disks()['disks'] == []
+    with pytest.raises(DiskError, match="mount failed"):
+        DiskSpaceManager.add_disk("1M", 8, "disk1")
+
+
+def test_ledger_totals_after_add_remove_reconcile(disk_dirs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    monkeypatch.setattr(DiskSpaceManager, "_unmount_disk", classmethod(lambda cls, d: None))
+    DiskSpaceManager._reserve_disk("1M", 2, "disk1", None, "sparse")
+    DiskSpaceManager._reserve_disk("1K", 64, "disk2", None, "sparse")
+    assert DiskSpaceManager.list_disks() == {"total": 2*1024*1024 + 64*1024, "total_actual": 0,
+                                             "disks": [("disk1", 2*1024*1024), ("disk2", 64*1024)]}
+
+    #the quota check uses the ledger total
+    with pytest.raises(DiskError, match="Not enough space"):
+        DiskSpaceManager._reserve_disk("1K", 1, "disk3", 2*1024*1024 + 64*1024, "sparse")
+    assert not (vd_dir / "disk_disk3.iso").exists()
+
+    DiskSpaceManager.remove_disk("disk1")
+    assert DiskSpaceManager.list_disks()['disks'] == [("disk2", 64*1024)]
+    assert DiskSpaceManager.list_disks()['total'] == 64*1024
+
+    #changes made behind the ledger's back are picked up by reconcile_ledger
+    (vd_dir / "disk_disk2.iso").write_bytes(b"x"*8192)
+    _fake_disk(vd_dir, mounts_dir, "disk4", 4096, mounted=False)
+    ledger = DiskSpaceManager.reconcile_ledger()
+    assert ledger['total_allocated'] == 8192 + 4096
+    assert ledger['total_actual'] == sum(os.stat(vd_dir / f"disk_{d}.iso").st_blocks*512
+                                         for d in ["disk2", "disk4"])
+    assert DiskSpaceManager.list_disks()['disks'] == [("disk2", 8192), ("disk4", 4096)]
+
+
+def test_missing_ledger_rebuilt_from_files(disk_dirs):
+    vd_dir, mounts_dir = disk_dirs
+    _fake_disk(vd_dir, mounts_dir, "disk1", 4096, mounted=False)
+    assert not (vd_dir / "ledger.json").exists()
+    assert DiskSpaceManager.list_disks()['total'] == 4096
+    assert DiskSpaceManager.disk_usage("disk1")['allocated'] == 4096
+    with pytest.raises(DiskError):
+        DiskSpaceManager.disk_usage("disk2")
+
+
+MOUNTINFO = os.path.join(os.path.dirname(__file__), "data", "mountinfo")
+
+
+def test_read_mounts_parses_mountinfo(monkeypatch):
+    from pyhypercycle_aim import disks
+    monkeypatch.setattr(disks, "MOUNTINFO_PATH", MOUNTINFO)
+    mounts = DiskSpaceManager._read_mounts()
+    assert mounts["/"] == "overlay"
+    assert mounts["/proc"] == "proc"
+    assert mounts["/container_mount/disk_mounts/disk1"] == "/container_mount/virtual_disks/disk_disk1.iso"
+    #any number of optional fields before the separator, octal escapes undone
+    assert mounts["/container_mount/disk_mounts/disk3"] == "/srv/other.iso"
+    assert mounts["/mnt/with space"] == "tmp\\fs"
+
+    assert DiskSpaceManager.is_mounted("disk1", mounts)
+    #a loop device whose backing file cannot be read counts as mounted
+    assert DiskSpaceManager.is_mounted("disk2", mounts)
+    #something else is mounted at the disk's mount point
+    assert not DiskSpaceManager.is_mounted("disk3", mounts)
+    assert not DiskSpaceManager.is_mounted("disk4", mounts)
+    assert DiskSpaceManager.is_mounted("disk1")
+
+
+def test_update_disks_mounts_only_missing_disks(disk_dirs, monkeypatch):
+    vd_dir, mounts_dir = disk_dirs
+    mounts = _fake_disk(vd_dir, mounts_dir, "disk1", 4096, mounted=True)
+    for disk_id in ["disk2", "disk3", "bad"]:
+        _fake_disk(vd_dir, mounts_dir, disk_id, 4096, mounted=False)
+    (vd_dir / "disk_a-b.iso").write_bytes(b"stray")
+    reads = []
+    monkeypatch.setattr(DiskSpaceManager, "_read_mounts",
+                        classmethod(lambda cls: reads.append(1) or mounts))
+    mounted = []
+    def mount(cls, disk_id):
+        if disk_id == "bad":
+            raise DiskError("mount failed")
+        mounted.append(disk_id)
+    monkeypatch.setattr(DiskSpaceManager, "_mount_disk", classmethod(mount))
+
+    result = DiskSpaceManager.update_disks(max_workers=2)
+    assert sorted(result['mounted']) == ["disk2", "disk3"] == sorted(mounted)
+    assert result['failed'] == {"bad": "mount failed"}
+    #the mount table is read once, not per disk
+    assert reads == [1]
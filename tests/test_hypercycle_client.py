@@ -0,0 +1,372 @@
+import json
+import socket
+import time
+import pytest
+from pyhypercycle_aim.hypercycle_client import HyperCycleClient, WebSocketSession, websocket_call, \
+    client_config
+from pyhypercycle_aim.local_node import LocalNode
+
+PK = "0x" + "42" * 32
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def node():
+    port = _free_port()
+    address = f"127.0.0.1:{port}"
+    server = LocalNode(address=address, verify_signatures=False).start(port=port)
+    yield address
+    server.should_exit = True
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(client_config, "cache_dir", str(tmp_path))
+
+
+@pytest.fixture
+def silent_node():
+    #accepts TCP connections but never answers the websocket handshake
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen()
+        yield "127.0.0.1:%d" % s.getsockname()[1]
+
+
+def test_websocket_partials_acknowledged_by_default(node):
+    gen = HyperCycleClient.call(node, PK, 1, "websocket", "/run", body='{"partials": 3}', timeout=5)
+    partials = []
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            #next() sends nothing back, the client must still acknowledge
+            partials.append(next(gen))
+    assert [p["result"] for p in partials] == [0, 1, 2]
+    assert stop.value.value == {"status": "return", "result": {"partials": 3}}
+
+
+def test_websocket_session_reused_after_acknowledged_call(node):
+    session = WebSocketSession(node, PK, 1, "/run", {"tx-sender": "0x0", "tx-driver": "ethereum"})
+    try:
+        assert session.call('{"partials": 2}', timeout=5)["result"] == {"partials": 2}
+        ws = session._ws
+        assert session.call('{"partials": 1}', timeout=5)["result"] == {"partials": 1}
+        assert session._ws is ws
+    finally:
+        session.close()
+
+
+def test_websocket_session_times_out(silent_node):
+    from websocket import WebSocketTimeoutException
+    session = WebSocketSession(silent_node, PK, 1, "/run", {"isPublic": "True"})
+    start = time.time()
+    with pytest.raises((WebSocketTimeoutException, socket.timeout)):
+        session.call("{}", timeout=(0.5, 0.5))
+    assert time.time() - start < 5
+
+
+def test_websocket_call_times_out(silent_node):
+    from websocket import WebSocketTimeoutException
+    start = time.time()
+    with pytest.raises((WebSocketTimeoutException, socket.timeout)):
+        next(websocket_call(f"ws://{silent_node}/vm/1/run", {}, "{}", timeout=0.5))
+    assert time.time() - start < 5
+
+
+def test_hedge_uses_cached_rankings(monkeypatch):
+    from pyhypercycle_aim.hypercycle_client import NodeDiscovery
+    discovered = []
+
+    def slow_discover(force=False):
+        discovered.append(time.time())
+        time.sleep(2)
+
+    monkeypatch.setattr(NodeDiscovery, "discover", slow_discover)
+    monkeypatch.setattr(NodeDiscovery, "_nodes", {
+        "primary:8000": {"rtt": 0.01, "error_rate": 0.0, "info": None},
+        "backup:8000": {"rtt": 0.02, "error_rate": 0.0, "info": None}})
+    monkeypatch.setattr(NodeDiscovery, "_updated", 0)
+    monkeypatch.setattr(HyperCycleClient, "hedge_delay", 0.05)
+
+    def attempt(node):
+        if node == "primary:8000":
+            time.sleep(1)
+        return node
+
+    start = time.time()
+    assert HyperCycleClient._hedged("primary:8000", 1, attempt) == "backup:8000"
+    assert time.time() - start < 0.5
+    #the stale table is refreshed, but off the call path
+    for _ in range(100):
+        if discovered:
+            break
+        time.sleep(0.01)
+    assert len(discovered) == 1
+
+
+class _ErrorSession:
+    def get(self, url, **kwargs):
+        import requests
+        res = requests.Response()
+        res.status_code = 502
+        res._content = b"<html>Bad Gateway</html>"
+        return res
+
+
+def test_manifest_cache_falls_back_to_cached_copy(node, monkeypatch):
+    import requests
+    from pyhypercycle_aim.hypercycle_client import ManifestCache
+    manifest = ManifestCache.get(node, 1)
+    assert json.loads(manifest)["short_name"] == "echo"
+    monkeypatch.setattr(HyperCycleClient, "_session", classmethod(lambda cls, node: _ErrorSession()))
+    assert ManifestCache.get(node, 1, refresh=True) == manifest
+    with pytest.raises(requests.exceptions.HTTPError):
+        ManifestCache.get(node, 2)
+
+
+
+def test_nonces_unique_when_fetched_concurrently():
+    import concurrent.futures
+    from pyhypercycle_aim.hypercycle_client import NonceManager
+
+    def fetch():
+        time.sleep(0.2)
+        return "5"
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        nonces = list(executor.map(lambda _: NonceManager.allocate("node", "0xabc", fetch), range(8)))
+    #fetches overlap instead of queueing behind the file lock
+    assert time.time() - start < 1
+    assert sorted(int(n) for n in nonces) == list(range(5, 13))
+    assert NonceManager.allocate("node", "0xabc", fetch) == "13"
+
+
+DATA = "héllo wörld\n" * 50000
+
+
+def _body_bytes(body):
+    data = body.data()
+    return data if isinstance(data, (bytes, type(None))) else data.read()
+
+
+@pytest.mark.parametrize("make", [
+    lambda path: DATA,
+    lambda path: DATA.encode(),
+    lambda path: path,
+    lambda path: open(path, "rb"),
+    lambda path: open(path, "r", encoding="utf-8"),
+    lambda path: __import__("io").StringIO(DATA),
+    lambda path: iter([DATA.encode()[i:i+4096] for i in range(0, len(DATA.encode()), 4096)]),
+], ids=["str", "bytes", "path", "binary file", "text file", "StringIO", "bytes iterator"])
+def test_request_body_hashes_every_kind_of_body(tmp_path, make):
+    import hashlib
+    from pathlib import Path
+    from pyhypercycle_aim.hypercycle_client import RequestBody
+    path = Path(tmp_path) / "body.txt"
+    path.write_text(DATA, encoding="utf-8")
+    expected = DATA.encode()
+    body = RequestBody(make(path))
+    try:
+        assert body.size == len(expected)
+        assert body.hexdigest() == hashlib.sha256(expected).hexdigest()
+        assert _body_bytes(body) == expected
+    finally:
+        body.close()
+
+
+def test_text_file_body_uploaded(node, tmp_path):
+    path = tmp_path / "body.txt"
+    path.write_text(DATA, encoding="utf-8")
+    with open(path) as f:
+        res = HyperCycleClient.call(node, PK, 1, "POST", "/echo", body=f)
+    assert json.loads(res)["size"] == len(DATA.encode())
+
+
+class _Output:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(json.loads(line) for line in data.splitlines() if line)
+
+    def flush(self):
+        pass
+
+
+def _batch(monkeypatch, lines, delays, unordered=False, wait_for=None):
+    import argparse
+    import sys
+    from pyhypercycle_aim.hypercycle_client import ClientCLI
+    output = _Output()
+    seen_before_next = []
+
+    class Input:
+        #reading the next line waits until `wait_for` results are written
+        def __iter__(self):
+            for i, line in enumerate(lines):
+                if wait_for is not None and i == wait_for[0]:
+                    deadline = time.time() + 2
+                    while len(output.lines) < wait_for[1] and time.time() < deadline:
+                        time.sleep(0.01)
+                    seen_before_next.append(len(output.lines))
+                yield line
+
+    def call(self, index, request, args):
+        time.sleep(delays.get(request["id"], 0))
+        return {"index": index, "id": request["id"], "ok": True, "elapsed": 0.0}
+
+    monkeypatch.setattr(ClientCLI, "_batch_call", call)
+    monkeypatch.setattr(sys, "stdin", Input())
+    monkeypatch.setattr(sys, "stdout", output)
+    args = argparse.Namespace(input="-", concurrency=4, unordered=unordered)
+    ClientCLI.batch(ClientCLI(), args)
+    return [out.get("id") for out in output.lines], seen_before_next
+
+
+def test_batch_ordered_writes_results_as_soon_as_ready(monkeypatch):
+    lines = [json.dumps({"id": i}) for i in range(6)] + ["not json"]
+    ids, seen = _batch(monkeypatch, lines, {1: 0.2}, wait_for=(3, 1))
+    #the first result was out before more input was read
+    assert seen == [1]
+    assert ids[:6] == list(range(6))
+    assert len(ids) == 7
+
+
+def test_batch_unordered_does_not_wait_for_slow_calls(monkeypatch):
+    lines = [json.dumps({"id": i}) for i in range(4)]
+    ids, seen = _batch(monkeypatch, lines, {0: 0.5}, unordered=True)
+    assert sorted(ids) == [0, 1, 2, 3]
+    assert ids[-1] == 0
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    monkeypatch.setattr(HyperCycleClient, "_sessions", {})
+    yield HyperCycleClient._sessions
+    HyperCycleClient.close()
+
+
+def test_session_pooled_per_node(node, sessions, monkeypatch):
+    monkeypatch.setitem(client_config, "max_connections", 4)
+    session = HyperCycleClient._session(node)
+    assert HyperCycleClient._session(node) is session
+    assert HyperCycleClient._session("other:8000") is not session
+    for _ in range(5):
+        assert HyperCycleClient.node_info(node)
+    pools = session.get_adapter(f"http://{node}").poolmanager.pools
+    pools = [pools[key] for key in pools.keys()]
+    #sequential calls share one keep-alive connection
+    assert [pool.num_connections for pool in pools] == [1]
+    assert pools[0].pool.maxsize == 4
+    HyperCycleClient.close()
+    assert sessions == {}
+    assert HyperCycleClient._session(node) is not session
+
+
+def test_web3_provider_and_account_cached(monkeypatch):
+    from eth_account import Account
+    from eth_account.messages import encode_defunct
+    monkeypatch.setattr(HyperCycleClient, "_web3_providers", {})
+    w3 = HyperCycleClient._web3()
+    assert HyperCycleClient._web3() is w3
+    monkeypatch.setitem(client_config, "rpc_provider", "http://127.0.0.1:1")
+    assert HyperCycleClient._web3() is not w3
+
+    account = HyperCycleClient._account(PK)
+    assert HyperCycleClient._account(PK) is account
+    assert account.address == Account.from_key(PK).address
+    signature = HyperCycleClient.sign_message("hello", account.address, PK)
+    assert Account.recover_message(encode_defunct(text="hello"), signature=signature) == account.address
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    from pyhypercycle_aim.hypercycle_client import NodeDiscovery
+    monkeypatch.setattr(NodeDiscovery, "_nodes", {})
+    #a fresh table, so ranking does not start discovery
+    monkeypatch.setattr(NodeDiscovery, "_updated", time.time())
+    monkeypatch.setattr(NodeDiscovery, "decay", 0.5)
+    return NodeDiscovery
+
+
+def test_node_ranking(discovery):
+    discovery.record("slow:1", rtt=0.2, info={"aims": [{"slot": 1, "name": "echo"}]})
+    discovery.record("slow:1", rtt=0.1)
+    #fastest, but fails half the time
+    discovery.record("flaky:1", rtt=0.1, info={"aims": {"1": {"name": "echo"}}})
+    discovery.record("flaky:1", error=True)
+    discovery.record("fast:1", rtt=0.05, info={"aims": [2]})
+    discovery.record("unknown:1", rtt=0.01)
+    discovery.record("down:1", error=True)
+
+    #moving averages of the samples
+    assert discovery._nodes["slow:1"]["rtt"] == pytest.approx(0.15)
+    assert discovery._nodes["flaky:1"]["error_rate"] == pytest.approx(0.5)
+    assert discovery._score(discovery._nodes["flaky:1"]) == pytest.approx(0.2)
+
+    #nodes that never answered are left out, those not listing their aims serve any
+    assert discovery.ranked_nodes() == ["unknown:1", "fast:1", "slow:1", "flaky:1"]
+    assert discovery.ranked_nodes(1) == ["unknown:1", "slow:1", "flaky:1"]
+    assert discovery.ranked_nodes("echo") == ["unknown:1", "slow:1", "flaky:1"]
+    assert discovery.ranked_nodes(2, cached=True) == ["unknown:1", "fast:1"]
+    assert discovery.best_node(3) == "unknown:1"
+
+    #a node that starts failing drops behind slower ones
+    for _ in range(5):
+        discovery.record("unknown:1", error=True)
+    assert discovery.ranked_nodes(1) == ["slow:1", "flaky:1", "unknown:1"]
+    assert discovery.best_node(1) == "slow:1"
+
+
+def test_node_discovery_probes_seed_nodes(node, discovery, monkeypatch):
+    monkeypatch.setitem(client_config, "seed_hosts", [node])
+    gone, flaky = "127.0.0.1:1", "127.0.0.1:2"
+    discovery._nodes[gone] = {"rtt": 0.01, "error_rate": 0.95, "info": None}
+    discovery._nodes[flaky] = {"rtt": None, "error_rate": 0.2, "info": None}
+
+    discovery.discover(force=True)
+    assert discovery._nodes[node]["rtt"] > 0
+    assert discovery._nodes[node]["info"]["aims"][0]["name"] == "echo"
+    #unlisted nodes are dropped once they keep failing
+    assert gone not in discovery._nodes
+    assert discovery._nodes[flaky]["error_rate"] == pytest.approx(0.6)
+    assert discovery.ranked_nodes("echo") == [node]
+    assert discovery.ranked_nodes("other") == []
+
+    #the table is shared with other processes through the cache
+    monkeypatch.setattr(discovery, "_nodes", {})
+    monkeypatch.setattr(discovery, "_updated", 0)
+    discovery._load()
+    assert sorted(discovery._nodes) == sorted([node, flaky])
+
+
+def test_batch_runs_file_against_node(node, tmp_path, capsys, monkeypatch):
+    from pyhypercycle_aim.hypercycle_client import ClientCLI
+    monkeypatch.setitem(client_config, "max_connections", 2)
+    requests_path = tmp_path / "requests.jsonl"
+    lines = [{"id": i, "aim_slot": 1, "method": "POST", "uri": "/echo", "body": "x" * i} for i in range(20)]
+    lines.insert(5, {"id": "no-slot", "method": "GET", "uri": "/echo"})
+    requests_path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n")
+
+    cli = ClientCLI()
+    args = cli.parser.parse_args(["batch", str(requests_path), "--node", node, "--pk", PK,
+                                  "--concurrency", "4"])
+    args.func(args)
+    out, err = capsys.readouterr()
+    results = [json.loads(line) for line in out.splitlines()]
+    assert [r["id"] for r in results] == [line["id"] for line in lines]
+    assert [r["index"] for r in results] == list(range(21))
+    for r in results:
+        if r["id"] == "no-slot":
+            assert not r["ok"] and r["error"].startswith("KeyError")
+        else:
+            assert r["ok"] and r["result"]["size"] == r["id"]
+    assert err.startswith("21 requests, 1 failed in ")
+    assert "p50" in err and "p99" in err
+    #the connection pools were sized for the concurrency
+    assert client_config["max_connections"] == 4
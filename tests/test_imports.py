@@ -0,0 +1,40 @@
+import sys
+import json
+import subprocess
+import pytest
+import pyhypercycle_aim
+
+
+def _modules_after(code):
+    #a fresh interpreter, as this one already imported whatever other tests use
+    script = f"{code}\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))"
+    out = subprocess.check_output([sys.executable, "-c", script])
+    return set(json.loads(out))
+
+
+def test_package_import_loads_no_submodules():
+    modules = _modules_after("import pyhypercycle_aim")
+    assert [m for m in modules if m.startswith("pyhypercycle_aim.")] == []
+    for heavy in ["starlette", "web3", "filelock", "uvicorn", "requests"]:
+        assert heavy not in modules
+
+
+def test_name_import_loads_only_its_submodule():
+    modules = _modules_after("from pyhypercycle_aim import StorageManager")
+    assert "pyhypercycle_aim.storage" in modules
+    for other in ["servers", "util", "subscription", "disks", "ssh_port_manager"]:
+        assert f"pyhypercycle_aim.{other}" not in modules
+    assert "starlette" not in modules
+
+
+def test_exported_names_resolve():
+    for name in pyhypercycle_aim.__all__:
+        assert getattr(pyhypercycle_aim, name) is not None
+        assert name in dir(pyhypercycle_aim)
+
+
+def test_unknown_name_raises_attribute_error():
+    with pytest.raises(AttributeError):
+        pyhypercycle_aim.NoSuchThing
+    with pytest.raises(ImportError):
+        from pyhypercycle_aim import NoSuchThing
@@ -0,0 +1,112 @@
+import json
+import socket
+import pytest
+import requests
+from pyhypercycle_aim.hypercycle_client import HyperCycleClient, RequestBody, client_config
+from pyhypercycle_aim.local_node import LocalNode
+
+PK = "0x" + "42" * 32
+OTHER_PK = "0x" + "17" * 32
+
+
+@pytest.fixture(scope="module")
+def node():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    address = f"127.0.0.1:{port}"
+    server = LocalNode(address=address, peers=["peer:8000"]).start(port=port)
+    yield address
+    server.should_exit = True
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(client_config, "cache_dir", str(tmp_path))
+
+
+def _signed(node, uri, body, pk=PK, sender=None):
+    sender = sender or HyperCycleClient._account(PK).address
+    base_headers = HyperCycleClient._base_headers(sender, None, "ethereum", "2", False, False)
+    return HyperCycleClient._sign_headers(node, sender, pk, "POST", uri, base_headers,
+                                          RequestBody(body), "2")
+
+
+def test_public_endpoints(node):
+    assert requests.get(f"http://{node}/nodes").json() == {"nodes": [node, "peer:8000"]}
+    assert HyperCycleClient.node_info(node)["aims"] == [{"slot": 1, "name": "echo", "version": "1.0"}]
+    sender = HyperCycleClient._account(PK).address
+    res = requests.post(f"http://{node}/balance", headers={"tx-sender": sender, "tx-id": "0x1"})
+    assert res.json()["balance"]["USDC"] > 0
+
+
+def test_signed_calls_accepted_and_nonces_advance(node):
+    sender = HyperCycleClient._account(PK).address
+    first = int(HyperCycleClient._fetch_nonce(node, sender))
+    res = json.loads(HyperCycleClient.call(node, PK, 1, "POST", "/echo?x=1", body="abc"))
+    assert res == {"method": "POST", "uri": "/echo", "size": 3}
+    assert json.loads(HyperCycleClient.call(node, PK, 1, "POST", "/echo", body={"a": 1}))["size"] == 8
+    assert int(HyperCycleClient._fetch_nonce(node, sender)) == first + 2
+    cost = json.loads(HyperCycleClient.call(node, PK, 1, "POST", "/echo", body="abc", cost_only=True))
+    assert cost["cost"]
+
+
+def test_replayed_call_rejected(node):
+    headers = _signed(node, "/aim/1/echo", b"abc")
+    res = requests.post(f"http://{node}/aim/1/echo", headers=headers, data=b"abc")
+    assert res.status_code == 200
+    res = requests.post(f"http://{node}/aim/1/echo", headers=headers, data=b"abc")
+    assert res.status_code == 403 and "nonce" in res.json()["error"]
+
+
+def test_bad_signatures_rejected(node):
+    #signed by another key
+    headers = _signed(node, "/aim/1/echo", b"abc", pk=OTHER_PK)
+    res = requests.post(f"http://{node}/aim/1/echo", headers=headers, data=b"abc")
+    assert res.status_code == 403 and res.json()["error"] == "Invalid signature"
+    #body changed after signing
+    headers = _signed(node, "/aim/1/echo", b"abc")
+    res = requests.post(f"http://{node}/aim/1/echo", headers=headers, data=b"abd")
+    assert res.status_code == 403 and res.json()["error"] == "Invalid signature"
+    #unsigned
+    res = requests.post(f"http://{node}/aim/1/echo", data=b"abc")
+    assert res.status_code == 403
+
+
+def test_signed_websocket_call(node):
+    gen = HyperCycleClient.call(node, PK, 1, "websocket", "/run", body='{"partials": 2}', timeout=5)
+    partials = []
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            partials.append(next(gen))
+    assert len(partials) == 2
+    assert stop.value.value["result"] == {"partials": 2}
+
+
+def test_manifest_etag(node):
+    res = requests.get(f"http://{node}/aim/1/manifest.json")
+    assert res.status_code == 200 and res.json()["short_name"] == "echo"
+    etag = res.headers["ETag"]
+    res = requests.get(f"http://{node}/aim/1/manifest.json", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert requests.get(f"http://{node}/aim/2/manifest.json").status_code == 404
+
+
+@pytest.mark.parametrize("make", [
+    lambda path: path,
+    lambda path: open(path, "rb"),
+    lambda path: iter([path.read_bytes()[i:i+65536] for i in range(0, path.stat().st_size, 65536)]),
+], ids=["path", "binary file", "bytes iterator"])
+def test_signed_streaming_upload(node, tmp_path, capsys, make):
+    path = tmp_path / "dataset.bin"
+    path.write_bytes(b"dataset-marker" + bytes(range(256)) * 8192)
+    body = make(path)
+    try:
+        #the node checks the signature over the body hash computed while streaming
+        res = json.loads(HyperCycleClient.call(node, PK, 1, "POST", "/echo", body=body))
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    assert res["size"] == path.stat().st_size
+    #nothing of the body is printed while signing
+    assert "dataset-marker" not in capsys.readouterr().out
@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from pathlib import Path
+from pyhypercycle_aim import sharding
+from pyhypercycle_aim.append_log import AppendLog
+from pyhypercycle_aim.storage import StorageManager
+
+KEY_HASH = hashlib.sha256(b"key").hexdigest()
+
+
+def _increment(base, count):
+    for _ in range(count):
+        with sharding.stripe_lock(base, KEY_HASH):
+            path = os.path.join(base, "counter")
+            with open(path) as f:
+                value = int(f.read())
+            with open(path, "w") as f:
+                f.write(str(value + 1))
+
+
+def _append(log, worker, count):
+    for i in range(count):
+        log.append([{"worker": worker, "i": i}])
+
+
+def _run_forked(target, args_list):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=target, args=args) for args in args_list]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+        assert p.exitcode == 0
+
+
+def test_stripe_lock_after_fork(tmp_path):
+    base = str(tmp_path)
+    with open(os.path.join(base, "counter"), "w") as f:
+        f.write("0")
+    #populate the parent's lock cache before forking
+    _increment(base, 1)
+    _run_forked(_increment, [(base, 50)] * 4)
+    with open(os.path.join(base, "counter")) as f:
+        assert int(f.read()) == 201
+
+
+def test_append_log_after_fork(tmp_path):
+    path = tmp_path / "log.jsonl"
+    log = AppendLog(path)
+    log.append([{"worker": -1, "i": 0}])
+    _run_forked(_append, [(log, w, 50) for w in range(4)])
+    log.append([{"worker": -1, "i": 1}])
+    reset, records = log.read_new()
+    assert len(records) == 202
+    for w in range(4):
+        assert [r["i"] for r in records if r["worker"] == w] == list(range(50))
+
+
+def _hash(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_migrate_flat_layout(tmp_path):
+    a, b, c = _hash("a"), _hash("b"), _hash("c")
+    _write(tmp_path / f"{a}.json", "a")
+    _write(tmp_path / f"{a}.lock", "")
+    #a sharded copy already exists, so the flat one is stale
+    _write(tmp_path / f"{b}.json", "old")
+    _write(sharding.shard_path(tmp_path, b), "new")
+    _write(tmp_path / "_index.log", "")
+    _write(tmp_path / f"{c}.txt", "c")
+
+    assert sharding.migrate_flat_layout(tmp_path) == 1
+    assert sharding.shard_path(tmp_path, a).read_text() == "a"
+    assert sharding.shard_path(tmp_path, b).read_text() == "new"
+    assert not (tmp_path / f"{a}.json").exists()
+    assert not (tmp_path / f"{a}.lock").exists()
+    assert not (tmp_path / f"{b}.json").exists()
+    #files that are not flat key files are left alone
+    assert (tmp_path / "_index.log").exists()
+    assert (tmp_path / f"{c}.txt").exists()
+    assert sorted(sharding.iter_shard_files(tmp_path)) == \
+        sorted([sharding.shard_path(tmp_path, a), sharding.shard_path(tmp_path, b)])
+
+
+def test_resolve_shard_path_moves_legacy_file(tmp_path):
+    a = _hash("a")
+    _write(tmp_path / f"{a}.json", "a")
+    assert list(sharding.iter_shard_files(tmp_path)) == [tmp_path / f"{a}.json"]
+    path = sharding.resolve_shard_path(tmp_path, a)
+    assert path == sharding.shard_path(tmp_path, a)
+    assert path.read_text() == "a"
+    assert not (tmp_path / f"{a}.json").exists()
+    #nothing to move for a new key
+    assert not sharding.resolve_shard_path(tmp_path, _hash("b")).exists()
+
+
+def test_storage_reads_and_migrates_flat_layout(tmp_path, monkeypatch):
+    monkeypatch.setattr(StorageManager, "_storage_dir", Path(tmp_path))
+    monkeypatch.setattr(StorageManager, "_index_log", None)
+    for key in ["a", "b"]:
+        _write(tmp_path / f"{_hash(key)}.json", json.dumps({"_original_key": key, "v": key}))
+
+    #first access of a key moves its file lazily
+    assert StorageManager.get("a", "v") == "a"
+    assert sharding.shard_path(tmp_path, _hash("a")).exists()
+    assert (tmp_path / f"{_hash('b')}.json").exists()
+    assert StorageManager.keys() == ["a", "b"]
+
+    migrator = StorageManager.migrate_layout()
+    migrator.join(30)
+    assert migrator.error is None and migrator.moved == 1
+    assert sharding.shard_path(tmp_path, _hash("b")).exists()
+    assert StorageManager.get("b", "v") == "b"
@@ -0,0 +1,67 @@
+import os
+import time
+from pathlib import Path
+import pytest
+from pyhypercycle_aim.storage import StorageManager
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(StorageManager, "_storage_dir", Path(tmp_path))
+    monkeypatch.setattr(StorageManager, "_index_log", None)
+    return StorageManager
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_blob_roundtrip(storage):
+    ref = storage.store_blob("k", "data", b"hello")
+    assert ref["size"] == 5
+    assert bytes(storage.get_blob("k", "data")) == b"hello"
+    assert storage.get("k", "data") == ref
+    assert storage.get_blob("k", "missing", default=1) == 1
+    storage.store_blob("k", "empty", b"")
+    assert bytes(storage.get_blob("k", "empty")) == b""
+
+
+def test_gc_keeps_blob_while_any_key_references_it(storage):
+    ref = storage.store_blob("a", "data", b"shared")
+    storage.store_blob("b", "data", b"shared")
+    path = storage._blob_path(ref["_blob"])
+    _age(path, 7200)
+
+    storage.delete("a", "data")
+    assert storage.gc_blobs(grace=60) == 0
+    assert path.exists()
+
+    storage.delete("b", "data")
+    assert storage.gc_blobs(grace=60) == 1
+    assert not path.exists()
+
+
+def test_gc_keeps_unreferenced_blob_within_grace(storage):
+    ref = storage.store_blob("a", "data", b"fresh")
+    storage.delete("a", "data")
+    path = storage._blob_path(ref["_blob"])
+
+    assert storage.gc_blobs(grace=3600) == 0
+    assert path.exists()
+    _age(path, 7200)
+    assert storage.gc_blobs(grace=3600) == 1
+    assert not path.exists()
+
+
+def test_storing_existing_blob_restarts_grace(storage):
+    ref = storage.store_blob("a", "data", b"again")
+    storage.delete("a", "data")
+    path = storage._blob_path(ref["_blob"])
+    _age(path, 7200)
+
+    #a writer about to reference the blob again refreshes its mtime
+    storage.store_blob("b", "data", b"again")
+    storage.delete("b", "data")
+    assert storage.gc_blobs(grace=3600) == 0
+    assert path.exists()
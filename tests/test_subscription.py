@@ -0,0 +1,138 @@
+import time
+import multiprocessing
+import threading
+import pytest
+from pyhypercycle_aim.subscription import SubscriptionManager
+
+DAY = 24*60*60
+
+
+@pytest.fixture
+def subscriptions(tmp_path, monkeypatch):
+    monkeypatch.setattr(SubscriptionManager, "_subscription_dir", str(tmp_path))
+    monkeypatch.setattr(SubscriptionManager, "_index", {})
+    monkeypatch.setattr(SubscriptionManager, "_index_state", {"log": None, "records": 0, "sorted": None})
+    monkeypatch.setattr(SubscriptionManager, "_index_mutex", threading.Lock())
+    monkeypatch.setattr(SubscriptionManager, "_access_cache", {})
+    monkeypatch.setattr(SubscriptionManager, "_expiry_heap", [])
+    monkeypatch.setattr(SubscriptionManager, "_expiry_deadlines", {})
+    return SubscriptionManager
+
+
+def _add(count):
+    for _ in range(count):
+        SubscriptionManager.add_subscription("shared", days=1)
+
+
+def _renew(keys, count):
+    for _ in range(count):
+        SubscriptionManager.renew_many(keys, days=1)
+
+
+def _run_forked(target, args_list):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=target, args=args) for args in args_list]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+
+def test_concurrent_add_subscription(subscriptions):
+    start = time.time()
+    subscriptions.add_subscription("shared", days=1)
+    assert subscriptions.is_active("shared")
+    _run_forked(_add, [(25,)] * 4)
+    data = subscriptions.get_subscription("shared")
+    #no renewal was lost to a concurrent writer
+    assert data['version'] == 101
+    assert start + 101*DAY <= data['deadline'] <= time.time() + 101*DAY
+    #the parent's index picked up the other processes' writes
+    assert subscriptions.get_deadline("shared") == data['deadline']
+
+
+def test_concurrent_renew_many(subscriptions):
+    keys = [f"user{i}" for i in range(40)]
+    subscriptions.renew_many(keys, days=1)
+    _run_forked(_renew, [(keys, 10), (keys[::-1], 10), (keys[::2], 10)])
+    for i, key in enumerate(keys):
+        renewals = 21 + (10 if i % 2 == 0 else 0)
+        data = subscriptions.get_subscription(key)
+        assert data['version'] == renewals
+        assert subscriptions.get_deadline(key) == data['deadline']
+        assert subscriptions.remaining(key) > (renewals - 1)*DAY
+
+
+def test_close_deadlines_dispatched_as_one_batch(subscriptions, monkeypatch):
+    import asyncio
+    batches = []
+
+    class Recorder(SubscriptionManager):
+        @classmethod
+        def remove_batch_callback(cls, keys):
+            batches.append(sorted(keys))
+
+    monkeypatch.setattr(SubscriptionManager, "expiry_batch_window", 0.1)
+    for i in range(5):
+        Recorder.add_subscription(f"user{i}", seconds=0.3 + i*0.01)
+
+    async def run():
+        task = asyncio.create_task(Recorder.subscription_loop())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if batches:
+                break
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    assert batches == [[f"user{i}" for i in range(5)]]
+    assert not any(subscriptions.is_active(f"user{i}") for i in range(5))
+
+
+def test_renewal_supersedes_scheduled_deadline(subscriptions):
+    now = time.time()
+    subscriptions.add_subscription("a", seconds=10)
+    subscriptions.add_subscription("b", seconds=15)
+    subscriptions.add_subscription("a", seconds=10)
+    deadline = subscriptions.get_deadline("a")
+    assert now + 20 <= deadline <= time.time() + 20
+    #the stale 10s entry for "a" is skipped
+    assert subscriptions._next_expiry() == subscriptions.get_deadline("b")
+    assert subscriptions._pop_due_expiries(now + 12) == ([], None)
+    assert subscriptions._pop_due_expiries(now + 17)[0] == ["b"]
+    assert subscriptions._pop_due_expiries(deadline) == (["a"], deadline)
+    assert subscriptions._next_expiry() is None
+
+
+def test_due_expiries_batched_within_window(subscriptions, monkeypatch):
+    monkeypatch.setattr(SubscriptionManager, "expiry_batch_window", 1)
+    subscriptions._schedule_expiry("a", 100)
+    subscriptions._schedule_expiry("b", 100.5)
+    subscriptions._schedule_expiry("c", 102)
+    #nothing is popped before the first deadline
+    assert subscriptions._pop_due_expiries(99.9) == ([], None)
+    assert subscriptions._pop_due_expiries(100) == (["a", "b"], 100.5)
+    assert subscriptions._next_expiry() == 102
+
+
+def test_removed_subscription_unscheduled(subscriptions):
+    subscriptions.add_subscription("a", seconds=10)
+    subscriptions.remove_subscription("a")
+    assert subscriptions._next_expiry() is None
+    assert subscriptions._pop_due_expiries(time.time() + 60) == ([], None)
+
+
+def test_rebuild_expiry_schedule_from_index(subscriptions):
+    subscriptions.add_subscription("a", seconds=10)
+    subscriptions.add_subscription("b", seconds=20, delete_on_expire=False)
+    data = subscriptions.get_subscription("b")
+    data['expired'] = True
+    subscriptions.save_subscription(data)
+    #a fresh process starts with an empty schedule
+    subscriptions._expiry_heap.clear()
+    subscriptions._expiry_deadlines.clear()
+    subscriptions.rebuild_expiry_schedule()
+    assert subscriptions._expiry_deadlines == {"a": subscriptions.get_deadline("a")}
+    assert subscriptions._next_expiry() == subscriptions.get_deadline("a")
@@ -0,0 +1,49 @@
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from pyhypercycle_aim.util import aim_uri, JSONResponseCORS
+
+
+class NoSubscriptions:
+    @classmethod
+    def has_access(cls, key):
+        return False
+
+
+@aim_uri(uri="/model", methods=["GET"], endpoint_manifest={"documentation": "test"},
+         requires_subscription=True, subscription_manager=NoSubscriptions)
+async def model(request):
+    #ignores cost_only on purpose
+    return JSONResponseCORS({"output": "full content"})
+
+
+def _client():
+    return TestClient(Starlette(routes=[Route("/model", model, methods=["GET"])]))
+
+
+def test_unsubscribed_user_is_denied():
+    res = _client().get("/model", headers={"hypc_user": "0xabc"})
+    assert res.status_code == 403
+
+
+def test_cost_only_does_not_bypass_subscription():
+    for header in ["cost_only", "cost-only"]:
+        res = _client().get("/model", headers={"hypc_user": "0xabc", header: "1"})
+        assert res.status_code == 403
+        assert "full content" not in res.text
+
+
+def test_manifest_served_with_etag():
+    from pyhypercycle_aim.servers import SimpleServer
+
+    class Server(SimpleServer):
+        manifest = {"name": "Test", "short_name": "test", "version": "1.0"}
+
+    server = Server()
+    server.build_app(debug=False)
+    client = TestClient(server.app)
+    res = client.get("/manifest.json")
+    assert res.status_code == 200
+    assert res.headers["etag"] == server.manifest_etag
+    res = client.get("/manifest.json", headers={"If-None-Match": server.manifest_etag})
+    assert res.status_code == 304